@@ -0,0 +1,98 @@
+"""Microbenchmark: parsing streamed chat completions.
+
+Compares the openai client's path (`OpenAIObject`s, what `transport` returns by
+default) with `sse.iter_chunks` (`--lean-stream`) on recorded streams, and
+reports the time per chunk. Both read the stream in the same block size.
+
+    python benchmarks/bench_sse.py [STREAM.sse ...] [--repeat N]
+
+Streams are raw response bodies (`data: {...}` events); by default the ones in
+`benchmarks/streams/` are used.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import pathlib
+import time
+from typing import Callable, Iterable
+
+import requests
+from openai import util
+from openai.api_requestor import APIRequestor
+
+from gpt_cli import sse
+
+STREAMS_DIR = pathlib.Path(__file__).parent / "streams"
+BLOCK_SIZE = 512  # what `requests.Response.iter_lines` reads at a time
+
+
+def make_response(body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "text/event-stream"
+    response.raw = io.BytesIO(body)
+    return response
+
+
+def openai_path(body: bytes) -> Iterable:
+    requestor = APIRequestor(key="sk-bench")
+    lines, _ = requestor._interpret_response(make_response(body), stream=True)
+    return (
+        util.convert_to_openai_object(line, requestor.api_key, requestor.api_version)
+        for line in lines
+    )
+
+
+def lean_path(body: bytes) -> Iterable:
+    return sse.iter_chunks(make_response(body).iter_content(chunk_size=BLOCK_SIZE))
+
+
+def consume(chunks: Iterable) -> str:
+    "Read the chunks the way `Chat` does."
+    parts = []
+    for chunk in chunks:
+        for choice in chunk.choices:
+            content = choice.get("delta", {}).get("content")
+            if content:
+                parts.append(content)
+    return "".join(parts)
+
+
+def best_time(parse: Callable[[bytes], Iterable], body: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        consume(parse(body))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("streams", nargs="*", type=pathlib.Path)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    for path in args.streams or sorted(STREAMS_DIR.glob("*.sse")):
+        body = path.read_bytes()
+        reply = consume(openai_path(body))
+        if consume(lean_path(body)) != reply:
+            raise SystemExit(f"{path.name}: the parsers disagree")
+        n_chunks = sum(1 for _ in lean_path(body))
+
+        print(f"{path.name}: {n_chunks:,d} chunks, {len(body):,d} bytes")
+        times = {
+            name: best_time(parse, body, args.repeat)
+            for name, parse in (("openai", openai_path), ("lean", lean_path))
+        }
+        for name, seconds in times.items():
+            print(
+                f"  {name:<8}{seconds / n_chunks * 1e6:8.2f} µs/chunk"
+                f"{times['openai'] / seconds:8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
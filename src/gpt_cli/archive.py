@@ -0,0 +1,147 @@
+"""Compressed transcript archives with a random-access index.
+
+Layout of a `.gptz` file:
+
+    MAGIC | block | block | ... | index | footer
+
+Each block is a zlib-compressed JSON list of messages. The index (also
+zlib-compressed JSON) lists the blocks and, for every message, its block, role
+and token count. The fixed-size footer points to the index, so a reader can
+pick the messages that fit into the context window and decompress only the
+blocks that hold them.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import struct
+import zlib
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .message import Message
+from .model import OpenAiModel
+from .tokens import encoding_name
+
+MAGIC = b"GPTCLIZ1"
+SUFFIX = ".gptz"
+BLOCK_SIZE = 64 * 1024  # uncompressed bytes per block
+_FOOTER = struct.Struct(f"<QQ{len(MAGIC)}s")
+
+
+def is_archive(filepath: str) -> bool:
+    try:
+        with open(filepath, "rb") as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_archive(filepath: str, system: Message, messages: Iterable[Message]):
+    index: Dict[str, Any] = {
+        "model": system.model.name.value,
+        # Token counts are only valid for readers with the same encoding
+        "encoding": encoding_name(system.model.name),
+        "system": system.to_record() if system.content is not None else None,
+        "system_tokens": system.n_tokens,
+        "blocks": [],
+        "messages": [],
+    }
+
+    tmp_filepath = f"{filepath}.tmp"
+    with open(tmp_filepath, "wb") as file:
+        file.write(MAGIC)
+
+        block: List[Dict[str, Any]] = []
+        block_size = 0
+
+        def flush():
+            nonlocal block, block_size
+            if not block:
+                return
+            data = zlib.compress(json.dumps(block).encode())
+            index["blocks"].append({"offset": file.tell(), "length": len(data)})
+            file.write(data)
+            block, block_size = [], 0
+
+        for message in messages:
+            record = message.to_record()
+            index["messages"].append(
+                {
+                    "block": len(index["blocks"]),
+                    "position": len(block),
+                    "role": message.role.value,
+                    "n_tokens": message.n_tokens,
+                }
+            )
+            block.append(record)
+            block_size += len(record["content"])
+            if block_size >= BLOCK_SIZE:
+                flush()
+        flush()
+
+        index_data = zlib.compress(json.dumps(index).encode())
+        index_offset = file.tell()
+        file.write(index_data)
+        file.write(_FOOTER.pack(index_offset, len(index_data), MAGIC))
+
+    os.replace(tmp_filepath, filepath)
+
+
+def read_index(filepath: str) -> Dict[str, Any]:
+    with open(filepath, "rb") as file:
+        file.seek(-_FOOTER.size, 2)
+        index_offset, index_length, magic = _FOOTER.unpack(file.read(_FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{filepath} is not a gpt-cli archive.")
+        file.seek(index_offset)
+        return json.loads(zlib.decompress(file.read(index_length)))
+
+
+def read_archive(
+    filepath: str, model: OpenAiModel, max_tokens: int | None = None
+) -> Tuple[str | None, List[Message]]:
+    """Read the system message and the messages of an archive.
+
+    With `max_tokens`, only the newest messages that fit into that many tokens
+    (together with the system message) are read, using the token counts stored
+    in the index.
+    """
+    index = read_index(filepath)
+    entries = index["messages"]
+    counts_valid = index.get("encoding") == encoding_name(model.name)
+
+    first = 0
+    if max_tokens is not None and counts_valid:
+        n_tokens = index["system_tokens"]
+        first = len(entries)
+        while first > 0 and n_tokens + entries[first - 1]["n_tokens"] <= max_tokens:
+            first -= 1
+            n_tokens += entries[first]["n_tokens"]
+
+    # Messages are read in order, so only one decompressed block is kept
+    block_id, block = -1, []
+    messages = []
+    with open(filepath, "rb") as file:
+        for entry in entries[first:]:
+            if entry["block"] != block_id:
+                block_id = entry["block"]
+                file.seek(index["blocks"][block_id]["offset"])
+                data = file.read(index["blocks"][block_id]["length"])
+                block = json.loads(zlib.decompress(data))
+            record = block[entry["position"]]
+            message = Message.from_record(record, model)
+            if counts_valid:
+                message.set_n_tokens(entry["n_tokens"])
+            messages.append(message)
+
+    system = index["system"]["content"] if index["system"] else None
+    if max_tokens is not None and not counts_valid:
+        # Counted with another encoding: count again, then keep the tail
+        n_tokens = Message.count_tokens(system, model.name)
+        first = len(messages)
+        while first > 0 and n_tokens + messages[first - 1].n_tokens <= max_tokens:
+            first -= 1
+            n_tokens += messages[first].n_tokens
+        messages = messages[first:]
+    return system, messages
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque
+
+from .model import OpenAiModel
+
+
+@dataclass
+class TokenBudget:
+    context_tokens: int
+    output_tokens: int
+    history_tokens: int
+
+    def __str__(self) -> str:
+        return (
+            f"Token budget: {self.context_tokens:,d} context "
+            f"(of {self.history_tokens:,d} in history) + "
+            f"{self.output_tokens:,d} output."
+        )
+
+
+class TokenBudgetPlanner:
+    """Split the model's window between context and output on every turn.
+
+    Instead of always reserving the model's maximum output, the output
+    allowance follows the length of recent replies (with some headroom), and
+    whatever is left of the window goes to the conversation history. The
+    configured (or model) limits are never exceeded.
+    """
+
+    def __init__(
+        self,
+        model: OpenAiModel,
+        max_context_tokens: int | None = None,
+        max_output_tokens: int | None = None,
+        min_output_tokens: int = 1_024,
+        initial_output_tokens: int = 4_096,
+        headroom: float = 2.0,
+        n_recent_replies: int = 8,
+    ):
+        self.model = model
+        self.max_context_tokens = min(
+            max_context_tokens or model.max_context_tokens, model.max_context_tokens
+        )
+        self.max_output_tokens = min(
+            max_output_tokens or model.max_output_tokens, model.max_output_tokens
+        )
+        self.min_output_tokens = min(min_output_tokens, self.max_output_tokens)
+        self.initial_output_tokens = initial_output_tokens
+        self.headroom = headroom
+        self.recent_replies: Deque[int] = deque(maxlen=n_recent_replies)
+
+    def observe(self, reply_tokens: int):
+        "Record the length of a reply, so that the next plans can follow it."
+        self.recent_replies.append(reply_tokens)
+
+    def expected_output_tokens(self) -> int:
+        if self.recent_replies:
+            expected = int(self.headroom * max(self.recent_replies))
+        else:
+            expected = self.initial_output_tokens
+        return max(self.min_output_tokens, min(expected, self.max_output_tokens))
+
+    def plan(self, history_tokens: int) -> TokenBudget:
+        window = self.model.max_context_tokens
+        output_tokens = self.expected_output_tokens()
+        context_tokens = min(
+            history_tokens, self.max_context_tokens, window - output_tokens
+        )
+        if context_tokens < min(history_tokens, self.max_context_tokens):
+            # History does not fit: it wins over output headroom, down to the minimum
+            context_tokens = min(
+                history_tokens,
+                self.max_context_tokens,
+                window - self.min_output_tokens,
+            )
+            output_tokens = max(self.min_output_tokens, window - context_tokens)
+        return TokenBudget(
+            context_tokens=context_tokens,
+            output_tokens=output_tokens,
+            history_tokens=history_tokens,
+        )
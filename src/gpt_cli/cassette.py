@@ -0,0 +1,156 @@
+"""Record API traffic to a cassette and replay it offline.
+
+A cassette is a JSON lines file with one interaction per line: the request
+(without credentials), and either the response, or the streamed chunks with
+the seconds elapsed before each one, plus the error the request ended with,
+if any. Replaying returns the same objects as the API client through the same
+`create_completion` interface, at the recorded pace or as fast as possible.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List
+
+import openai
+from openai.util import convert_to_openai_object
+
+from .trace import span
+
+# Not part of what is asked, so recordings neither leak them nor depend on them
+_UNMATCHED_PARAMS = (
+    "api_key",
+    "api_base",
+    "organization",
+    "request_timeout",
+    "headers",
+    "lean_stream",
+)
+
+
+class CassetteError(Exception):
+    pass
+
+
+def _request_key(params: Dict[str, Any]) -> str:
+    request = {k: v for k, v in params.items() if k not in _UNMATCHED_PARAMS}
+    return json.dumps(request, sort_keys=True, default=str)
+
+
+def _to_dict(response: Any) -> Any:
+    return response.to_dict_recursive()
+
+
+def _error(e: Exception) -> Dict[str, Any]:
+    return {
+        "type": type(e).__name__,
+        "message": str(e),
+        "http_status": getattr(e, "http_status", None),
+    }
+
+
+def _to_exception(error: Dict[str, Any]) -> Exception:
+    # Raised as their own types, so retries behave as they did when recording
+    error_class = getattr(openai.error, error["type"], None)
+    if isinstance(error_class, type) and issubclass(
+        error_class, openai.error.OpenAIError
+    ):
+        return error_class(error["message"], http_status=error["http_status"])
+    return CassetteError(f"{error['type']}: {error['message']}")
+
+
+class Recorder:
+    "Wrap `create_completion` so that every interaction is appended to a cassette."
+
+    def __init__(self, filepath: str, create_completion: Callable):
+        self.filepath = filepath
+        self.create_completion = create_completion
+        self._lock = threading.Lock()
+        open(filepath, "w").close()  # a new recording replaces the old one
+
+    def __call__(self, **params):
+        interaction: Dict[str, Any] = {"request": json.loads(_request_key(params))}
+        start = time.monotonic()
+        try:
+            response = self.create_completion(**params)
+        except Exception as e:
+            interaction["error"] = _error(e)
+            self._write(interaction)
+            raise
+        if not params.get("stream"):
+            interaction["response"] = _to_dict(response)
+            self._write(interaction)
+            return response
+        return self._record_stream(interaction, response, start)
+
+    def _record_stream(self, interaction: Dict[str, Any], stream, start: float):
+        chunks: List[Any] = []
+        interaction["chunks"] = chunks
+        last = start
+        try:
+            for chunk in stream:
+                now = time.monotonic()
+                chunks.append([round(now - last, 6), _to_dict(chunk)])
+                last = now
+                yield chunk
+        except Exception as e:
+            interaction["error"] = _error(e)
+            raise
+        finally:
+            # Also when the reader stops early, e.g. on a stop condition
+            self._write(interaction)
+
+    def _write(self, interaction: Dict[str, Any]):
+        line = json.dumps(interaction, ensure_ascii=False)
+        with self._lock, open(self.filepath, "a") as file:
+            file.write(line + "\n")
+
+
+class Player:
+    """Replay a cassette as `create_completion`.
+
+    Requests are matched to recorded ones by their parameters (credentials and
+    timeouts aside), in recording order for repeated requests, so concurrent
+    requests get their own replies. With `realtime`, chunks arrive at the
+    recorded pace.
+    """
+
+    def __init__(self, filepath: str, realtime: bool = False):
+        self.realtime = realtime
+        self._interactions: Dict[str, List[Dict[str, Any]]] = {}
+        with open(filepath, "r") as file:
+            for line in file:
+                if line.strip():
+                    interaction = json.loads(line)
+                    key = _request_key(interaction["request"])
+                    self._interactions.setdefault(key, []).append(interaction)
+        self._lock = threading.Lock()
+
+    def __call__(self, **params):
+        with self._lock:
+            recorded = self._interactions.get(_request_key(params))
+            if not recorded:
+                raise CassetteError(
+                    "The cassette has no (more) replies to this request: "
+                    f"{params.get('model')} with {len(params.get('messages', [])):,d} "
+                    "messages. Record it again after changing the conversation "
+                    "or the parameters."
+                )
+            interaction = recorded.pop(0)
+
+        if "chunks" in interaction:
+            return self._replay_stream(interaction)
+        if "error" in interaction:
+            raise _to_exception(interaction["error"])
+        return convert_to_openai_object(interaction["response"])
+
+    def _replay_stream(self, interaction: Dict[str, Any]) -> Iterator[Any]:
+        with span("cassette.replay", n_chunks=len(interaction["chunks"])):
+            for delay, chunk in interaction["chunks"]:
+                if self.realtime and delay > 0:
+                    time.sleep(delay)
+                yield convert_to_openai_object(chunk)
+        if "error" in interaction:
+            raise _to_exception(interaction["error"])
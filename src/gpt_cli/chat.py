@@ -1,40 +1,65 @@
 from __future__ import annotations
 
-from typing import Dict, List
+import time
+from typing import Any, Callable, Dict, List
 
-import openai
 import rich
 import typer
-from openai import ChatCompletion
 from openai.error import (
     APIConnectionError,
     APIError,
     AuthenticationError,
     RateLimitError,
     ServiceUnavailableError,
+    Timeout,
 )
-from rich.console import Console
+from prompt_toolkit.formatted_text import HTML
+from rich.console import Console, RenderableType
 from rich.live import Live
 from rich.markdown import Markdown
+from rich.panel import Panel
+from rich.prompt import IntPrompt
+from rich.table import Table
 
 from gpt_cli import pretty
 
-from .constants import DEFAULT_SYSTEM
+from . import transport
+from .budget import TokenBudgetPlanner
+from .compaction import Compactor
+from .constants import CONTINUE_PROMPT, DEFAULT_SYSTEM
 from .context import Context
 from .key import OpenaiApiKey
 from .message import Message
 from .model import ModelName, OpenAiModel
-from .prompt import prompt
+from .prompt import TokenMeter, prompt
 from .role import Role
+from .router import ModelRouter
+from .stops import StopCondition, parse_stop_condition
+from .timeouts import StreamInterrupted, with_timeouts
+from .tools import ToolRegistry, ToolResult, add_tool_call_deltas, ordered_calls
+from .trace import span
+
+# Worth another try after a pause; anything else is reported at once
+TRANSIENT_ERRORS = (
+    RateLimitError,
+    APIError,
+    ServiceUnavailableError,
+    APIConnectionError,
+    Timeout,
+)
 
 
 class Chat:
     RETRY_SLEEP: int = 10
+    MAX_QUIET_RETRIES: int = 5
+    REFRESH_PER_SECOND: int = 50
+    CHECKPOINT_SECONDS: float = 2.0
+    MAX_TOOL_ROUNDS: int = 8
     chat_completion_params: Dict[str, str | float | int | List[str] | None]
 
     def __init__(
         self,
-        api_key: OpenaiApiKey,
+        api_key: OpenaiApiKey | None,
         model: str | OpenAiModel = OpenAiModel(name=ModelName.gpt_4o_mini),
         system: str | None = None,
         out: str | None = None,
@@ -47,10 +72,22 @@ class Chat:
         presence_penalty: float = 0,
         frequency_penalty: float = 0,
         stream_output: bool = True,
+        create_completion: Callable | None = None,
+        dynamic_budget: bool = False,
+        n_choices: int = 1,
+        router: ModelRouter | None = None,
+        stop_when: List[str] | None = None,
+        connect_timeout: float | None = 10,
+        first_token_timeout: float | None = 120,
+        chunk_timeout: float | None = 30,
+        memory_margin: int | None = None,
+        compact: bool = False,
+        tools: ToolRegistry | None = None,
     ):
         self.stream_output = stream_output
 
-        openai.api_key = api_key.get()
+        # Anything with the signature of `ChatCompletion.create`, e.g. a daemon client
+        self.create_completion = create_completion or transport.create_completion
 
         if isinstance(model, str):
             self.model = OpenAiModel(name=ModelName(model))
@@ -122,7 +159,15 @@ class Chat:
             )
             quit(1)
 
+        # Messages older than the window plus a margin are spilled to disk
+        if memory_margin is not None:
+            assert memory_margin >= 0
+            self.context.set_keep_tokens(self.max_context_tokens + memory_margin)
+
         self.stop = stop if stop else None  # "" or [] becomes None
+        # Checked on the client, in addition to the API's stop sequences
+        self.stop_when = stop_when or []
+        self.stop_reasons: List[str | None] = []
         self.temperature = temperature
         assert 0 <= self.temperature <= 2
         self.top_p = top_p
@@ -131,6 +176,33 @@ class Chat:
         assert -2 <= self.presence_penalty <= 2
         self.frequency_penalty = frequency_penalty
         assert -2 <= self.frequency_penalty <= 2
+        self.n_choices = n_choices
+        assert self.n_choices >= 1
+
+        # With a router, `model` is the candidate with the largest window and the
+        # model is picked again on every turn
+        self.router = router
+
+        # Removes redundancy from user messages; the original text is saved too
+        self.compactor = Compactor() if compact else None
+
+        # Local tools the model may call; their results go into the context
+        self.tools = tools
+        # Tool calls of the last reply, and of every candidate of the last request
+        self.tool_calls: List[Dict[str, Any]] = []
+        self.choice_tool_calls: List[List[Dict[str, Any]]] = []
+
+        # Shows the draft's size against the budget while typing
+        self.token_meter = TokenMeter()
+
+        # Size context and output per turn instead of using the static limits
+        self.budget_planner = None
+        if dynamic_budget:
+            self.budget_planner = TokenBudgetPlanner(
+                model=self.model,
+                max_context_tokens=max_context_tokens,
+                max_output_tokens=max_output_tokens,
+            )
 
         self.chat_completion_params = {
             "stop": self.stop,
@@ -140,116 +212,592 @@ class Chat:
             "presence_penalty": self.presence_penalty,
             "frequency_penalty": self.frequency_penalty,
         }
+        if tools is not None:
+            self.chat_completion_params["tools"] = tools.schemas()
+        # Stalled streams are detected by `with_timeouts`; the socket's own read
+        # timeout is only a backstop that frees the reader thread eventually.
+        # Replies that are not streamed get none: they may take long to generate
+        self.first_token_timeout = first_token_timeout
+        self.chunk_timeout = chunk_timeout
+        self.stream_params: Dict[str, Any] = {}
+        if connect_timeout is not None:
+            read_timeout = max(first_token_timeout or 0, chunk_timeout or 0) or None
+            self.stream_params["request_timeout"] = (connect_timeout, read_timeout)
+        # The key goes with every request instead of the global `openai.api_key`,
+        # so that requests can use different credentials (e.g. a key pool)
+        if api_key is not None:
+            self.chat_completion_params["api_key"] = api_key.get()
 
-    @staticmethod
-    def ask_for_input() -> str:
-        user_input = prompt()
+    def ask_for_input(
+        self, message: str = "> ", status: Callable[[], HTML] | None = None
+    ) -> str:
+        self.token_meter.reset(
+            model=self.model.name,
+            context_tokens=lambda: self.context.n_tokens,
+            max_context_tokens=self.max_context_tokens,
+        )
+        user_input = prompt(meter=self.token_meter, message=message, status=status)
         if user_input.lower().strip() in ("exit", "quit", ":q"):
             raise typer.Exit()
 
         return user_input
 
     def _need_user_input(self) -> bool:
-        if len(self.context.messages) == 0:
+        last_message = self.context.last_message
+        if last_message is None:
             # First message should be user input
             return True
         # Need input, if last message was not user message
-        last_message = self.context.messages[-1]
         return last_message.role != Role.user
 
-    def start(self):
-        while True:
-            # Check if we need user input
-            if self._need_user_input():
-                user_input = self.ask_for_input()
-                self.context.add_message(
-                    Message(content=user_input, role=Role.user, model=self.model)
+    def _checkpoint(self, partial_reply: str):
+        "Save the reply received so far, so a crash does not lose it."
+        if not self.out:
+            return
+        partial = Message(
+            content=partial_reply,
+            role=Role.assistant,
+            model=self.model,
+            incomplete=True,
+        )
+        with span("chat.checkpoint"):
+            self.context.save(self.out, partial=partial)
+
+    @staticmethod
+    def _render(replies: List[str]) -> RenderableType:
+        if len(replies) == 1:
+            return Markdown(replies[0])
+        # Several candidates are shown side by side
+        grid = Table.grid(expand=True, padding=(0, 1))
+        for _ in replies:
+            grid.add_column(ratio=1)
+        grid.add_row(
+            *(
+                Panel(Markdown(reply), title=f"Reply {i}")
+                for i, reply in enumerate(replies, 1)
+            )
+        )
+        return grid
+
+    def _stream_replies(
+        self, messages: List[Dict[str, str]], prefix: str = "", n: int = 1
+    ) -> List[str]:
+        request_start = time.monotonic()
+        with span("chat.request", stream=True, n=n):
+            output_stream = pretty.typing_animation(
+                func=self.create_completion,
+                text="Thinking...",
+                model=self.model.name,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **({"n": n} if n > 1 else {}),
+                **self.chat_completion_params,
+                **self.stream_params,
+            )
+        # Collect chunks and join them only when rendering or checkpointing:
+        # repeated concatenation and Markdown parsing on every chunk are wasteful
+        chunks: List[List[str]] = [[prefix] for _ in range(n)]
+        conditions = [self._stop_conditions(prefix) for _ in range(n)]
+        self.stop_reasons: List[str | None] = [None] * n
+        tool_calls: List[Dict[int, Dict[str, Any]]] = [{} for _ in range(n)]
+        min_render_interval = 1 / self.REFRESH_PER_SECOND
+        last_render = last_checkpoint = time.monotonic()
+        first_token_at, n_content_chunks = None, 0
+        rich.print()
+        console = Console()
+        with (
+            span("chat.stream") as stream_span,
+            Live(console=console, refresh_per_second=self.REFRESH_PER_SECOND) as live,
+        ):
+            # With timeouts the stream is read on another thread, which also
+            # closes it: only the wrapper may be closed from this one
+            stream = self._with_timeouts(output_stream)
+            try:
+                for chunk in stream:
+                    for choice in chunk.choices:
+                        i = choice.get("index", 0)
+                        delta = choice.get("delta", {})
+                        if delta.get("tool_calls"):
+                            add_tool_call_deltas(tool_calls[i], delta["tool_calls"])
+                        content = delta.get("content")
+                        if content and self.stop_reasons[i] is None:
+                            chunks[i].append(content)
+                            n_content_chunks += 1
+                            self.stop_reasons[i] = self._check_stops(
+                                conditions[i], chunks[i], content
+                            )
+
+                    now = time.monotonic()
+                    if first_token_at is None and n_content_chunks:
+                        first_token_at = now
+                    if now - last_render >= min_render_interval:
+                        with span("chat.render"):
+                            live.update(self._render(["".join(c) for c in chunks]))
+                        last_render = now
+                    if n == 1 and now - last_checkpoint >= self.CHECKPOINT_SECONDS:
+                        self._checkpoint("".join(chunks[0]))
+                        last_checkpoint = now
+                    if conditions[0] and all(self.stop_reasons):
+                        break
+            except APIConnectionError as e:
+                partial = "".join(chunks[0])
+                if n > 1 or len(partial) == len(prefix):
+                    raise  # nothing new to keep: retry as usual
+                # Clear the display: the continuation renders the whole reply
+                live.update("")
+                raise StreamInterrupted(partial) from e
+            # Closes the connection if a stop condition ended the reply early
+            getattr(stream, "close", lambda: None)()
+            stream_span.set(stop_reasons=self.stop_reasons)
+            self.choice_tool_calls = [ordered_calls(calls) for calls in tool_calls]
+            replies = ["".join(c) for c in chunks]
+            with span("chat.render"):
+                live.update(self._render(replies))
+        rich.print()
+        self._note_stops()
+
+        self._observe(request_start, first_token_at, n_content_chunks)
+        return replies
+
+    def _observe(
+        self, request_start: float, first_token_at: float | None, n_tokens: int
+    ):
+        "Tell the router how fast the model streamed, for `--model auto`."
+        if self.router is not None and first_token_at is not None:
+            # A content chunk is about one token, which is all throughput needs
+            self.router.observe(
+                self.model,
+                ttft=first_token_at - request_start,
+                n_tokens=n_tokens,
+                stream_seconds=time.monotonic() - first_token_at,
+            )
+
+    def _with_timeouts(self, output_stream):
+        if self.first_token_timeout is None and self.chunk_timeout is None:
+            return output_stream  # no need for a reader thread
+        return with_timeouts(
+            output_stream, self.first_token_timeout, self.chunk_timeout
+        )
+
+    def _complete_replies(
+        self, messages: List[Dict[str, str]], n: int = 1
+    ) -> List[str]:
+        with span("chat.request", stream=False, n=n):
+            completion = pretty.typing_animation(
+                func=self.create_completion,
+                text="Typing...",
+                model=self.model.name,
+                messages=messages,
+                **({"n": n} if n > 1 else {}),
+                **self.chat_completion_params,
+            )
+        choices = sorted(completion.choices, key=lambda c: c.get("index", 0))
+        # Replies that only call tools have no content
+        replies = [choice.message.get("content") or "" for choice in choices]
+        self.choice_tool_calls = [
+            [
+                call.to_dict_recursive()
+                for call in choice.message.get("tool_calls") or []
+            ]
+            for choice in choices
+        ]
+        # Nothing to save here, but replies should be trimmed the same way
+        self.stop_reasons = [None] * len(replies)
+        for i, reply in enumerate(replies):
+            chunks = [reply]
+            self.stop_reasons[i] = self._check_stops(
+                self._stop_conditions(), chunks, reply
+            )
+            replies[i] = chunks[0]
+        with span("chat.render"):
+            rich.print()
+            rich.print(self._render(replies))
+            rich.print()
+        self._note_stops()
+        return replies
+
+    def _stop_conditions(self, prefix: str = "") -> List[StopCondition]:
+        conditions = [parse_stop_condition(spec) for spec in self.stop_when]
+        # A continued reply is checked as a whole
+        if prefix:
+            self._check_stops(conditions, [prefix], prefix)
+        return conditions
+
+    @staticmethod
+    def _check_stops(
+        conditions: List[StopCondition], chunks: List[str], content: str
+    ) -> str | None:
+        "Feed new `content` to the conditions, trim `chunks` if one matches."
+        matches = []
+        for condition in conditions:
+            cut = condition.feed(content)
+            if cut is not None:
+                matches.append((cut, condition.reason))
+        if not matches:
+            return None
+        cut, reason = min(matches)
+        chunks[:] = ["".join(chunks)[:cut]]
+        return reason
+
+    def _note_stops(self):
+        for i, reason in enumerate(self.stop_reasons, 1):
+            if reason is not None:
+                which = f"Reply {i}" if len(self.stop_reasons) > 1 else "Reply"
+                pretty.note(f"{which} stopped on the client: {reason}.")
+
+    def _choose(self, replies: List[str]) -> str:
+        "Let the user pick which candidate reply goes into the context."
+        i = 0
+        if len(replies) > 1:
+            choice = IntPrompt.ask(
+                "Which reply should be kept?",
+                choices=[str(i) for i in range(1, len(replies) + 1)],
+                default=1,
+            )
+            i = choice - 1
+        self.tool_calls = self.choice_tool_calls[i]
+        return replies[i]
+
+    def _plan_request(self, notify: Callable[[str], None] = pretty.note) -> int:
+        "Pick the model and token limits for the next request, return the context size."
+        max_context_tokens = self.max_context_tokens
+        max_output_tokens = self.max_output_tokens
+        if self.router is not None:
+            with span("chat.route"):
+                # Room is kept for the output the request reserves below: with a
+                # budget planner history can take all but its minimum output
+                reserved = (
+                    self.budget_planner.min_output_tokens
+                    if self.budget_planner is not None
+                    else max_output_tokens
                 )
-                if self.out:
-                    self.context.save(self.out)
-
-            # Send request
-            success = False
-            while not success:
-                try:
-                    if self.stream_output:
-                        output_stream = pretty.typing_animation(
-                            func=ChatCompletion.create,
-                            text="Thinking...",
-                            model=self.model.name,
-                            messages=self.context.get_messages(
-                                max_context_tokens=self.max_context_tokens
-                            ),
-                            stream=True,
-                            stream_options={"include_usage": True},
-                            **self.chat_completion_params,
-                        )
-                        assistant_reply = ""
-                        rich.print()
-                        console = Console()
-                        with Live(console=console, refresh_per_second=50) as live:
-                            for chunk in output_stream:
-                                if chunk.choices and chunk.choices[0].delta:
-                                    assistant_reply += chunk.choices[0].delta.content
-                                    live.update(Markdown(assistant_reply))
-                        rich.print()
-                        success = True
-                    else:
-                        completion = pretty.typing_animation(
-                            func=ChatCompletion.create,
-                            text="Typing...",
-                            model=self.model.name,
-                            messages=self.context.get_messages(
-                                max_context_tokens=self.max_context_tokens
-                            ),
-                            **self.chat_completion_params,
+                decision = self.router.route(
+                    prompt_tokens=self.context.n_tokens, max_output_tokens=reserved
+                )
+            notify(str(decision))
+            self.model = decision.model
+            # Limits were checked against the largest candidate, this one may be smaller
+            max_output_tokens = min(max_output_tokens, self.model.max_output_tokens)
+            max_context_tokens = min(
+                max_context_tokens, self.model.max_context_tokens - max_output_tokens
+            )
+        if self.budget_planner is not None:
+            self.budget_planner.model = self.model
+            with span("chat.plan_budget"):
+                budget = self.budget_planner.plan(history_tokens=self.context.n_tokens)
+            notify(str(budget))
+            max_context_tokens = budget.context_tokens
+            max_output_tokens = min(budget.output_tokens, max_output_tokens)
+        self.chat_completion_params["max_completion_tokens"] = max_output_tokens
+        return max_context_tokens
+
+    def _fetch_reply(self) -> str:
+        """Request the next reply without showing anything, e.g. in the background.
+
+        Transient errors are retried as in `_get_reply`, but quietly and at most
+        `MAX_QUIET_RETRIES` times: nobody can interrupt a background turn.
+        """
+        max_context_tokens = self._plan_request(notify=lambda _: None)
+        messages = self.context.get_messages(max_context_tokens=max_context_tokens)
+        n_retries = 0
+        while True:
+            try:
+                return self._fetch_once(messages)
+            except TRANSIENT_ERRORS:
+                if n_retries == self.MAX_QUIET_RETRIES:
+                    raise
+                n_retries += 1
+                time.sleep(self.RETRY_SLEEP)
+
+    def _fetch_once(self, messages: List[Dict[str, str]]) -> str:
+        request_start = time.monotonic()
+        with span("chat.request", stream=True, n=1):
+            output_stream = self.create_completion(
+                model=self.model.name,
+                messages=messages,
+                stream=True,
+                **self.chat_completion_params,
+                **self.stream_params,
+            )
+        chunks: List[str] = []
+        conditions = self._stop_conditions()
+        self.stop_reasons = [None]
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        first_token_at = None
+        with span("chat.stream"):
+            stream = self._with_timeouts(output_stream)
+            for chunk in stream:
+                for choice in chunk.choices:
+                    delta = choice.get("delta", {})
+                    if delta.get("tool_calls"):
+                        add_tool_call_deltas(tool_calls, delta["tool_calls"])
+                    content = delta.get("content")
+                    if content and self.stop_reasons[0] is None:
+                        if first_token_at is None:
+                            first_token_at = time.monotonic()
+                        chunks.append(content)
+                        self.stop_reasons[0] = self._check_stops(
+                            conditions, chunks, content
                         )
-                        success = True
-                except RateLimitError:
-                    s = self.RETRY_SLEEP
-                    msg = f"RateLimitError: retrying in {s:d} seconds."
-                    pretty.waiting_animation(s, msg)
-                except APIError:
-                    s = self.RETRY_SLEEP
-                    msg = f"APIError: retrying in {s:d} seconds."
-                    pretty.waiting_animation(s, msg)
-                except ServiceUnavailableError:
-                    s = self.RETRY_SLEEP
-                    msg = f"ServiceUnavailableError: retrying in {s:d} seconds."
-                    pretty.waiting_animation(s, msg)
-                except APIConnectionError:
-                    s = self.RETRY_SLEEP
-                    msg = f"APIConnectionError: retrying in {s:d} seconds."
-                    pretty.waiting_animation(s, msg)
-                except AuthenticationError:
-                    msg = (
-                        "Incorrect API key provided. You can find your API key "
-                        "at https://platform.openai.com/account/api-keys. "
-                        "Then rerun the 'init' command or specify it using the "
-                        "environment variable 'OPENAI_API_KEY', or the command line "
-                        "option '--openai-api-key'."
-                    )
-                    pretty.error(msg)
-                    quit(1)
-
-            if self.stream_output:
-                # `assistant_reply` is already filled in the stream loop, so no need to retrieve it again
-                assert isinstance(assistant_reply, str)  # type: ignore (we know it is bound)
-                self.context.add_message(
-                    Message(
-                        content=assistant_reply, role=Role.assistant, model=self.model
+                if conditions and self.stop_reasons[0]:
+                    break
+            getattr(stream, "close", lambda: None)()
+        self.tool_calls = ordered_calls(tool_calls)
+        self._observe(request_start, first_token_at, len(chunks))
+        return "".join(chunks)
+
+    def _get_reply(self, continue_from: str | None = None, n: int | None = None) -> str:
+        """Request the next assistant reply, retrying on transient errors.
+
+        With `n` (or `--n`) above 1, several candidates are requested at once
+        and the user picks one of them.
+        """
+        n = n or self.n_choices
+        max_context_tokens = self._plan_request()
+
+        while True:
+            try:
+                with span("chat.get_messages"):
+                    messages = self.context.get_messages(
+                        max_context_tokens=max_context_tokens
                     )
+                if continue_from is not None:
+                    messages = messages + [
+                        {"role": Role.assistant.value, "content": continue_from},
+                        {"role": Role.user.value, "content": CONTINUE_PROMPT},
+                    ]
+                    reply = self._stream_replies(messages, prefix=continue_from)[0]
+                    self.tool_calls = self.choice_tool_calls[0]
+                    return reply
+                if self.stream_output:
+                    return self._choose(self._stream_replies(messages, n=n))
+                return self._choose(self._complete_replies(messages, n=n))
+            except StreamInterrupted as e:
+                # Keep what was received and ask for the rest
+                pretty.warning(f"{e.__cause__}: continuing the reply.")
+                continue_from = e.partial
+            except TRANSIENT_ERRORS as e:
+                s = self.RETRY_SLEEP
+                msg = f"{type(e).__name__}: retrying in {s:d} seconds."
+                pretty.waiting_animation(s, msg)
+            except AuthenticationError:
+                msg = (
+                    "Incorrect API key provided. You can find your API key "
+                    "at https://platform.openai.com/account/api-keys. "
+                    "Then rerun the 'init' command or specify it using the "
+                    "environment variable 'OPENAI_API_KEY', or the command line "
+                    "option '--openai-api-key'."
                 )
-            else:
-                assistant_reply = completion.choices[0].message["content"]  # type: ignore (we know it is bound)
-                self.context.add_message(
-                    Message(
-                        content=assistant_reply, role=Role.assistant, model=self.model
-                    )
+                pretty.error(msg)
+                quit(1)
+
+    def _resume_incomplete(self):
+        "Offer to finish a reply that was cut off in a previous session."
+        last_message = self.context.last_message
+        if last_message is None:
+            return
+        if last_message.role != Role.assistant or not last_message.incomplete:
+            return
+
+        pretty.warning("The last reply in the conversation is incomplete:")
+        rich.print()
+        rich.print(Markdown(last_message.content))  # type: ignore (not a system message)
+        rich.print()
+        if not typer.confirm("Ask the model to continue it?"):
+            return
+
+        self.context.pop_message()
+        assistant_reply = self._get_reply(continue_from=last_message.content)
+        self._add_reply(assistant_reply)
+
+    def _user_message(self, user_input: str) -> Message:
+        message = Message(content=user_input, role=Role.user, model=self.model)
+        if self.compactor is None:
+            return message
+
+        with span("chat.compact") as compact_span:
+            # Blocks are only deduplicated against what the model will still see
+            window = self.context._get_context(
+                max_context_tokens=self.max_context_tokens
+            )
+            content = self.compactor.compact(
+                user_input, (m.content for m in window if m.content is not None)
+            )
+            if content == user_input:
+                return message
+            compacted = Message(
+                content=content, role=Role.user, model=self.model, original=user_input
+            )
+            n_saved = message.n_tokens - compacted.n_tokens
+            compact_span.set(tokens_saved=n_saved)
+        pretty.note(
+            f"Compacted the message by {n_saved:,d} tokens "
+            f"({message.n_tokens:,d} → {compacted.n_tokens:,d})."
+        )
+        return compacted
+
+    def _add_user_message(self, user_input: str):
+        message = self._user_message(user_input)
+        with span("chat.add_message", role=Role.user.value):
+            self.context.add_message(message)
+        if self.out:
+            with span("chat.save"):
+                self.context.save(self.out)
+
+    def _add_reply(
+        self, assistant_reply: str, tool_calls: List[Dict[str, Any]] | None = None
+    ):
+        message = Message(
+            content=assistant_reply,
+            role=Role.assistant,
+            model=self.model,
+            tool_calls=tool_calls or None,
+        )
+        with span("chat.add_message", role=Role.assistant.value):
+            self.context.add_message(message)
+        if self.budget_planner is not None:
+            self.budget_planner.observe(message.n_tokens)
+        if self.out:
+            with span("chat.save"):
+                self.context.save(self.out)
+
+    def _respond(
+        self,
+        get_reply: Callable[[], str] | None = None,
+        notify: Callable[[str], None] = pretty.note,
+    ) -> str:
+        """Add the next reply; while it asks for tools, run them and ask again.
+
+        Returns the last reply, the one that answers the user.
+        """
+        get_reply = get_reply or self._get_reply
+        reply = get_reply()
+        self._add_reply(reply, self.tool_calls)
+        for _ in range(self.MAX_TOOL_ROUNDS):
+            if not self.tool_calls:
+                return reply
+            self._run_tools(self.tool_calls, notify)
+            reply = get_reply()
+            self._add_reply(reply, self.tool_calls)
+
+        if self.tool_calls:
+            # Every call needs a result, or the next request is rejected
+            reason = (
+                f"Not run: more than {self.MAX_TOOL_ROUNDS:,d} rounds of tool calls."
+            )
+            self._add_tool_results(ToolRegistry.skip(self.tool_calls, reason), notify)
+            notify(f"Stopped after {self.MAX_TOOL_ROUNDS:,d} rounds of tool calls.")
+        return reply
+
+    def _run_tools(
+        self,
+        calls: List[Dict[str, Any]],
+        notify: Callable[[str], None] = pretty.note,
+    ):
+        if self.tools is None:  # e.g. a replayed or loaded reply
+            results = ToolRegistry.skip(calls, "Not run: tools are not enabled.")
+        else:
+            with span("chat.tools", n_calls=len(calls)):
+                results = self.tools.run(calls)
+        self._add_tool_results(results, notify)
+
+    def _add_tool_results(
+        self, results: List[ToolResult], notify: Callable[[str], None] = pretty.note
+    ):
+        with span("chat.add_message", role=Role.tool.value) as add_span:
+            n_tokens = 0
+            for result in results:
+                message = Message(
+                    content=result.output,
+                    role=Role.tool,
+                    model=self.model,
+                    tool_call_id=result.call_id,
+                )
+                self.context.add_message(message)
+                n_tokens += message.n_tokens
+                notify(
+                    f"Tool {result.name}: {result.status}, "
+                    f"{message.n_tokens:,d} tokens."
                 )
-                rich.print()
-                rich.print(Markdown(assistant_reply))
-                rich.print()
+            add_span.set(n_results=len(results), tokens=n_tokens)
+        if self.out:
+            with span("chat.save"):
+                self.context.save(self.out)
+
+    def _regenerate(self, args: List[str]):
+        "Replace the last reply with a new one (or one of `n` new ones)."
+        try:
+            n = int(args[0]) if args else self.n_choices
+            assert n > 0
+        except (ValueError, AssertionError):
+            pretty.error("Usage: /regenerate [N], where N is a positive integer.")
+            return
+
+        last_message = self.context.last_message
+        if last_message is None:
+            pretty.warning("Nothing to regenerate: the conversation is empty.")
+            return
+        if last_message.role == Role.assistant:
+            self.context.pop_message()
+        self._respond(lambda: self._get_reply(n=n))
 
-            if self.out:
+    def _switch_branch(self, command: str, args: List[str]):
+        "Handle `/branch NAME`, `/switch [NAME]` and `/rewind N`."
+        try:
+            match command, args:
+                case "/branch", [name]:
+                    self.context.fork(name)
+                    pretty.note(f"Switched to a new branch '{name}'.")
+                case "/switch", []:
+                    for name, head in self.context.branches.items():
+                        marker = "*" if name == self.context.branch else " "
+                        n_messages = head.depth if head is not None else 0
+                        pretty.note(f"{marker} {name} ({n_messages:,d} messages)")
+                    return
+                case "/switch", [name]:
+                    self.context.switch(name)
+                    pretty.note(
+                        f"Switched to branch '{name}' "
+                        f"({self.context.n_messages:,d} messages)."
+                    )
+                case "/rewind", [n] if n.isdigit():
+                    self.context.rewind(int(n))
+                    pretty.note(f"Removed the last {int(n):,d} messages.")
+                case _:
+                    pretty.error(
+                        "Usage: /branch NAME, /switch [NAME] or /rewind N, "
+                        "where N is a number of messages."
+                    )
+                    return
+        except ValueError as e:
+            pretty.error(str(e))
+            return
+
+        if self.out:
+            with span("chat.save"):
                 self.context.save(self.out)
+
+    def _run_command(self, user_input: str) -> bool:
+        "Run a slash command, return `False` if the input is not one."
+        command, *args = user_input.split() or [""]
+        match command:
+            case "/regenerate":
+                self._regenerate(args)
+            case "/branch" | "/switch" | "/rewind":
+                self._switch_branch(command, args)
+            case _:
+                return False
+        return True
+
+    def start(self):
+        self._resume_incomplete()
+        while True:
+            # Check if we need user input
+            if self._need_user_input():
+                user_input = self.ask_for_input()
+                if self._run_command(user_input):
+                    continue
+                self._add_user_message(user_input)
+
+            self._respond()
@@ -0,0 +1,131 @@
+"""Compaction of pasted text before it is sent.
+
+Logs, stack traces and code pasted into a prompt often carry whitespace runs,
+repeated lines and blocks that are already in the conversation. The transforms
+here only remove that redundancy: text inside code fences keeps its whitespace,
+repeats are replaced by a count, and duplicated blocks by a note, so nothing
+the model needs is lost.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Iterable, Iterator, List, Set, Tuple
+
+FENCE = "```"
+
+_INNER_WHITESPACE = re.compile(r"(?<=\S)[ \t]{2,}")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def split_fences(text: str) -> Iterator[Tuple[bool, str]]:
+    "Split text into `(is_code, segment)`; code segments include their fences."
+    segment: List[str] = []
+    in_fence = False
+    for line in text.splitlines(keepends=True):
+        is_fence = line.lstrip().startswith(FENCE)
+        if is_fence and not in_fence:
+            if segment:
+                yield False, "".join(segment)
+            segment, in_fence = [line], True
+        elif is_fence:
+            segment.append(line)
+            yield True, "".join(segment)
+            segment, in_fence = [], False
+        else:
+            segment.append(line)
+    if segment:
+        yield in_fence, "".join(segment)  # an unclosed fence runs to the end
+
+
+def normalize_whitespace(text: str) -> str:
+    """Strip trailing whitespace, collapse runs of spaces and blank lines.
+
+    Indentation is kept, and code fences are left alone.
+    """
+    segments = []
+    for is_code, segment in split_fences(text):
+        if not is_code:
+            lines = [
+                _INNER_WHITESPACE.sub(" ", line.rstrip())
+                for line in segment.split("\n")
+            ]
+            segment = _BLANK_LINES.sub("\n\n", "\n".join(lines))
+        segments.append(segment)
+    return "".join(segments).strip("\n")
+
+
+def collapse_repeats(text: str, min_repeats: int = 3) -> str:
+    "Replace runs of at least `min_repeats` identical lines with one and a count."
+    lines = text.split("\n")
+    result: List[str] = []
+    i = 0
+    while i < len(lines):
+        j = i + 1
+        while j < len(lines) and lines[j] == lines[i]:
+            j += 1
+        n = j - i
+        if n >= min_repeats and lines[i].strip():
+            indent = lines[i][: len(lines[i]) - len(lines[i].lstrip())]
+            result += [
+                lines[i],
+                f"{indent}[previous line repeated {n - 1:,d} more times]",
+            ]
+        else:
+            result += lines[i:j]
+        i = j
+    return "\n".join(result)
+
+
+def split_blocks(text: str) -> Iterator[str]:
+    "Code blocks (with their fences) and paragraphs of the rest."
+    for is_code, segment in split_fences(text):
+        if is_code:
+            yield segment.strip("\n")
+        else:
+            yield from (p.strip("\n") for p in re.split(r"\n\s*\n", segment))
+
+
+class Compactor:
+    """Compact a message against the messages that are already in the window.
+
+    Blocks shorter than `min_block_chars` are never deduplicated: short ones
+    (e.g. "Thanks!") repeat naturally and replacing them saves nothing.
+    """
+
+    def __init__(self, min_repeats: int = 3, min_block_chars: int = 200):
+        self.min_repeats = min_repeats
+        self.min_block_chars = min_block_chars
+
+    def compact(self, text: str, history: Iterable[str] = ()) -> str:
+        text = normalize_whitespace(text)
+        # Repeated lines in code are meaningful (e.g. in a table or a test)
+        text = "".join(
+            segment if is_code else collapse_repeats(segment, self.min_repeats)
+            for is_code, segment in split_fences(text)
+        )
+        return self.dedupe_blocks(text, history)
+
+    def dedupe_blocks(self, text: str, history: Iterable[str]) -> str:
+        seen: Set[str] = {
+            block
+            for content in history
+            for block in split_blocks(content)
+            if len(block) >= self.min_block_chars
+        }
+        if not seen:
+            return text
+
+        blocks = []
+        for is_code, segment in split_fences(text):
+            parts = [segment] if is_code else re.split(r"(\n\s*\n)", segment)
+            for part in parts:
+                block = part.strip("\n")
+                if len(block) >= self.min_block_chars and block in seen:
+                    n_lines = block.count("\n") + 1
+                    note = (
+                        f"[{n_lines:,d} lines omitted: same as in an earlier message]"
+                    )
+                    part = part.replace(block, note)
+                blocks.append(part)
+        return "".join(blocks)
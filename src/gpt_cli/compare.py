@@ -0,0 +1,210 @@
+"""Side-by-side comparison of models on the same conversation.
+
+Every round sends the conversation to all models at once and streams the
+replies into one column per model. The timings and token counts of all rounds
+are summarized in a table, with percentiles when there is more than one round.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Sequence
+
+from openai.error import OpenAIError
+from rich.console import Console, RenderableType
+from rich.live import Live
+from rich.markdown import Markdown
+from rich.panel import Panel
+from rich.table import Table
+
+from . import transport
+from .model import OpenAiModel
+from .tokens import count_tokens
+from .trace import span
+
+
+@dataclass
+class RunStats:
+    ttft: float | None  # seconds to the first token, None if nothing arrived
+    seconds: float
+    prompt_tokens: int
+    completion_tokens: int
+
+    @property
+    def tokens_per_second(self) -> float | None:
+        if self.ttft is None or self.seconds <= self.ttft:
+            return None
+        return self.completion_tokens / (self.seconds - self.ttft)
+
+
+@dataclass
+class ModelResults:
+    model: OpenAiModel
+    runs: List[RunStats] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    chunks: List[str] = field(default_factory=list)  # of the current round
+
+    @property
+    def reply(self) -> str:
+        return "".join(self.chunks)
+
+    def cost(self, run: RunStats) -> float:
+        return self.model.estimated_cost(run.prompt_tokens, run.completion_tokens)
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    "The `q`-th percentile (0-100), interpolating between the closest values."
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    weight = position - lower
+    return ordered[lower] * (1 - weight) + ordered[upper] * weight
+
+
+class Comparison:
+    REFRESH_PER_SECOND: int = 10
+    PERCENTILES = (50, 90)
+
+    def __init__(
+        self,
+        models: List[OpenAiModel],
+        messages: List[Dict[str, str]],
+        create_completion: Callable | None = None,
+        repeat: int = 1,
+        console: Console | None = None,
+        **chat_completion_params: Any,
+    ):
+        if repeat < 1:
+            raise ValueError("Number of rounds should be a positive integer.")
+        self.models = models
+        self.messages = messages
+        self.create_completion = create_completion or transport.create_completion
+        self.repeat = repeat
+        self.console = console or Console()
+        self.chat_completion_params = chat_completion_params
+        self.results = [ModelResults(model) for model in models]
+        self._lock = threading.Lock()
+
+    def run(self) -> List[ModelResults]:
+        with ThreadPoolExecutor(max_workers=len(self.models)) as executor:
+            for i in range(self.repeat):
+                for results in self.results:
+                    results.chunks = []
+                title = f"Round {i + 1} of {self.repeat}" if self.repeat > 1 else None
+                with Live(
+                    get_renderable=lambda: self._render(title),
+                    console=self.console,
+                    refresh_per_second=self.REFRESH_PER_SECOND,
+                ):
+                    futures = [
+                        executor.submit(self._run_one, results)
+                        for results in self.results
+                    ]
+                    for future in futures:
+                        future.result()
+        return self.results
+
+    def _run_one(self, results: ModelResults):
+        model = results.model
+        start = time.monotonic()
+        ttft = None
+        usage = None
+        chunks = results.chunks
+        with span("compare.request", model=model.name.value):
+            try:
+                stream = self.create_completion(
+                    model=model.name.value,
+                    messages=self.messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **self.chat_completion_params,
+                )
+                for chunk in stream:
+                    for choice in chunk.choices:
+                        content = choice.get("delta", {}).get("content")
+                        if content:
+                            if ttft is None:
+                                ttft = time.monotonic() - start
+                            with self._lock:
+                                chunks.append(content)
+                    usage = chunk.get("usage") or usage
+            except OpenAIError as e:
+                with self._lock:
+                    results.errors.append(str(e))
+                    chunks.append(f"\n\n**Error:** {e}")
+                return
+        seconds = time.monotonic() - start
+
+        if usage:
+            prompt_tokens = usage["prompt_tokens"]
+            completion_tokens = usage["completion_tokens"]
+        else:  # servers that do not report usage in streams
+            prompt_tokens = sum(
+                count_tokens(m["content"], model.name)
+                for m in self.messages
+                if m.get("content")
+            )
+            completion_tokens = count_tokens("".join(chunks), model.name)
+        with self._lock:
+            results.runs.append(
+                RunStats(ttft, seconds, prompt_tokens, completion_tokens)
+            )
+
+    def _render(self, title: str | None) -> RenderableType:
+        grid = Table.grid(expand=True, padding=(0, 1))
+        for _ in self.results:
+            grid.add_column(ratio=1)
+        with self._lock:
+            panels = [
+                Panel(Markdown(results.reply), title=results.model.name.value)
+                for results in self.results
+            ]
+        grid.add_row(*panels)
+        if title is None:
+            return grid
+        return Panel(grid, title=title, border_style="dim")
+
+    def _summarize(self, values: List[float], fmt: str) -> str:
+        if not values:
+            return "-"
+        if len(values) == 1:
+            return format(values[0], fmt)
+        return " / ".join(format(percentile(values, q), fmt) for q in self.PERCENTILES)
+
+    def table(self) -> Table:
+        title = "Comparison"
+        if self.repeat > 1:
+            quantiles = " / ".join(f"p{q}" for q in self.PERCENTILES)
+            title += f" ({quantiles} of {self.repeat} rounds)"
+        table = Table(title=title)
+        for column in (
+            "Model",
+            "TTFT, s",
+            "Tokens/s",
+            "Latency, s",
+            "Prompt tokens",
+            "Completion tokens",
+            "Cost, USD",
+            "Errors",
+        ):
+            table.add_column(column, justify="left" if column == "Model" else "right")
+
+        for results in self.results:
+            runs = results.runs
+            table.add_row(
+                results.model.name.value,
+                self._summarize([r.ttft for r in runs if r.ttft is not None], ".2f"),
+                self._summarize(
+                    [r.tokens_per_second for r in runs if r.tokens_per_second], ".1f"
+                ),
+                self._summarize([r.seconds for r in runs], ".2f"),
+                self._summarize([r.prompt_tokens for r in runs], ",.0f"),
+                self._summarize([r.completion_tokens for r in runs], ",.0f"),
+                self._summarize([results.cost(r) for r in runs], ".5f"),
+                f"{len(results.errors):,d}",
+            )
+        return table
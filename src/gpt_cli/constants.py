@@ -3,5 +3,16 @@ from pathlib import Path
 
 CONFIG_DIR = os.path.join(Path.home(), ".config", "gpt-cli")
 OPENAI_API_KEY_FILENAME = "openai_api_key"
+DAEMON_SOCKET_FILENAME = "daemon.sock"
+MODEL_LATENCY_FILENAME = "model_latency.json"
 
 DEFAULT_SYSTEM = "You are a helpful assistant. Answer as concisely as possible."
+CONTINUE_PROMPT = (
+    "Your previous reply was cut off. Continue it exactly where it stopped, "
+    "without repeating what you have already written."
+)
+DEFAULT_REDUCE_PROMPT = (
+    "You are given partial answers, each produced from one part of a larger "
+    "document and separated by '---'. Combine them into a single coherent answer "
+    "without repetitions."
+)
@@ -1,57 +1,249 @@
 from __future__ import annotations
 
 import io
+import itertools
+import json
+import os
+import re
 import textwrap
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List
 
 import yaml
 
+from . import archive, history
+from .history import Node
 from .message import Message
 from .model import OpenAiModel
 from .role import Role
+from .spill import SpillStore
+from .tokens import token_count_key
+from .trace import span, traced
+
+# Characters a block scalar keeps as they are: no line breaks other than "\n"
+# (YAML also breaks lines at e.g. "\r" and U+2028) and nothing it cannot load
+_BLOCK_SAFE = re.compile(
+    "[\t\n\x20-\x7e\xa0-\u2027\u202a-\ud7ff\ue000-\ufefe\uff00-\ufffd"
+    "\U00010000-\U0010ffff]*"
+)
+
+
+def _yaml_text(text: str) -> str:
+    """YAML for `text` as the value of a message field, which reads back exactly.
+
+    Prose is folded to lines of 80 characters where that loses nothing; other
+    text goes into a literal block, or a quoted string if even that would not
+    read back the same (e.g. with a carriage return).
+    """
+    indent = 4 * " "
+    if not _BLOCK_SAFE.fullmatch(text):
+        return " " + yaml.safe_dump(
+            text, default_style='"', allow_unicode=True, width=float("inf")
+        )
+    wrapped = textwrap.wrap(text, width=80, replace_whitespace=False)
+    if text == text.strip() and "\n" not in text and " ".join(wrapped) == text:
+        return " >-\n" + "".join(f"{indent}{line}\n" for line in wrapped)
+    # Keep ("+") or strip ("-") the final line breaks, indented by 2 more spaces
+    chomping = "+" if text.endswith("\n") else "-"
+    lines = text.removesuffix("\n").split("\n")
+    return f" |2{chomping}\n" + "".join(
+        f"{indent}{line}\n" if line else "\n" for line in lines
+    )
 
 
 class Context:
-    messages: List[Message]
+    DEFAULT_BRANCH: str = "main"
     system: Message
 
-    def __init__(self, model: OpenAiModel):
+    def __init__(self, model: OpenAiModel, keep_tokens: int | None = None):
+        """
+        With `keep_tokens`, only the newest messages that fit into that many
+        tokens stay in memory; older ones are spilled to a temporary file and
+        read back when needed.
+        """
         self.model = model
         self.system = Message(role=Role.system, content=None, model=self.model)
-        self.messages = []
+        # Newest message of every branch: branches share their common prefix
+        self.branches: Dict[str, Node | None] = {self.DEFAULT_BRANCH: None}
+        self.branch = self.DEFAULT_BRANCH
+        self.keep_tokens = keep_tokens
+        self._spill_store: SpillStore | None = None
+
+    @property
+    def head(self) -> Node | None:
+        return self.branches[self.branch]
+
+    @head.setter
+    def head(self, node: Node | None):
+        self.branches[self.branch] = node
+
+    @property
+    def messages(self) -> List[Message]:
+        "Messages of the current branch, oldest first (spilled ones are read back)."
+        return history.messages(self.head)
+
+    def iter_messages(self) -> Iterator[Message]:
+        "Like `messages`, but reads spilled messages back one at a time."
+        for node in history.nodes(self.head):
+            yield node.message
+
+    @property
+    def n_messages(self) -> int:
+        return self.head.depth if self.head is not None else 0
+
+    @property
+    def last_message(self) -> Message | None:
+        return self.head.message if self.head is not None else None
 
     def add_message(self, message: Message) -> Context:
-        self.messages.append(message)
+        self.head = Node(message, self.head)
+        if self.keep_tokens is not None:
+            self._spill()
         return self
 
-    def save(self, filepath: str):
-        messages = [
-            message.model_dump(mode="json", exclude=["model", "n_tokens"])  # type: ignore
-            for message in self.messages
-        ]
-        if self.is_system_set():
-            messages.insert(
-                0,
-                self.system.model_dump(mode="json", exclude=["model", "n_tokens"]),  # type: ignore
-            )
+    def set_keep_tokens(self, keep_tokens: int | None) -> Context:
+        self.keep_tokens = keep_tokens
+        if keep_tokens is not None:
+            self._spill()
+        return self
+
+    def _spill(self):
+        "Spill the messages of the current branch that are older than `keep_tokens`."
+        kept = 0
+        for node in history.ancestors(self.head):
+            if node.spilled:
+                break  # everything older was spilled before
+            if kept > self.keep_tokens:  # type: ignore (only called when set)
+                if self._spill_store is None:
+                    self._spill_store = SpillStore(self.model)
+                node.spill(self._spill_store)
+            else:
+                kept += node.n_tokens
 
+    def pop_message(self) -> Message:
+        node = self.head
+        if node is None:
+            raise IndexError("There are no messages to remove.")
+        self.head = node.parent
+        return node.message
+
+    def fork(self, name: str) -> Context:
+        "Start a new branch from the current message and switch to it."
+        if name in self.branches:
+            raise ValueError(f"Branch '{name}' already exists.")
+        self.branches[name] = self.head
+        self.branch = name
+        return self
+
+    def switch(self, name: str) -> Context:
+        if name not in self.branches:
+            raise ValueError(f"There is no branch '{name}'.")
+        self.branch = name
+        return self
+
+    def rewind(self, n: int) -> Context:
+        "Drop the last `n` messages of the current branch."
+        depth = self.head.depth if self.head is not None else 0
+        if not 0 <= n <= depth:
+            raise ValueError(f"Cannot rewind {n} messages: the branch has {depth}.")
+        self.head = history.rewind(self.head, n)
+        return self
+
+    @traced("context.save")
+    def save(self, filepath: str, partial: Message | None = None):
+        """Save the conversation as YAML.
+
+        `partial` is a reply that is still being received: it is written after
+        the other messages without being added to the context. Paths ending
+        with `.gptz` are written as compressed archives instead.
+
+        Other branches go to a `<filepath>.branches.yaml` sidecar, which only
+        stores the messages where they diverge from an already stored branch.
+        Token counts go to a `<filepath>.tokens.json` sidecar, so that loading
+        does not count them again.
+        """
+        # Streamed, so spilled messages are read back one at a time
+        messages: Iterable[Message] = self.iter_messages()
+        counts: Dict[str, int] = {}
+        if partial is None:  # branches do not change while a reply streams in
+            self._save_branches(filepath, counts)
+            self._record_count(self.system, counts)
+            messages = self._count(messages, counts)
+        else:
+            messages = itertools.chain(messages, [partial])
+
+        if filepath.endswith(archive.SUFFIX):
+            archive.write_archive(filepath, self.system, messages)
+        else:
+            if self.is_system_set():
+                messages = itertools.chain([self.system], messages)
+            self._write_yaml(filepath, messages)
+
+        if partial is None:
+            self._save_token_counts(filepath, counts)
+
+    @staticmethod
+    def _record_count(message: Message, counts: Dict[str, int]):
+        text = message.counted_text
+        if text is not None:
+            counts[token_count_key(text, message.model.name)] = message.n_tokens
+
+    def _count(
+        self, messages: Iterable[Message], counts: Dict[str, int]
+    ) -> Iterator[Message]:
+        "Pass `messages` through, collecting their token counts into `counts`."
+        for message in messages:
+            self._record_count(message, counts)
+            yield message
+
+    @staticmethod
+    def _write_yaml(filepath: str, messages: Iterable[Message]):
         # Instead of using pyyaml or ruamel.yaml, we'll just write the YAML file:
         # couldn't implement the formatting I liked with these libs
-        with open(filepath, "w") as file:
+        # Write to a temporary file first, so a crash never leaves a truncated file
+        tmp_filepath = f"{filepath}.tmp"
+        with open(tmp_filepath, "w") as file:
             for message in messages:
-                file.write(f"- role: {message['role']}\n")
-                file.write("  content: >-\n")
-                wrapped = textwrap.wrap(
-                    message["content"],
-                    width=80,
-                    replace_whitespace=False,
-                )
-                indent = 4 * " "
-                for _ in wrapped:
-                    for line in _.split("\n"):
-                        file.write(f"{indent}{line}\n")
+                file.write(f"- role: {message.role.value}\n")
+                if message.incomplete:
+                    file.write("  incomplete: true\n")
+                # JSON is valid YAML and keeps ids and arguments exact
+                if message.tool_call_id is not None:
+                    file.write(f"  tool_call_id: {json.dumps(message.tool_call_id)}\n")
+                if message.tool_calls:
+                    file.write(f"  tool_calls: {json.dumps(message.tool_calls)}\n")
+                # Exact, so token counts are found again by the content's hash
+                content = message.content or ""  # only the system one can be None
+                file.write(f"  content:{_yaml_text(content)}")
+                # The text before compaction
+                if message.original is not None:
+                    file.write(f"  original:{_yaml_text(message.original)}")
+        os.replace(tmp_filepath, filepath)
+
+    @traced("context.load")
+    def load(self, filepath: str | io.TextIOWrapper, max_tokens: int | None = None):
+        """Load a YAML transcript or a compressed archive.
+
+        For archives, `max_tokens` limits loading to the newest messages that
+        fit into that many tokens; YAML files are always loaded in full.
+        """
+        path = (
+            filepath if isinstance(filepath, str) else getattr(filepath, "name", None)
+        )
+        counts = self._load_token_counts(path) if path is not None else {}
+
+        if isinstance(filepath, str) and archive.is_archive(filepath):
+            system, messages = archive.read_archive(
+                filepath, model=self.model, max_tokens=max_tokens
+            )
+            if system is not None:
+                self.set_system(system)
+                self._use_count(self.system, counts)
+            for message in messages:
+                self.add_message(self._use_count(message, counts))
+            if max_tokens is None:  # fork points need the whole history
+                self._load_branches(filepath, counts)
+            return self
 
-    def load(self, filepath: str | io.TextIOWrapper):
         if isinstance(filepath, str):
             messages = yaml.safe_load(open(filepath, "r"))
         else:
@@ -60,16 +252,119 @@ class Context:
             match m["role"]:
                 case "system":
                     self.set_system(m["content"])
-                case "user" | "assistant":
-                    message = Message(
-                        role=Role(m["role"]), content=m["content"], model=self.model
-                    )
-                    self.add_message(message)
+                    self._use_count(self.system, counts)
+                case "user" | "assistant" | "tool":
+                    message = Message.from_record(m, self.model)
+                    self.add_message(self._use_count(message, counts))
                 case _:
                     raise ValueError(f"Unknown role: {m['role']} in file {filepath}.")
 
+        if path is not None:
+            self._load_branches(path, counts)
         return self
 
+    @staticmethod
+    def _token_counts_filepath(filepath: str) -> str:
+        return f"{filepath}.tokens.json"
+
+    def _save_token_counts(self, filepath: str, counts: Dict[str, int]):
+        tmp_filepath = f"{self._token_counts_filepath(filepath)}.tmp"
+        with open(tmp_filepath, "w") as file:
+            json.dump(counts, file)
+        os.replace(tmp_filepath, self._token_counts_filepath(filepath))
+
+    def _load_token_counts(self, filepath: str) -> Dict[str, int]:
+        # Only a cache: if it is missing or broken, tokens are counted again
+        try:
+            with open(self._token_counts_filepath(filepath), "r") as file:
+                counts = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return counts if isinstance(counts, dict) else {}
+
+    @staticmethod
+    def _use_count(message: Message, counts: Dict[str, int]) -> Message:
+        "Take the stored count if it is for the same content and encoding."
+        text = message.counted_text
+        if counts and text is not None:
+            n_tokens = counts.get(token_count_key(text, message.model.name))
+            if isinstance(n_tokens, int):
+                message.set_n_tokens(n_tokens)
+        return message
+
+    @staticmethod
+    def _branches_filepath(filepath: str) -> str:
+        return f"{filepath}.branches.yaml"
+
+    def _save_branches(self, filepath: str, counts: Dict[str, int]):
+        branches_filepath = self._branches_filepath(filepath)
+        if len(self.branches) == 1:
+            if os.path.exists(branches_filepath):
+                os.remove(branches_filepath)  # stale: the branches were merged away
+            return
+
+        # Branch that holds every node that is already stored
+        stored = {id(node): self.branch for node in history.ancestors(self.head)}
+        entries = []
+        for name, head in self.branches.items():
+            if name == self.branch:
+                continue
+            suffix = []
+            node = head
+            while node is not None and id(node) not in stored:
+                suffix.append(node)
+                node = node.parent
+            suffix.reverse()
+            for n in suffix:
+                self._record_count(n.message, counts)
+            entries.append(
+                {
+                    "name": name,
+                    "parent": stored[id(node)] if node is not None else self.branch,
+                    "fork_depth": node.depth if node is not None else 0,
+                    "messages": [n.message.to_record() for n in suffix],
+                }
+            )
+            stored.update((id(n), name) for n in suffix)
+
+        tmp_filepath = f"{branches_filepath}.tmp"
+        with open(tmp_filepath, "w") as file:
+            yaml.safe_dump(
+                {"current": self.branch, "branches": entries},
+                file,
+                sort_keys=False,
+                allow_unicode=True,
+            )
+        os.replace(tmp_filepath, branches_filepath)
+
+    def _load_branches(self, filepath: str, counts: Dict[str, int]):
+        branches_filepath = self._branches_filepath(filepath)
+        if not os.path.exists(branches_filepath):
+            return
+        with open(branches_filepath, "r") as file:
+            saved = yaml.safe_load(file)
+
+        # The main file holds the branch that was current when saving
+        self.branches = {saved["current"]: self.head}
+        self.branch = saved["current"]
+        for entry in saved["branches"]:
+            if entry["parent"] not in self.branches:
+                raise ValueError(
+                    f"Branch '{entry['name']}' in {branches_filepath} forks from "
+                    f"unknown branch '{entry['parent']}'."
+                )
+            node = history.at_depth(self.branches[entry["parent"]], entry["fork_depth"])
+            for m in entry["messages"]:
+                message = Message.from_record(m, self.model)
+                node = Node(self._use_count(message, counts), node)
+            self.branches[entry["name"]] = node
+
+    @property
+    def n_tokens(self) -> int:
+        "Number of tokens in the whole conversation, including the system message."
+        # Nodes keep running totals, so this does not re-count the history
+        return self.system.n_tokens + (self.head.tokens if self.head else 0)
+
     def is_system_set(self) -> bool:
         return self.system.content is not None
 
@@ -84,17 +379,24 @@ class Context:
     ) -> List[Message]:
         context_tokens = self.system.n_tokens
         context = []
-        for message in reversed(self.messages):
+        for node in history.ancestors(self.head):
+            # Token counts are kept in memory, so spilled messages are only
+            # read back if they fit
+            n_tokens = node.n_tokens
             # Will token count be ok?
-            ok_to_add = (context_tokens + message.n_tokens) <= max_context_tokens
+            ok_to_add = (context_tokens + n_tokens) <= max_context_tokens
             # Will message count be ok?
             ok_to_add = ok_to_add and (len(context) < max_messages)
 
             if ok_to_add:
-                context.insert(0, message)
-                context_tokens += message.n_tokens
+                context.append(node.message)
+                context_tokens += n_tokens
             else:
                 break
+        context.reverse()
+        # A tool result is only valid after the reply that asked for it
+        while context and context[0].role == Role.tool:
+            context.pop(0)
 
         if self.is_system_set():
             context.insert(0, self.system)
@@ -103,18 +405,17 @@ class Context:
 
     @staticmethod
     def _context2dict(history: List[Message]) -> List[Dict[str, str]]:
-        messages = []
-        for message in history:
-            messages.append({"role": message.role.value, "content": message.content})
-
-        return messages
+        # Cached per message, so building a request does not re-encode history
+        return [message.to_request() for message in history]
 
     def get_messages(
         self,
         max_context_tokens: int = 2048,
         max_messages: int = 32 * 1024,  # just a very large number
     ) -> List[Dict[str, str]]:
-        context = self._get_context(
-            max_context_tokens=max_context_tokens, max_messages=max_messages
-        )
-        return self._context2dict(context)
+        with span("context.get_context"):
+            context = self._get_context(
+                max_context_tokens=max_context_tokens, max_messages=max_messages
+            )
+        with span("context.to_dict", n_messages=len(context)):
+            return self._context2dict(context)
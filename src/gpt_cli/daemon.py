@@ -0,0 +1,256 @@
+"""A warm background process that serves completions and token counts.
+
+Every `gpt-cli` invocation otherwise loads BPE encodings and opens new HTTPS
+connections. `gpt-cli serve` keeps both around and answers requests over a Unix
+socket using newline-delimited JSON: the client sends one request per
+connection and reads back one or more JSON lines.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import socketserver
+from functools import lru_cache
+from typing import Any, Dict, Iterator
+
+import openai
+import requests
+from openai.util import convert_to_openai_object
+
+from gpt_cli import pretty
+
+from . import tokens, transport
+from .constants import CONFIG_DIR, DAEMON_SOCKET_FILENAME
+from .model import ModelName
+from .payload import encode_request
+from .timeouts import StreamTimeout
+from .tokens import count_tokens
+
+SOCKET_PATH = os.path.join(CONFIG_DIR, DAEMON_SOCKET_FILENAME)
+
+
+class DaemonError(Exception):
+    pass
+
+
+def _write(wfile, payload: Dict[str, Any]) -> None:
+    wfile.write(json.dumps(payload).encode() + b"\n")
+    wfile.flush()
+
+
+def _error_payload(e: Exception) -> Dict[str, Any]:
+    return {
+        "error": type(e).__name__,
+        "message": str(e),
+        "http_status": getattr(e, "http_status", None),
+    }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            match request["method"]:
+                case "ping":
+                    _write(self.wfile, {"result": os.getpid()})
+                case "shutdown":
+                    _write(self.wfile, {"result": True})
+                    # Handlers run in their own threads, so this does not deadlock
+                    self.server.shutdown()
+                case "count_tokens":
+                    n_tokens = count_tokens(
+                        request["text"], ModelName(request["model"])
+                    )
+                    _write(self.wfile, {"result": n_tokens})
+                case "chat_completion":
+                    self._chat_completion(request["params"])
+                case method:
+                    raise DaemonError(f"Unknown method: {method}.")
+        except (BrokenPipeError, ConnectionResetError):
+            return  # the client went away, e.g. after a stop condition
+        except Exception as e:
+            try:
+                _write(self.wfile, _error_payload(e))
+            except OSError:
+                pass  # nobody left to report to
+
+    def _chat_completion(self, params: Dict[str, Any]):
+        response = transport.create_completion(**params)
+        if not params.get("stream"):
+            _write(self.wfile, {"result": response.to_dict_recursive()})  # type: ignore
+            return
+        # The request was accepted: errors from now on end a started stream
+        _write(self.wfile, {"started": True})
+        for chunk in response:
+            _write(self.wfile, {"chunk": chunk.to_dict_recursive()})  # type: ignore
+        _write(self.wfile, {"done": True})
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _warm_up():
+    # One session for all handler threads, so HTTPS connections are reused
+    openai.requestssession = requests.Session()
+    for model in ModelName:
+        try:
+            count_tokens("warm up", model)
+        except Exception:
+            pass  # Encodings that cannot be loaded are loaded on first use
+
+
+def serve(path: str = SOCKET_PATH):
+    "Run the daemon in the foreground until it is asked to shut down."
+    if os.path.exists(path):
+        if DaemonClient.connect(path) is not None:
+            raise DaemonError(f"A daemon is already listening on {path}.")
+        os.remove(path)  # Stale socket left by a crashed daemon
+
+    _warm_up()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # The daemon forwards the API key, so the socket is private from the start:
+    # with a chmod after `bind` it would briefly have the default permissions
+    umask = os.umask(0o177)
+    try:
+        server = DaemonServer(path, _Handler)
+    finally:
+        os.umask(umask)
+    with server:
+        pretty.print(f"Listening on {path} (pid {os.getpid()}).")
+        try:
+            server.serve_forever(poll_interval=0.2)
+        finally:
+            os.remove(path)
+
+
+class DaemonClient:
+    def __init__(self, path: str = SOCKET_PATH, api_key: str | None = None):
+        self.path = path
+        self.api_key = api_key
+        # Set when the daemon went away: requests are then sent from this process
+        self.fallen_back = False
+        # Per client, so that the cache does not keep clients alive
+        self.count_tokens = lru_cache(maxsize=4096)(self._count_tokens)
+
+    @classmethod
+    def connect(
+        cls, path: str = SOCKET_PATH, api_key: str | None = None
+    ) -> DaemonClient | None:
+        "Return a client if a daemon is listening on `path`, `None` otherwise."
+        client = cls(path=path, api_key=api_key)
+        try:
+            client.ping()
+        except (OSError, openai.error.APIConnectionError):
+            return None
+        return client
+
+    def _open(self, request: bytes) -> socket.socket:
+        "Connect and send a request; `OSError` means the daemon is not there."
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            sock.sendall(request + b"\n")
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _read(self, sock: socket.socket) -> Iterator[Dict[str, Any]]:
+        # A daemon that dies mid-request is a dropped connection to the caller,
+        # which retries (or continues a partial reply) as with the API itself
+        try:
+            with sock, sock.makefile("rb") as rfile:
+                for line in rfile:
+                    response = json.loads(line)
+                    if "error" in response:
+                        raise self._to_exception(response)
+                    yield response
+        except (OSError, ValueError) as e:
+            raise openai.error.APIConnectionError(
+                f"Lost the connection to the daemon: {e}"
+            ) from e
+        raise openai.error.APIConnectionError(
+            "The daemon closed the connection before the response was complete."
+        )
+
+    def _call(self, payload: Dict[str, Any]) -> Any:
+        sock = self._open(json.dumps(payload).encode())
+        responses = self._read(sock)
+        try:
+            return next(responses)["result"]
+        finally:
+            responses.close()
+
+    @staticmethod
+    def _to_exception(response: Dict[str, Any]) -> Exception:
+        # Re-raise OpenAI errors as their own types, so retries work as usual
+        if response["error"] == StreamTimeout.__name__:
+            return StreamTimeout(response["message"])
+        error_class = getattr(openai.error, response["error"], None)
+        if isinstance(error_class, type) and issubclass(
+            error_class, openai.error.OpenAIError
+        ):
+            return error_class(response["message"], http_status=response["http_status"])
+        return DaemonError(f"{response['error']}: {response['message']}")
+
+    def ping(self) -> int:
+        return self._call({"method": "ping"})
+
+    def shutdown(self) -> None:
+        self._call({"method": "shutdown"})
+
+    def _fall_back(self, e: Exception):
+        if not self.fallen_back:
+            pretty.warning(
+                f"The daemon is not responding ({e}): continuing without it."
+            )
+            self.fallen_back = True
+        if tokens.get_counter() == self.count_tokens:
+            tokens.set_counter(None)
+
+    def _count_tokens(self, text: str, model: ModelName) -> int:
+        if not self.fallen_back:
+            try:
+                return self._call(
+                    {"method": "count_tokens", "text": text, "model": model.value}
+                )
+            except (OSError, openai.error.APIConnectionError) as e:
+                self._fall_back(e)
+        return count_tokens(text, model)
+
+    def chat_completion(self, **params):
+        "Drop-in replacement for `ChatCompletion.create`."
+        if self.api_key is not None:
+            params.setdefault("api_key", self.api_key)
+        if not self.fallen_back:
+            # Messages are spliced in from their cached JSON fragments
+            request = (
+                b'{"method":"chat_completion","params":' + encode_request(params) + b"}"
+            )
+            try:
+                sock = self._open(request)
+            except OSError as e:
+                self._fall_back(e)
+            else:
+                responses = self._read(sock)
+                if params.get("stream"):
+                    # Wait until the stream starts, so that errors such as rate
+                    # limits are raised here as by `ChatCompletion.create` (and
+                    # e.g. a key pool can move on to the next key)
+                    next(responses)
+                    return self._stream(responses)
+                try:
+                    return convert_to_openai_object(next(responses)["result"])
+                finally:
+                    responses.close()
+        return transport.create_completion(**params)
+
+    @staticmethod
+    def _stream(responses: Iterator[Dict[str, Any]]):
+        for response in responses:
+            if response.get("done"):
+                return
+            yield convert_to_openai_object(response["chunk"])
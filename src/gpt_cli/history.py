@@ -0,0 +1,103 @@
+"""Persistent message history.
+
+Messages form a tree of immutable nodes: every node points to its parent, so a
+branch is just a pointer to its newest node. Forking, switching and rewinding
+move pointers and never copy messages, and branches share their common prefix.
+
+Old messages can be spilled to disk: the node keeps its place in the tree and
+its token counts, and reads the message back when it is needed.
+"""
+
+from __future__ import annotations
+
+from typing import Iterator, List
+
+from .message import Message
+from .spill import SpilledMessage, SpillStore
+
+
+class Node:
+    __slots__ = ("_message", "_spilled", "parent", "depth", "_tokens")
+
+    def __init__(self, message: Message, parent: Node | None = None):
+        self._message: Message | None = message
+        self._spilled: SpilledMessage | None = None
+        self.parent = parent
+        # Number of messages from the root up to and including this one
+        self.depth: int = 1 if parent is None else parent.depth + 1
+        # Tokens from the root up to and including this one, counted lazily
+        self._tokens: int | None = None
+
+    @property
+    def message(self) -> Message:
+        if self._message is not None:
+            return self._message
+        # The count is known, so reading the message back does not re-count it
+        return self._spilled.load().set_n_tokens(self.n_tokens)  # type: ignore
+
+    @property
+    def spilled(self) -> bool:
+        return self._message is None
+
+    def spill(self, store: SpillStore):
+        "Move the message to disk, keeping only its place and token counts."
+        self.tokens  # counted while the message is still at hand
+        if self._spilled is None:
+            self._spilled = store.write(self._message)  # type: ignore (not spilled)
+        self._message = None
+
+    @property
+    def n_tokens(self) -> int:
+        "Tokens of this message alone."
+        return self.tokens - (self.parent.tokens if self.parent is not None else 0)
+
+    @property
+    def tokens(self) -> int:
+        if self._tokens is None:
+            # Iterate instead of recursing: histories can be long
+            pending = []
+            node: Node | None = self
+            while node is not None and node._tokens is None:
+                pending.append(node)
+                node = node.parent
+            total = 0 if node is None else node._tokens
+            for node in reversed(pending):
+                total += node.message.n_tokens
+                node._tokens = total
+        return self._tokens  # type: ignore (set above)
+
+
+def ancestors(node: Node | None) -> Iterator[Node]:
+    "Iterate from `node` back to the root."
+    while node is not None:
+        yield node
+        node = node.parent
+
+
+def nodes(node: Node | None) -> List[Node]:
+    "Nodes from the root to `node`, oldest first."
+    result = list(ancestors(node))
+    result.reverse()
+    return result
+
+
+def messages(node: Node | None) -> List[Message]:
+    "Messages from the root to `node`, oldest first."
+    return [n.message for n in nodes(node)]
+
+
+def rewind(node: Node | None, n: int) -> Node | None:
+    for _ in range(n):
+        if node is None:
+            break
+        node = node.parent
+    return node
+
+
+def at_depth(node: Node | None, depth: int) -> Node | None:
+    "The ancestor of `node` that has `depth` messages (None for 0)."
+    if depth == 0:
+        return None
+    if node is None or depth > node.depth or depth < 0:
+        raise ValueError(f"There is no message number {depth} on this branch.")
+    return rewind(node, node.depth - depth)
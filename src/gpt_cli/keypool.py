@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Tuple
+
+import yaml
+from openai.error import AuthenticationError, PermissionError, RateLimitError
+from pydantic import BaseModel, Field
+from rich.table import Table
+
+from .trace import span
+
+# Requests and tokens are counted over this sliding window, as OpenAI does
+WINDOW_SECONDS = 60
+
+
+class PooledKey(BaseModel):
+    name: str
+    key: str
+    organization: str | None = None
+    rpm: int = Field(default=500, gt=0)
+    tpm: int = Field(default=200_000, gt=0)
+
+
+class KeyUsage:
+    def __init__(self):
+        # Sliding windows of request times and of (time, tokens)
+        self.request_window: Deque[float] = deque()
+        self.token_window: Deque[Tuple[float, int]] = deque()
+        self.requests = 0
+        self.tokens = 0
+        self.rate_limited = 0
+        self.cooldown_until = 0.0
+        self.disabled = False
+
+    def prune(self, now: float):
+        while self.request_window and self.request_window[0] < now - WINDOW_SECONDS:
+            self.request_window.popleft()
+        while self.token_window and self.token_window[0][0] < now - WINDOW_SECONDS:
+            self.token_window.popleft()
+
+    def headroom(self, key: PooledKey, n_tokens: int) -> float:
+        "Fraction of the tighter of the two limits left after this request."
+        window_tokens = sum(tokens for _, tokens in self.token_window)
+        return min(
+            1 - (len(self.request_window) + 1) / key.rpm,
+            1 - (window_tokens + n_tokens) / key.tpm,
+        )
+
+
+class KeyPool:
+    """Spread requests over several API keys.
+
+    Each request goes to the key with the most headroom left under its
+    requests-per-minute and tokens-per-minute limits. Keys that hit a rate
+    limit cool down for a while, keys that fail authentication are dropped,
+    and the request is retried on the next key.
+    """
+
+    COOLDOWN_SECONDS: int = 20
+
+    def __init__(self, keys: List[PooledKey]):
+        if not keys:
+            raise ValueError("Key pool should contain at least one key.")
+        self.keys = keys
+        self.usage: Dict[str, KeyUsage] = {key.name: KeyUsage() for key in keys}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, filepath: str) -> KeyPool:
+        with open(filepath, "r") as file:
+            entries = yaml.safe_load(file) or []
+        return cls([PooledKey.model_validate(entry) for entry in entries])
+
+    def acquire(self, n_tokens: int) -> PooledKey:
+        with self._lock:
+            now = time.monotonic()
+            candidates = []
+            for key in self.keys:
+                usage = self.usage[key.name]
+                usage.prune(now)
+                if usage.disabled or usage.cooldown_until > now:
+                    continue
+                candidates.append((usage.headroom(key, n_tokens), key))
+            if not candidates:
+                # Let the caller's usual retry logic wait for a key
+                raise RateLimitError("All keys in the pool are rate limited.")
+
+            _, key = max(candidates, key=lambda candidate: candidate[0])
+            usage = self.usage[key.name]
+            usage.request_window.append(now)
+            usage.token_window.append((now, n_tokens))
+            usage.requests += 1
+            usage.tokens += n_tokens
+            return key
+
+    def record_tokens(self, key: PooledKey, n_tokens: int):
+        "Account for tokens only known after the request (e.g. the completion)."
+        with self._lock:
+            usage = self.usage[key.name]
+            usage.token_window.append((time.monotonic(), n_tokens))
+            usage.tokens += n_tokens
+
+    def _rate_limited(self, key: PooledKey, e: RateLimitError):
+        with self._lock:
+            usage = self.usage[key.name]
+            usage.rate_limited += 1
+            retry_after = (e.headers or {}).get("retry-after")
+            try:
+                cooldown = float(retry_after)  # type: ignore (None is handled)
+            except (TypeError, ValueError):
+                cooldown = self.COOLDOWN_SECONDS
+            usage.cooldown_until = time.monotonic() + cooldown
+
+    def _disable(self, key: PooledKey):
+        with self._lock:
+            self.usage[key.name].disabled = True
+
+    @staticmethod
+    def _estimate_tokens(params: Dict) -> int:
+        # Scheduling only needs a rough number of prompt tokens: ~4 characters
+        # per token. Completion tokens are recorded once they are known.
+        n_chars = sum(len(m.get("content") or "") for m in params.get("messages", []))
+        return n_chars // 4
+
+    def wrap(self, create_completion: Callable) -> Callable:
+        "Return `create_completion` that runs every request on a pooled key."
+
+        def create(**params):
+            n_tokens = self._estimate_tokens(params)
+            while True:
+                key = self.acquire(n_tokens)
+                try:
+                    with span("keypool.request", key=key.name):
+                        response = create_completion(
+                            **{
+                                **params,
+                                "api_key": key.key,
+                                "organization": key.organization,
+                            }
+                        )
+                except RateLimitError as e:
+                    self._rate_limited(key, e)
+                    continue
+                except (AuthenticationError, PermissionError):
+                    self._disable(key)
+                    if all(usage.disabled for usage in self.usage.values()):
+                        raise
+                    continue
+
+                if params.get("stream"):
+                    return self._track_stream(key, response)
+                usage = response.get("usage")
+                if usage:
+                    self.record_tokens(key, usage["completion_tokens"])
+                return response
+
+        return create
+
+    def _track_stream(self, key: PooledKey, stream):
+        for chunk in stream:
+            usage = chunk.get("usage")
+            if usage:
+                self.record_tokens(key, usage["completion_tokens"])
+            yield chunk
+
+    def stats(self) -> Table:
+        table = Table(title="API key usage")
+        for column in ("Key", "Requests", "Tokens", "Rate limited", "Status"):
+            table.add_column(column, justify="left" if column == "Key" else "right")
+        now = time.monotonic()
+        for key in self.keys:
+            usage = self.usage[key.name]
+            if usage.disabled:
+                status = "disabled"
+            elif usage.cooldown_until > now:
+                status = "cooling down"
+            else:
+                status = "ok"
+            table.add_row(
+                key.name,
+                f"{usage.requests:,d}",
+                f"{usage.tokens:,d}",
+                f"{usage.rate_limited:,d}",
+                status,
+            )
+        return table
@@ -1,23 +1,39 @@
+import functools
 import os
 from importlib import metadata
-from typing import List, Optional, Tuple, Annotated
+from typing import Annotated, Callable, List, Optional, Tuple
 
 import rich
 import rich.prompt
+from rich.markdown import Markdown
 import typer
 from pydantic import ValidationError
 
 import gpt_cli
-from gpt_cli import pretty
+from gpt_cli import pretty, trace
 
+from . import archive, tokens, transport
 from .chat import Chat, Context
+from .cassette import Player, Recorder
+from .compare import Comparison
+from .constants import DEFAULT_REDUCE_PROMPT
+from .daemon import SOCKET_PATH, DaemonClient, DaemonError, serve as serve_daemon
 from .key import OpenaiApiKey
+from .keypool import KeyPool
+from .mapreduce import Checkpoint, MapReduce
+from .message import Message
 from .model import OpenAiModel, ModelName
+from .role import Role
+from .router import AUTO_MODEL, LatencyHistory, ModelRouter
+from .sessions import SessionManager
+from .stops import parse_stop_condition
+from .tools import ToolRegistry
 
 app = typer.Typer(rich_markup_mode="markdown")
 
 PANE_TITLES = {
     "context": "Conversation context",
+    "mapreduce": "Map-reduce",
     "authentication": "Authentication",
     "params": "Model parameters, more in-depth documentation [link=https://platform.openai.com/docs/api-reference/chat/create]here[/link]",
 }
@@ -28,6 +44,38 @@ INPUT_OPTION = typer.Option(
     show_default=False,
     rich_help_panel=PANE_TITLES["context"],
 )
+DYNAMIC_BUDGET_OPTION = typer.Option(
+    False,
+    "--dynamic-budget",
+    help=(
+        "Split the model's window between context and output on every turn, "
+        "based on the history size and the length of recent replies. "
+        "Max token options still apply as upper bounds."
+    ),
+    rich_help_panel=PANE_TITLES["context"],
+)
+COMPACT_OPTION = typer.Option(
+    False,
+    "--compact",
+    help=(
+        "Compact your messages before sending them: normalize whitespace "
+        "outside code blocks, collapse repeated lines and omit blocks that are "
+        "already in the context. The original text is saved as well."
+    ),
+    rich_help_panel=PANE_TITLES["context"],
+)
+MEMORY_MARGIN_OPTION = typer.Option(
+    None,
+    help=(
+        "Keep only the context window plus this many tokens of history in "
+        "memory and spill older messages to a temporary file, so long sessions "
+        "use constant memory. By default the whole history stays in memory."
+    ),
+    metavar="TOKENS",
+    min=0,
+    rich_help_panel=PANE_TITLES["context"],
+    show_default=False,
+)
 OUTPUT_OPTION = typer.Option(
     None,
     help="Output the whole conversation to a file.",
@@ -41,6 +89,17 @@ MAX_CONTEXT_TOKENS_OPTION = typer.Option(
     rich_help_panel=PANE_TITLES["context"],
     show_default=False,
 )
+KEY_POOL_OPTION = typer.Option(
+    None,
+    help=(
+        "YAML file listing several API keys (`name`, `key`, optional "
+        "`organization`, `rpm` and `tpm`): requests go to the key with the most "
+        "headroom and move on to another key on rate limit or auth errors."
+    ),
+    metavar="PATH",
+    show_default=False,
+    rich_help_panel=PANE_TITLES["authentication"],
+)
 API_KEY_OPTION = typer.Option(
     None,
     help="OpenAI API key (run `gpt-cli init` to avoid passing it each time).",
@@ -70,7 +129,7 @@ TOP_P_OPTION = typer.Option(
 )
 MODEL_OPTION = typer.Option(
     "gpt-4o-mini",
-    help="Model name, check [here](https://platform.openai.com/docs/models/model-endpoint-compatibility) for alternative models.",
+    help="Model name, check [here](https://platform.openai.com/docs/models/model-endpoint-compatibility) for alternative models. `chat` also accepts `auto` to pick a model on every turn.",
     rich_help_panel=PANE_TITLES["params"],
     show_default=False,
 )
@@ -94,12 +153,45 @@ FREQUENCY_PENALTY_OPTION = typer.Option(
     help="Penalty for repeating already frequent words.",
     rich_help_panel=PANE_TITLES["params"],
 )
+N_CHOICES_OPTION = typer.Option(
+    1,
+    "--n",
+    min=1,
+    help=(
+        "Number of candidate replies to generate on every turn; they are shown "
+        "side by side and you pick the one that stays in the conversation."
+    ),
+    rich_help_panel=PANE_TITLES["params"],
+)
+ROUTING_RULES_OPTION = typer.Option(
+    None,
+    help=(
+        "YAML file with the rules for `--model auto`: a list of entries with "
+        "`models` and an optional `max_prompt_tokens`, tried in order."
+    ),
+    metavar="PATH",
+    show_default=False,
+    rich_help_panel=PANE_TITLES["params"],
+)
 STOP_OPTION = typer.Option(
     None,
     help="Stop sequence(s).",
     rich_help_panel=PANE_TITLES["params"],
     show_default=False,
 )
+STOP_WHEN_OPTION = typer.Option(
+    None,
+    "--stop-when",
+    help=(
+        "Stop the reply on the client as soon as a condition holds: "
+        "`regex:PATTERN` (cut before the match), `fence` (a code block is "
+        "closed), `json` (a JSON object is complete) or `lines:N`. "
+        "Can be repeated; applies in addition to `--stop`."
+    ),
+    metavar="CONDITION",
+    rich_help_panel=PANE_TITLES["params"],
+    show_default=False,
+)
 NOWARNING_OPTION = typer.Option(
     False,
     "--nowarning",
@@ -115,6 +207,222 @@ NOSTREAM_OPTION = typer.Option(
     "--no-stream",
     help="Do not stream the chat.",
 )
+CONNECT_TIMEOUT_OPTION = typer.Option(
+    10,
+    help="Seconds to wait for a connection to the API, 0 for no limit.",
+    min=0,
+)
+FIRST_TOKEN_TIMEOUT_OPTION = typer.Option(
+    120,
+    help=(
+        "Seconds to wait for the first token of a streamed reply, "
+        "including the model's thinking time, 0 for no limit."
+    ),
+    min=0,
+)
+CHUNK_TIMEOUT_OPTION = typer.Option(
+    30,
+    help=(
+        "Seconds to wait for the next chunk of a streamed reply. If the stream "
+        "stalls or drops, the received part is kept and the model is asked to "
+        "continue it. 0 for no limit."
+    ),
+    min=0,
+)
+SESSIONS_OPTION = typer.Option(
+    False,
+    "--sessions",
+    help=(
+        "Run several conversations at once: replies are generated in the "
+        "background while you use other sessions."
+    ),
+)
+LEAN_STREAM_OPTION = typer.Option(
+    False,
+    "--lean-stream",
+    help=(
+        "Parse streamed replies with a minimal parser instead of the openai "
+        "client's, which uses less CPU per chunk. Only applies to requests "
+        "sent from this process, not through the daemon."
+    ),
+)
+TOOLS_OPTION = typer.Option(
+    False,
+    "--tools",
+    help=(
+        "Let the model read files and search them with grep in the current "
+        "directory. Calls of one reply run in parallel and their results are "
+        "added to the conversation."
+    ),
+)
+ALLOW_COMMAND_OPTION = typer.Option(
+    None,
+    "--allow-command",
+    help=(
+        "Let the model run this program in the current directory (without a "
+        "shell); implies --tools. Can be repeated."
+    ),
+    metavar="PROGRAM",
+    show_default=False,
+)
+RECORD_OPTION = typer.Option(
+    None,
+    "--record",
+    help=(
+        "Record requests, replies and the timings of streamed chunks to a "
+        "cassette file, to replay them later with --replay."
+    ),
+    metavar="PATH",
+)
+REPLAY_OPTION = typer.Option(
+    None,
+    "--replay",
+    help=(
+        "Answer requests from a cassette recorded with --record instead of "
+        "the API, at the recorded pace. No API key is needed."
+    ),
+    metavar="PATH",
+)
+REPLAY_FAST_OPTION = typer.Option(
+    False,
+    "--replay-fast",
+    help="With --replay, send the recorded chunks without waiting between them.",
+)
+NODAEMON_OPTION = typer.Option(
+    False,
+    "--no-daemon",
+    help="Do not use a running `gpt-cli serve` daemon, even if there is one.",
+)
+SOCKET_OPTION = typer.Option(
+    SOCKET_PATH,
+    help="Unix socket of the daemon.",
+    metavar="PATH",
+)
+STOP_DAEMON_OPTION = typer.Option(
+    False,
+    "--stop",
+    help="Stop a running daemon.",
+)
+PROFILE_OPTION = typer.Option(
+    None,
+    "--profile",
+    help=(
+        "Profile the session and write the results to a file: a Chrome "
+        "trace-event JSON if the path ends with `.json`, a cProfile dump otherwise."
+    ),
+    metavar="PATH",
+    show_default=False,
+)
+
+
+MAP_PROMPT_OPTION = typer.Option(
+    ...,
+    help="Prompt applied to every chunk of the inputs.",
+    rich_help_panel=PANE_TITLES["mapreduce"],
+)
+REDUCE_PROMPT_OPTION = typer.Option(
+    DEFAULT_REDUCE_PROMPT,
+    help="Prompt that combines the results of the map prompt.",
+    rich_help_panel=PANE_TITLES["mapreduce"],
+    show_default=False,
+)
+CHUNK_TOKENS_OPTION = typer.Option(
+    8_000,
+    min=1,
+    help="Max number of tokens in a chunk.",
+    rich_help_panel=PANE_TITLES["mapreduce"],
+)
+COMPARE_MODELS_OPTION = typer.Option(
+    ...,
+    "--model",
+    help="Model to compare, repeat the option for every model.",
+    rich_help_panel=PANE_TITLES["params"],
+    show_default=False,
+)
+REPEAT_OPTION = typer.Option(
+    1,
+    min=1,
+    help="Number of rounds: with more than one, the table shows percentiles.",
+)
+API_BASE_OPTION = typer.Option(
+    None,
+    help=(
+        "Base URL of an OpenAI-compatible API, e.g. a local stand-in. "
+        "No API key is needed with it."
+    ),
+    metavar="URL",
+    show_default=False,
+    rich_help_panel=PANE_TITLES["authentication"],
+)
+CONCURRENCY_OPTION = typer.Option(
+    4,
+    min=1,
+    help="Max number of requests running at the same time.",
+    rich_help_panel=PANE_TITLES["mapreduce"],
+)
+CHECKPOINT_OPTION = typer.Option(
+    None,
+    help="Store finished requests in this file and skip them when rerunning.",
+    metavar="PATH",
+    show_default=False,
+    rich_help_panel=PANE_TITLES["mapreduce"],
+)
+
+
+def parse_model(model: str) -> OpenAiModel:
+    try:
+        return OpenAiModel(name=ModelName(model))
+    except (ValidationError, ValueError):
+        pretty.error(
+            f'Model "{model}" is not supported. '
+            "Check the list of supported models here: "
+            "https://platform.openai.com/docs/models/model-endpoint-compatibility."
+        )
+        raise typer.Abort()
+
+
+def get_router(model: str, rules_filepath: str | None) -> ModelRouter | None:
+    if model != AUTO_MODEL:
+        if rules_filepath is not None:
+            pretty.warning("Ignoring --routing-rules because --model is not 'auto'.")
+        return None
+    rules = None
+    if rules_filepath is not None:
+        try:
+            rules = ModelRouter.load_rules(rules_filepath)
+        except (OSError, ValueError) as e:  # pydantic's ValidationError is a ValueError
+            pretty.error(f"Could not load routing rules from {rules_filepath}: {e}")
+            raise typer.Abort()
+    return ModelRouter(rules=rules, history=LatencyHistory())
+
+
+def load_key_pool(filepath: str | None) -> KeyPool | None:
+    if filepath is None:
+        return None
+    try:
+        return KeyPool.load(filepath)
+    except (OSError, ValueError) as e:  # pydantic's ValidationError is a ValueError
+        pretty.error(f"Could not load key pool from {filepath}: {e}")
+        raise typer.Abort()
+
+
+def get_create_completion(
+    nodaemon: bool, pool: KeyPool | None, lean_stream: bool = False
+) -> Callable:
+    "Build the function that sends chat completion requests."
+    create_completion = transport.create_completion
+    if lean_stream:
+        create_completion = functools.partial(create_completion, lean_stream=True)
+
+    # Use the warm daemon if it is running, fall back to in-process otherwise
+    daemon = None if nodaemon else DaemonClient.connect()
+    if daemon is not None:
+        tokens.set_counter(daemon.count_tokens)
+        create_completion = daemon.chat_completion
+
+    if pool is not None:
+        create_completion = pool.wrap(create_completion)
+    return create_completion
 
 
 def validate_model_parameters(
@@ -184,6 +492,53 @@ def deinit(noconfirm: bool = NOCONFIRM_OPTION):
     os.remove(api_key_path)
 
 
+@app.command()
+def serve(socket: str = SOCKET_OPTION, stop: bool = STOP_DAEMON_OPTION):
+    """Run a background daemon that keeps encodings and connections warm.
+
+    While it is running, `chat` sends its requests through the daemon instead
+    of paying the start-up cost on every invocation.
+    """
+    if stop:
+        client = DaemonClient.connect(socket)
+        if client is None:
+            pretty.warning(f"No daemon is listening on {socket}: nothing to stop.")
+            return
+        client.shutdown()
+        return
+
+    try:
+        serve_daemon(socket)
+    except DaemonError as e:
+        pretty.error(str(e))
+        raise typer.Abort()
+
+
+@app.command()
+def convert(
+    source: str = typer.Argument(..., help="Transcript to convert."),
+    destination: str = typer.Argument(
+        ...,
+        help=(
+            "Converted transcript: a compressed archive if it ends with "
+            f"`{archive.SUFFIX}`, YAML otherwise."
+        ),
+    ),
+    model: str = MODEL_OPTION,  # type: ignore
+):
+    """Convert transcripts between YAML and compressed archives.
+
+    Archives store token counts in an index, so `chat --input` can read only
+    the messages that fit into the context window.
+    """
+    model: OpenAiModel = parse_model(model)
+    try:
+        Context(model=model).load(source).save(destination)
+    except (OSError, ValueError) as e:
+        pretty.error(str(e))
+        raise typer.Abort()
+
+
 def print_version_callback(version: bool):
     if version:
         pretty.print(f"Version: {metadata.version(gpt_cli.__name__)}")
@@ -218,6 +573,9 @@ def chat(
     input: Optional[typer.FileText] = INPUT_OPTION,
     output: str = OUTPUT_OPTION,
     max_context_tokens: Optional[int] = MAX_CONTEXT_TOKENS_OPTION,
+    dynamic_budget: bool = DYNAMIC_BUDGET_OPTION,
+    memory_margin: Optional[int] = MEMORY_MARGIN_OPTION,
+    compact: bool = COMPACT_OPTION,
     model: str = MODEL_OPTION,  # type: ignore
     system: Optional[str] = SYSTEM_OPTION,
     max_output_tokens: Optional[int] = MAX_OUTPUT_TOKENS_OPTION,
@@ -226,33 +584,75 @@ def chat(
     presence_penalty: float = PRESENCE_PENALTY_OPTION,
     frequency_penalty: float = FREQUENCY_PENALTY_OPTION,
     stop: Optional[List[str]] = STOP_OPTION,
+    stop_when: Optional[List[str]] = STOP_WHEN_OPTION,
+    n_choices: int = N_CHOICES_OPTION,
+    routing_rules: Optional[str] = ROUTING_RULES_OPTION,
     nowarning: bool = NOWARNING_OPTION,
     openai_api_key: str = API_KEY_OPTION,  # type: ignore
     nostream: bool = NOSTREAM_OPTION,
+    connect_timeout: float = CONNECT_TIMEOUT_OPTION,
+    first_token_timeout: float = FIRST_TOKEN_TIMEOUT_OPTION,
+    chunk_timeout: float = CHUNK_TIMEOUT_OPTION,
+    lean_stream: bool = LEAN_STREAM_OPTION,
+    sessions: bool = SESSIONS_OPTION,
+    tools: bool = TOOLS_OPTION,
+    allow_command: Optional[List[str]] = ALLOW_COMMAND_OPTION,
+    key_pool: Optional[str] = KEY_POOL_OPTION,
+    nodaemon: bool = NODAEMON_OPTION,
+    record: Optional[str] = RECORD_OPTION,
+    replay: Optional[str] = REPLAY_OPTION,
+    replay_fast: bool = REPLAY_FAST_OPTION,
+    profile: Optional[str] = PROFILE_OPTION,
 ):
     """Start an interactive chat.
 
     For multiline inputs use backslashes or use Meta + Enter (sometimes it does
     not work, then try Esc + Enter).
 
-    Type "exit" or press Ctrl + C to exit the chat.
+    Type "exit" or press Ctrl + C to exit the chat. Type "/regenerate [N]" to
+    replace the last reply with a new one, or pick from N new candidates.
+    "/branch NAME" forks the conversation, "/switch [NAME]" lists branches or
+    switches to one, and "/rewind N" drops the last N messages.
+
+    With "--model auto", the model is picked on every turn from the prompt size
+    and the latencies observed so far.
+
+    With "--sessions", "/new NAME [OUTPUT]" starts another conversation (saved
+    to OUTPUT, if given), "/session NAME" switches to it and "/sessions" lists
+    them all.
+
+    With "--tools", the model can read and search files in the current
+    directory, and run the programs allowed with "--allow-command".
     """
-    openai_api_key: OpenaiApiKey = OpenaiApiKey(openai_api_key)
+    if replay is not None:
+        # A replay answers everything from the cassette, no key is needed
+        pool, api_key = None, None
+        try:
+            create_completion: Callable = Player(replay, realtime=not replay_fast)
+        except (OSError, ValueError) as e:
+            pretty.error(f"Could not load cassette from {replay}: {e}")
+            raise typer.Abort()
+    else:
+        pool = load_key_pool(key_pool)
+        # A key pool brings its own keys, so there is no need for the default one
+        api_key = OpenaiApiKey(openai_api_key) if pool is None else None
+        create_completion = get_create_completion(nodaemon, pool, lean_stream)
+    if record is not None:
+        create_completion = Recorder(record, create_completion)
 
-    try:
-        model: OpenAiModel = OpenAiModel(name=ModelName(model))
-    except ValidationError:
-        pretty.error(
-            f'Model "{model}" is not supported. '
-            "Check the list of supported models here: "
-            "https://platform.openai.com/docs/models/model-endpoint-compatibility."
-        )
-        raise typer.Abort()
+    router = get_router(model, routing_rules)
+    model: OpenAiModel = router.largest_model if router else parse_model(model)
 
     # Load context if provided
     if input:
         try:
-            context = Context(model=model).load(input)
+            if archive.is_archive(input.name):
+                # Without an output file nothing can be lost by only reading
+                # the messages that fit into the model's window
+                max_tokens = None if output else model.max_context_tokens
+                context = Context(model=model).load(input.name, max_tokens=max_tokens)
+            else:
+                context = Context(model=model).load(input)
         except ValueError as e:
             pretty.error(str(e))
             raise typer.Abort()
@@ -273,11 +673,16 @@ def chat(
     temperature, top_p, stop = validate_model_parameters(
         temperature, top_p, stop, nowarning
     )
+    for spec in stop_when or []:
+        try:
+            parse_stop_condition(spec)
+        except ValueError as e:
+            pretty.error(str(e))
+            raise typer.Abort()
 
     # Create the chat
-    chat = Chat(
-        api_key=openai_api_key,
-        out=output,
+    chat_params = dict(
+        api_key=api_key,
         system=system,
         model=model,
         stop=stop,
@@ -287,10 +692,173 @@ def chat(
         top_p=top_p,
         presence_penalty=presence_penalty,
         frequency_penalty=frequency_penalty,
-        context=context,
         stream_output=not nostream,
+        create_completion=create_completion,
+        dynamic_budget=dynamic_budget,
+        n_choices=n_choices,
+        router=router,
+        stop_when=stop_when,
+        connect_timeout=connect_timeout or None,
+        first_token_timeout=first_token_timeout or None,
+        chunk_timeout=chunk_timeout or None,
+        memory_margin=memory_margin,
+        compact=compact,
+        tools=(
+            ToolRegistry(commands=allow_command or ())
+            if tools or allow_command
+            else None
+        ),
     )
-    chat.start()
+    chat = Chat(out=output, context=context, **chat_params)
+    try:
+        with trace.profile(profile):
+            if sessions:
+                SessionManager(
+                    chat, new_chat=lambda out: Chat(out=out, **chat_params)
+                ).start()
+            else:
+                chat.start()
+    finally:
+        if pool is not None:
+            rich.print(pool.stats())
+
+
+@app.command()
+def compare(
+    prompt: Optional[str] = typer.Argument(
+        None, help="Prompt to send, after the conversation from `--input` if any."
+    ),
+    input: Optional[typer.FileText] = INPUT_OPTION,
+    models: List[str] = COMPARE_MODELS_OPTION,
+    repeat: int = REPEAT_OPTION,
+    system: Optional[str] = SYSTEM_OPTION,
+    max_output_tokens: Optional[int] = MAX_OUTPUT_TOKENS_OPTION,
+    temperature: float = TEMPERATURE_OPTION,
+    api_base: Optional[str] = API_BASE_OPTION,
+    openai_api_key: Optional[str] = API_KEY_OPTION,
+):
+    """Send the same conversation to several models and compare them.
+
+    Replies stream side by side, then a table shows time to first token,
+    throughput, latency, token counts and the estimated cost of every model.
+    """
+    parsed_models = [parse_model(model) for model in models]
+
+    # The conversation is cut to fit the smallest window, so all models get the same
+    context = Context(model=parsed_models[0])
+    if input:
+        try:
+            if archive.is_archive(input.name):
+                context.load(input.name)
+            else:
+                context.load(input)
+        except ValueError as e:
+            pretty.error(str(e))
+            raise typer.Abort()
+    if system is not None:
+        context.set_system(system)
+    if prompt:
+        context.add_message(
+            Message(content=prompt, role=Role.user, model=context.model)
+        )
+    if context.n_messages == 0:
+        pretty.error("Nothing to send: provide a prompt or a conversation (`--input`).")
+        raise typer.Abort()
+    max_context_tokens = min(
+        model.max_context_tokens - (max_output_tokens or model.max_output_tokens)
+        for model in parsed_models
+    )
+    if max_context_tokens <= 0:
+        pretty.error(
+            "'--max-completion-tokens' leaves no room for the conversation "
+            "in the smallest window of the models."
+        )
+        raise typer.Abort()
+    messages = context.get_messages(max_context_tokens=max_context_tokens)
+
+    if api_base is not None:
+        api_key = openai_api_key or "sk-local"  # local stand-ins ignore the key
+    else:
+        api_key = OpenaiApiKey(openai_api_key).get()
+    chat_completion_params = {"api_key": api_key, "temperature": temperature}
+    if api_base is not None:
+        chat_completion_params["api_base"] = api_base
+    if max_output_tokens is not None:
+        chat_completion_params["max_completion_tokens"] = max_output_tokens
+
+    comparison = Comparison(
+        models=parsed_models,
+        messages=messages,
+        repeat=repeat,
+        **chat_completion_params,
+    )
+    comparison.run()
+    rich.print(comparison.table())
+
+
+@app.command(name="map")
+def map_reduce(
+    inputs: List[typer.FileText] = typer.Argument(
+        ..., help="Documents to process, use `-` for standard input."
+    ),
+    map_prompt: str = MAP_PROMPT_OPTION,
+    reduce_prompt: str = REDUCE_PROMPT_OPTION,
+    chunk_tokens: int = CHUNK_TOKENS_OPTION,
+    concurrency: int = CONCURRENCY_OPTION,
+    checkpoint: Optional[str] = CHECKPOINT_OPTION,
+    output: Optional[str] = OUTPUT_OPTION,
+    model: str = MODEL_OPTION,
+    temperature: float = TEMPERATURE_OPTION,
+    openai_api_key: str = API_KEY_OPTION,  # type: ignore
+    key_pool: Optional[str] = KEY_POOL_OPTION,
+    nodaemon: bool = NODAEMON_OPTION,
+):
+    """Answer one prompt over documents that do not fit into the context.
+
+    Inputs are split into chunks at natural boundaries, the map prompt runs over
+    the chunks concurrently and the reduce prompt combines the results (in
+    several rounds if needed). Use `--checkpoint` to resume interrupted runs.
+    """
+    pool = load_key_pool(key_pool)
+    model: OpenAiModel = parse_model(model)
+
+    available_tokens = model.max_context_tokens - model.max_output_tokens
+    if chunk_tokens > available_tokens:
+        pretty.error(
+            "'--chunk-tokens' cannot be larger than the number of context tokens "
+            f"left for the input by the '{model.name}' model: {available_tokens:,d}."
+        )
+        raise typer.Abort()
+
+    chat_completion_params = {}
+    if pool is None:
+        chat_completion_params["api_key"] = OpenaiApiKey(openai_api_key).get()
+
+    map_reduce = MapReduce(
+        model=model,
+        map_prompt=map_prompt,
+        reduce_prompt=reduce_prompt,
+        chunk_tokens=chunk_tokens,
+        concurrency=concurrency,
+        checkpoint=Checkpoint(checkpoint),
+        create_completion=get_create_completion(nodaemon, pool),
+        temperature=temperature,
+        **chat_completion_params,
+    )
+    try:
+        answer = map_reduce.run([input.read() for input in inputs])
+    except ValueError as e:
+        pretty.error(str(e))
+        raise typer.Abort()
+    finally:
+        if pool is not None:
+            rich.print(pool.stats())
+
+    if output:
+        with open(output, "w") as file:
+            file.write(answer)
+    else:
+        rich.print(Markdown(answer))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from openai.error import (
+    APIConnectionError,
+    APIError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, TextColumn
+
+from . import transport
+from .model import OpenAiModel
+from .role import Role
+from .tokens import count_tokens
+from .trace import span
+
+SEPARATOR = "\n\n---\n\n"
+
+# From coarse to fine: paragraphs, lines, sentences, words
+_BOUNDARIES = [r"\n\s*\n", r"\n", r"(?<=[.!?])\s+", r"\s+"]
+
+
+def _split_keeping_separators(text: str, pattern: str) -> List[str]:
+    pieces = []
+    start = 0
+    for match in re.finditer(pattern, text):
+        if match.end() > start:
+            pieces.append(text[start : match.end()])
+            start = match.end()
+    pieces.append(text[start:])
+    return [piece for piece in pieces if piece]
+
+
+def _split_hard(text: str, max_tokens: int, model: OpenAiModel) -> List[str]:
+    "Last resort for text without any boundaries: split by characters."
+    pieces = []
+    while text:
+        size = len(text)
+        while size > 1 and count_tokens(text[:size], model.name) > max_tokens:
+            size //= 2
+        pieces.append(text[:size])
+        text = text[size:]
+    return pieces
+
+
+def split_text(
+    text: str, max_tokens: int, model: OpenAiModel, _level: int = 0
+) -> List[str]:
+    """Split text into chunks of at most `max_tokens` tokens.
+
+    Chunks are cut at the coarsest natural boundary that works (paragraphs,
+    then lines, sentences and words) and packed greedily.
+    """
+    if count_tokens(text, model.name) <= max_tokens:
+        return [text] if text.strip() else []
+    if _level >= len(_BOUNDARIES):
+        return _split_hard(text, max_tokens, model)
+
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece in _split_keeping_separators(text, _BOUNDARIES[_level]):
+        n_tokens = count_tokens(piece, model.name)
+        if n_tokens > max_tokens:
+            if current:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            chunks += split_text(piece, max_tokens, model, _level + 1)
+        elif current_tokens + n_tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [piece], n_tokens
+        else:
+            current.append(piece)
+            current_tokens += n_tokens
+    if current:
+        chunks.append("".join(current))
+
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+class Checkpoint:
+    """Results of finished requests, keyed by a hash of prompt and input.
+
+    Keys only depend on the request itself, so a rerun over the same inputs
+    skips everything that was already done, whichever stage it belonged to.
+    """
+
+    def __init__(self, filepath: str | None = None):
+        self.filepath = filepath
+        self.results: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        if filepath is not None and os.path.exists(filepath):
+            with open(filepath, "r") as file:
+                self.results = json.load(file)
+
+    @staticmethod
+    def key(prompt: str, text: str) -> str:
+        return hashlib.sha256(f"{prompt}\0{text}".encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        return self.results.get(key)
+
+    def set(self, key: str, result: str):
+        with self._lock:
+            self.results[key] = result
+            if self.filepath is None:
+                return
+            tmp_filepath = f"{self.filepath}.tmp"
+            with open(tmp_filepath, "w") as file:
+                json.dump(self.results, file)
+            os.replace(tmp_filepath, self.filepath)
+
+
+class MapReduce:
+    RETRY_SLEEP: int = 10
+    MAX_RETRIES: int = 5
+
+    def __init__(
+        self,
+        model: OpenAiModel,
+        map_prompt: str,
+        reduce_prompt: str,
+        chunk_tokens: int,
+        concurrency: int = 4,
+        checkpoint: Checkpoint | None = None,
+        create_completion: Callable | None = None,
+        **chat_completion_params,
+    ):
+        self.model = model
+        self.map_prompt = map_prompt
+        self.reduce_prompt = reduce_prompt
+        self.chunk_tokens = chunk_tokens
+        self.concurrency = concurrency
+        self.checkpoint = checkpoint or Checkpoint()
+        self.create_completion = create_completion or transport.create_completion
+        self.chat_completion_params = chat_completion_params
+
+    def _ask(self, prompt: str, text: str) -> str:
+        key = Checkpoint.key(prompt, text)
+        cached = self.checkpoint.get(key)
+        if cached is not None:
+            return cached
+
+        messages = [
+            {"role": Role.system.value, "content": prompt},
+            {"role": Role.user.value, "content": text},
+        ]
+        for attempt in range(self.MAX_RETRIES):
+            try:
+                with span("mapreduce.request"):
+                    completion = self.create_completion(
+                        model=self.model.name,
+                        messages=messages,
+                        **self.chat_completion_params,
+                    )
+                break
+            except (
+                RateLimitError,
+                APIError,
+                ServiceUnavailableError,
+                APIConnectionError,
+                Timeout,
+            ):
+                if attempt == self.MAX_RETRIES - 1:
+                    raise
+                time.sleep(self.RETRY_SLEEP * 2**attempt)
+
+        result = completion.choices[0].message["content"]  # type: ignore (bound after break)
+        self.checkpoint.set(key, result)
+        return result
+
+    def _run_stage(
+        self, progress: Progress, description: str, prompt: str, texts: List[str]
+    ) -> List[str]:
+        task = progress.add_task(description, total=len(texts))
+
+        def ask(text: str) -> str:
+            result = self._ask(prompt, text)
+            progress.advance(task)
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(ask, texts))
+
+    def _group(self, results: List[str]) -> List[str]:
+        "Pack results into as few reduce inputs as fit into a chunk."
+        groups: List[List[str]] = [[]]
+        group_tokens = 0
+        for result in results:
+            n_tokens = count_tokens(result + SEPARATOR, self.model.name)
+            if groups[-1] and group_tokens + n_tokens > self.chunk_tokens:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(result)
+            group_tokens += n_tokens
+        return [SEPARATOR.join(group) for group in groups]
+
+    def run(self, texts: List[str]) -> str:
+        chunks = [
+            chunk
+            for text in texts
+            for chunk in split_text(text, self.chunk_tokens, self.model)
+        ]
+        if not chunks:
+            raise ValueError("Nothing to process: all inputs are empty.")
+
+        with Progress(
+            TextColumn("{task.description}"),
+            BarColumn(),
+            MofNCompleteColumn(),
+            transient=True,
+        ) as progress:
+            results = self._run_stage(progress, "Map", self.map_prompt, chunks)
+            # Reduce at least once, then hierarchically until one answer is left
+            level = 1
+            while level == 1 or len(results) > 1:
+                groups = self._group(results)
+                if len(groups) == len(results) > 1:
+                    # Every result fills a chunk on its own: pair them anyway
+                    groups = [
+                        SEPARATOR.join(results[i : i + 2])
+                        for i in range(0, len(results), 2)
+                    ]
+                results = self._run_stage(
+                    progress, f"Reduce (level {level})", self.reduce_prompt, groups
+                )
+                level += 1
+
+        return results[0]
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
-from pydantic import BaseModel, computed_field, model_validator
+from typing import Any, Dict, List, Tuple
+
+from pydantic import BaseModel, PrivateAttr, computed_field, model_validator
 
 from .model import OpenAiModel
+from .payload import RequestMessage
 from .role import Role
 from .tokens import count_tokens
 
@@ -11,11 +14,43 @@ class Message(BaseModel):
     role: Role
     content: str | None
     model: OpenAiModel
+    # Set on replies that were cut off (e.g. a crash while streaming)
+    incomplete: bool = False
+    # The text as typed, when `content` is a compacted version of it
+    original: str | None = None
+    # Tools an assistant reply asks to call, in the API's format
+    tool_calls: List[Dict[str, Any]] | None = None
+    # The call a tool message answers
+    tool_call_id: str | None = None
+    # What is sent to the API, kept so that it is encoded to JSON only once
+    _request: RequestMessage | None = PrivateAttr(default=None)
+    # Token count with the content it was counted for
+    _n_tokens: Tuple[str | None, int] | None = PrivateAttr(default=None)
 
     @computed_field
     @property
     def n_tokens(self) -> int:
-        return self.count_tokens(self.content, self.model.name)
+        cached = self._n_tokens
+        if cached is None or cached[0] is not self.content:
+            n_tokens = self.count_tokens(self.counted_text, self.model.name)
+            cached = self._n_tokens = (self.content, n_tokens)
+        return cached[1]
+
+    @property
+    def counted_text(self) -> str | None:
+        "The content, plus the names and arguments of the tools it calls."
+        if not self.tool_calls:
+            return self.content
+        calls = "\n".join(
+            f"{call['function']['name']}({call['function']['arguments']})"
+            for call in self.tool_calls
+        )
+        return f"{self.content}\n{calls}" if self.content else calls
+
+    def set_n_tokens(self, n_tokens: int) -> Message:
+        "Use a known token count (e.g. a stored one) instead of counting."
+        self._n_tokens = (self.content, n_tokens)
+        return self
 
     @model_validator(mode="after")
     def content_can_be_none_only_for_system(self) -> Message:
@@ -23,6 +58,44 @@ class Message(BaseModel):
             raise ValueError("If role is not 'system', content cannot be None.")
         return self
 
+    def to_record(self) -> Dict[str, Any]:
+        "The message as stored in transcripts, archives and spill files."
+        record: Dict[str, Any] = {"role": self.role.value, "content": self.content}
+        if self.incomplete:
+            record["incomplete"] = True
+        if self.original is not None:
+            record["original"] = self.original
+        if self.tool_calls:
+            record["tool_calls"] = self.tool_calls
+        if self.tool_call_id is not None:
+            record["tool_call_id"] = self.tool_call_id
+        return record
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], model: OpenAiModel) -> Message:
+        return cls(
+            role=Role(record["role"]),
+            content=record["content"],
+            model=model,
+            incomplete=record.get("incomplete", False),
+            original=record.get("original"),
+            tool_calls=record.get("tool_calls"),
+            tool_call_id=record.get("tool_call_id"),
+        )
+
+    def to_request(self) -> RequestMessage:
+        request = self._request
+        if request is None or request["content"] is not self.content:
+            fields: Dict[str, Any] = {}
+            if self.tool_calls:
+                fields["tool_calls"] = self.tool_calls
+            if self.tool_call_id is not None:
+                fields["tool_call_id"] = self.tool_call_id
+            request = self._request = RequestMessage(
+                self.role.value, self.content, **fields
+            )
+        return request
+
     @staticmethod
     def count_tokens(text: str | None, model: str) -> int:
         if text is None:
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Dict
+from typing import Dict, Tuple
 
 from pydantic import BaseModel, Field, computed_field
 
@@ -108,3 +108,38 @@ class OpenAiModel(BaseModel):
     @property
     def max_context_tokens(self) -> int:
         return self._MAX_CONTEXT_TOKENS[self.name]
+
+    # USD per million (prompt, completion) tokens, from the pricing page at the
+    # time of writing: estimates only, e.g. cached prompts are cheaper
+    _PRICES_PER_MILLION_TOKENS: Dict[ModelName, Tuple[float, float]] = {
+        # 5
+        ModelName.gpt_5: (1.25, 10.00),
+        ModelName.gpt_5_mini: (0.25, 2.00),
+        ModelName.gpt_5_nano: (0.05, 0.40),
+        ModelName.gpt_5_chat: (1.25, 10.00),
+        # 4.1
+        ModelName.gpt_4_1: (2.00, 8.00),
+        ModelName.gpt_4_1_mini: (0.40, 1.60),
+        ModelName.gpt_4_1_nano: (0.10, 0.40),
+        # o3
+        ModelName.gpt_o3: (2.00, 8.00),
+        ModelName.gpt_o3_deep_research: (10.00, 40.00),
+        ModelName.gpt_o3_mini: (1.10, 4.40),
+        ModelName.gpt_o3_pro: (20.00, 80.00),
+        # o4
+        ModelName.gpt_o4_mini: (1.10, 4.40),
+        # o1
+        ModelName.gpt_o1: (15.00, 60.00),
+        # 4o
+        ModelName.gpt_4o: (2.50, 10.00),
+        ModelName.gpt_4o_search_preview: (2.50, 10.00),
+        ModelName.gpt_4o_mini: (0.15, 0.60),
+        ModelName.gpt_chatgpt_4o: (5.00, 15.00),
+    }
+
+    def estimated_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        "Estimated price of a request in USD."
+        prompt_price, completion_price = self._PRICES_PER_MILLION_TOKENS[self.name]
+        return (
+            prompt_tokens * prompt_price + completion_tokens * completion_price
+        ) / 1e6
@@ -0,0 +1,66 @@
+"""JSON request bodies assembled from cached per-message fragments.
+
+Messages are encoded once, when they are first sent, and every later request
+only concatenates the cached fragments instead of re-serializing the whole
+history. orjson is used when it is installed (`pip install gpt-cli[fast]`).
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, Iterable
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class RequestMessage(dict):
+    """A message as sent to the API, which caches its JSON encoding.
+
+    It is a plain `dict` to everything else (e.g. the daemon or a key pool), so
+    it should be treated as read-only once created.
+    """
+
+    __slots__ = ("_json",)
+
+    def __init__(self, role: str, content: str | None, **fields: Any):
+        super().__init__(role=role, content=content, **fields)
+        self._json: bytes | None = None
+
+    @property
+    def json(self) -> bytes:
+        if self._json is None:
+            self._json = dumps(dict(self))
+        return self._json
+
+
+def encode_messages(messages: Iterable[Dict[str, Any]]) -> bytes:
+    fragments = [
+        message.json if isinstance(message, RequestMessage) else dumps(message)
+        for message in messages
+    ]
+    return b"[" + b",".join(fragments) + b"]"
+
+
+def encode_request(params: Dict[str, Any]) -> bytes:
+    "Encode request parameters, splicing in the cached message fragments."
+    params = dict(params)
+    messages = encode_messages(params.pop("messages", []))
+    rest = dumps(params)
+    if rest == b"{}":
+        return b'{"messages":' + messages + b"}"
+    return b'{"messages":' + messages + b"," + rest[1:]
@@ -14,6 +14,10 @@ def warning(text: str) -> None:
     print(f"[bold yellow]Warning:[/bold yellow] {text}")
 
 
+def note(text: str) -> None:
+    print(f"[dim]{text}[/dim]")
+
+
 def typing_animation(func: Callable, text: str = "Typing...", *args, **kwargs):
     with Progress(
         SpinnerColumn(),
@@ -1,11 +1,17 @@
+import html
+import threading
 from pathlib import Path
+from typing import Callable
 
 from prompt_toolkit import PromptSession
+from prompt_toolkit.formatted_text import HTML, merge_formatted_text
 from prompt_toolkit.history import FileHistory
 from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.keys import Keys
 
 from .constants import CONFIG_DIR
+from .model import ModelName
+from .tokens import IncrementalTokenCounter
 
 _kb = KeyBindings()
 
@@ -23,13 +29,168 @@ def _(event):
     event.current_buffer.newline()
 
 
-def prompt() -> str:
-    path = Path(CONFIG_DIR) / Path(".history")
-    session = PromptSession(
-        history=FileHistory(str(path)),
-        key_bindings=_kb,
-    )
-    user_input = session.prompt("> ", prompt_continuation="  ")
+class TokenMeter:
+    """Bottom toolbar with the draft's size and the context budget.
+
+    Tokens are counted on a background thread, so typing never waits for the
+    tokenizer: the toolbar shows the latest finished count and is redrawn when
+    a newer one is ready. Edits made while counting are coalesced.
+    """
+
+    def __init__(self):
+        self.counter: IncrementalTokenCounter | None = None
+        self.max_context_tokens = 0
+        self.context_tokens: int | None = None
+        self.draft_tokens = 0
+        # Why the last count failed, e.g. a daemon that went away
+        self.error: str | None = None
+        self.on_update: Callable[[], None] = lambda: None
+
+        self._context_tokens: Callable[[], int] | None = None
+        self._draft: str | None = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def reset(
+        self,
+        model: ModelName,
+        context_tokens: Callable[[], int],
+        max_context_tokens: int,
+    ):
+        "Prepare for a new prompt: the context is counted lazily, off the UI thread."
+        with self._lock:
+            if self.counter is None or self.counter.model != model:
+                self.counter = IncrementalTokenCounter(model)
+            self._context_tokens = context_tokens
+            self.context_tokens = None
+            self.max_context_tokens = max_context_tokens
+            self.draft_tokens = 0
+            self._draft = ""
+        self._wake()
+
+    def update(self, text: str):
+        with self._lock:
+            self._draft = text
+        self._wake()
+
+    def _wake(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="token-meter", daemon=True
+            )
+            self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                counter, context_tokens = self.counter, self._context_tokens
+                draft, self._draft = self._draft, None
+                self._context_tokens = None
+            if counter is None:
+                continue
+            try:
+                if context_tokens is not None:
+                    self.context_tokens = context_tokens()
+                    context_tokens = None
+                if draft is not None:
+                    self.draft_tokens = counter.count(draft)
+                self.error = None
+            except Exception as e:  # the thread must outlive a failed count
+                self.error = str(e) or type(e).__name__
+                with self._lock:
+                    # Counted again with the next edit, unless replaced by then
+                    if self._context_tokens is None:
+                        self._context_tokens = context_tokens
+                    if self._draft is None:
+                        self._draft = draft
+            self.on_update()
+
+    def toolbar(self) -> HTML:
+        if self.error is not None:
+            return HTML(
+                "<style fg='ansired'>Token meter unavailable: "
+                f"{html.escape(self.error)}</style>"
+            )
+        if self.context_tokens is None:
+            return HTML(f"Draft: {self.draft_tokens:,d} tokens")
+        used = self.context_tokens + self.draft_tokens
+        left = self.max_context_tokens - used
+        text = (
+            f"Draft: {self.draft_tokens:,d} tokens │ "
+            f"Context: {used:,d} / {self.max_context_tokens:,d} │ "
+        )
+        if left < 0:
+            # `Context` will drop the oldest messages to make room
+            return HTML(
+                f"{text}<b><style bg='ansired'>Over by {-left:,d}: "
+                "old messages will be dropped</style></b>"
+            )
+        return HTML(f"{text}Left: {left:,d}")
+
+
+_session: PromptSession | None = None
+
+
+def _get_session() -> PromptSession:
+    # One session per process: a new one per prompt would re-read the history
+    # file every turn and keep growing memory in long chats
+    global _session
+    if _session is None:
+        path = Path(CONFIG_DIR) / Path(".history")
+        _session = PromptSession(
+            history=FileHistory(str(path)),
+            key_bindings=_kb,
+        )
+    return _session
+
+
+def invalidate():
+    "Redraw the prompt, e.g. after its toolbar changed on another thread."
+    if _session is not None:
+        _session.app.invalidate()
+
+
+def prompt(
+    meter: TokenMeter | None = None,
+    message: str = "> ",
+    status: Callable[[], HTML] | None = None,
+) -> str:
+    """Read the user's input.
+
+    `meter` shows the draft's size in the bottom toolbar, and `status` adds a
+    line above it.
+    """
+    session = _get_session()
+    toolbars = [
+        toolbar for toolbar in (status, meter and meter.toolbar) if toolbar is not None
+    ]
+    if not toolbars:
+        user_input = session.prompt(message, prompt_continuation="  ")
+    else:
+
+        def on_text_changed(buffer):
+            meter.update(buffer.text)  # type: ignore (only added with a meter)
+
+        def bottom_toolbar():
+            lines = [toolbar() for toolbar in toolbars]
+            return merge_formatted_text(
+                [part for line in lines for part in (line, "\n")][:-1]
+            )
+
+        if meter is not None:
+            meter.on_update = session.app.invalidate
+            session.default_buffer.on_text_changed += on_text_changed
+        try:
+            user_input = session.prompt(
+                message, prompt_continuation="  ", bottom_toolbar=bottom_toolbar
+            )
+        finally:
+            if meter is not None:
+                session.default_buffer.on_text_changed -= on_text_changed
 
     # Clean up user input
     user_input = user_input.split("\n")
@@ -5,3 +5,4 @@ class Role(str, Enum):
     system = "system"
     user = "user"
     assistant = "assistant"
+    tool = "tool"
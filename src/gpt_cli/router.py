@@ -0,0 +1,210 @@
+"""Per-turn model selection for `--model auto`.
+
+Rules are tried in order: the first one whose prompt limit admits the prompt
+and that has a model with a large enough window decides. Among the rule's
+models that fit, the one with the lowest expected latency wins, based on the
+time to first token and throughput observed in previous sessions.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import asdict, dataclass
+from typing import Dict, List
+
+import yaml
+from pydantic import BaseModel, Field
+
+from .constants import CONFIG_DIR, MODEL_LATENCY_FILENAME
+from .model import ModelName, OpenAiModel
+
+AUTO_MODEL = "auto"
+LATENCY_PATH = os.path.join(CONFIG_DIR, MODEL_LATENCY_FILENAME)
+
+
+class RoutingRule(BaseModel):
+    models: List[ModelName] = Field(min_length=1)
+    max_prompt_tokens: int | None = Field(default=None, gt=0)
+
+
+DEFAULT_RULES = [
+    # Short questions: small models answer quickly
+    RoutingRule(
+        max_prompt_tokens=2_000,
+        models=[ModelName.gpt_4_1_nano, ModelName.gpt_4o_mini, ModelName.gpt_5_nano],
+    ),
+    RoutingRule(
+        max_prompt_tokens=100_000,
+        models=[ModelName.gpt_4o_mini, ModelName.gpt_4_1_mini, ModelName.gpt_5_mini],
+    ),
+    # Everything else needs a large window
+    RoutingRule(models=[ModelName.gpt_4_1_mini, ModelName.gpt_4_1]),
+]
+
+
+@dataclass
+class ModelLatency:
+    ttft: float  # seconds to the first token
+    tokens_per_second: float
+    n_observations: int = 1
+
+
+class LatencyHistory:
+    """Moving averages of observed latencies, stored as JSON between sessions."""
+
+    SMOOTHING: float = 0.3  # weight of the newest observation
+
+    def __init__(self, filepath: str | None = LATENCY_PATH):
+        self.filepath = filepath
+        self.models: Dict[str, ModelLatency] = {}
+        if filepath is not None and os.path.exists(filepath):
+            try:
+                with open(filepath, "r") as file:
+                    entries = json.load(file)
+                self.models = {
+                    name: ModelLatency(**entry) for name, entry in entries.items()
+                }
+            except (OSError, ValueError, TypeError):
+                # The history is only a hint: start over rather than fail
+                self.models = {}
+
+    def observe(self, model: ModelName, ttft: float, tokens_per_second: float):
+        latency = self.models.get(model.value)
+        if latency is None:
+            self.models[model.value] = ModelLatency(ttft, tokens_per_second)
+            return
+        a = self.SMOOTHING
+        latency.ttft = a * ttft + (1 - a) * latency.ttft
+        latency.tokens_per_second = (
+            a * tokens_per_second + (1 - a) * latency.tokens_per_second
+        )
+        latency.n_observations += 1
+
+    def expected_seconds(self, model: ModelName, output_tokens: int) -> float | None:
+        latency = self.models.get(model.value)
+        if latency is None or latency.tokens_per_second <= 0:
+            return None
+        return latency.ttft + output_tokens / latency.tokens_per_second
+
+    def save(self):
+        if self.filepath is None:
+            return
+        os.makedirs(os.path.dirname(self.filepath) or ".", exist_ok=True)
+        tmp_filepath = f"{self.filepath}.tmp"
+        with open(tmp_filepath, "w") as file:
+            json.dump({name: asdict(m) for name, m in self.models.items()}, file)
+        os.replace(tmp_filepath, self.filepath)
+
+
+@dataclass
+class RoutingDecision:
+    model: OpenAiModel
+    reason: str
+
+    def __str__(self) -> str:
+        return f"Model: {self.model.name.value} ({self.reason})."
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        rules: List[RoutingRule] | None = None,
+        history: LatencyHistory | None = None,
+        expected_output_tokens: int = 500,
+    ):
+        self.rules = rules or DEFAULT_RULES
+        self.history = history or LatencyHistory(filepath=None)
+        self.expected_output_tokens = expected_output_tokens
+
+    @staticmethod
+    def load_rules(filepath: str) -> List[RoutingRule]:
+        with open(filepath, "r") as file:
+            entries = yaml.safe_load(file) or []
+        return [RoutingRule.model_validate(entry) for entry in entries]
+
+    @property
+    def largest_model(self) -> OpenAiModel:
+        "The candidate with the largest window: user limits are checked against it."
+        names = dict.fromkeys(name for rule in self.rules for name in rule.models)
+        models = [OpenAiModel(name=name) for name in names]
+        return max(models, key=lambda model: model.max_context_tokens)
+
+    @staticmethod
+    def fits(
+        model: OpenAiModel, prompt_tokens: int, max_output_tokens: int | None = None
+    ) -> bool:
+        """Whether the prompt fits next to the output that is reserved for.
+
+        The same split as the chat uses: the window minus the output limit
+        (capped by the model's own) is left for the prompt.
+        """
+        output_tokens = model.max_output_tokens
+        if max_output_tokens is not None:
+            output_tokens = min(max_output_tokens, output_tokens)
+        return prompt_tokens <= model.max_context_tokens - output_tokens
+
+    def route(
+        self, prompt_tokens: int, max_output_tokens: int | None = None
+    ) -> RoutingDecision:
+        """Pick the model for a prompt.
+
+        `max_output_tokens` is the output the request reserves room for, the
+        model's maximum by default.
+        """
+        for rule in self.rules:
+            if rule.max_prompt_tokens is not None and (
+                prompt_tokens > rule.max_prompt_tokens
+            ):
+                continue
+            fitting = [
+                model
+                for model in (OpenAiModel(name=name) for name in rule.models)
+                if self.fits(model, prompt_tokens, max_output_tokens)
+            ]
+            if not fitting:
+                continue
+
+            limit = (
+                f"≤ {rule.max_prompt_tokens:,d}"
+                if rule.max_prompt_tokens is not None
+                else "any number of"
+            )
+            expected = {
+                model.name: self.history.expected_seconds(
+                    model.name, self.expected_output_tokens
+                )
+                for model in fitting
+            }
+            known = [model for model in fitting if expected[model.name] is not None]
+            if not known:
+                return RoutingDecision(
+                    fitting[0],
+                    f"{prompt_tokens:,d} prompt tokens, rule for {limit} tokens, "
+                    "no latency history yet",
+                )
+            model = min(known, key=lambda m: expected[m.name])  # type: ignore
+            return RoutingDecision(
+                model,
+                f"{prompt_tokens:,d} prompt tokens, rule for {limit} tokens, "
+                f"fastest of {len(fitting)} with ~{expected[model.name]:.1f} s expected",
+            )
+
+        model = self.largest_model
+        return RoutingDecision(
+            model,
+            f"{prompt_tokens:,d} prompt tokens, no rule matches, "
+            "using the largest window",
+        )
+
+    def observe(
+        self, model: OpenAiModel, ttft: float, n_tokens: int, stream_seconds: float
+    ):
+        "Record a streamed reply and persist the history."
+        if n_tokens == 0 or stream_seconds <= 0:
+            return
+        self.history.observe(model.name, ttft, n_tokens / stream_seconds)
+        try:
+            self.history.save()
+        except OSError:
+            pass  # losing one observation is not worth interrupting the chat
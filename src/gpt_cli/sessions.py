@@ -0,0 +1,193 @@
+"""Several conversations in one interactive process.
+
+Every session is a `Chat` with its own context and output file. A message sent
+in one session is answered on a shared thread pool while the prompt returns
+right away, so other sessions can be used in the meantime. Finished replies
+are printed if their session is the current one, and announced otherwise.
+
+All sessions share the process: encodings are loaded once, and the worker
+threads keep their HTTP connections open between requests.
+"""
+
+from __future__ import annotations
+
+import html
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+
+import rich
+from prompt_toolkit.formatted_text import HTML
+from prompt_toolkit.patch_stdout import patch_stdout
+from rich.markdown import Markdown
+
+from gpt_cli import pretty
+
+from .chat import Chat
+from .prompt import invalidate
+from .trace import span
+
+USAGE = "Usage: /new NAME [OUTPUT], /session NAME or /sessions."
+
+
+class Session:
+    def __init__(self, name: str, chat: Chat):
+        self.name = name
+        self.chat = chat
+        self.future: Future | None = None
+        # Finished while the session was in the background, not shown yet
+        self.unread: str | None = None
+        self.error: str | None = None
+
+    @property
+    def busy(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+    @property
+    def status(self) -> str:
+        if self.busy:
+            return "waiting for a reply"
+        if self.error is not None:
+            return "failed"
+        if self.unread is not None:
+            return "new reply"
+        return "idle"
+
+
+class SessionManager:
+    MAX_WORKERS: int = 8
+
+    def __init__(self, chat: Chat, new_chat: Callable[[str | None], Chat]):
+        """
+        `chat` is the first session, `new_chat(output)` creates the others.
+        """
+        self.new_chat = new_chat
+        self.sessions: Dict[str, Session] = {"main": Session("main", chat)}
+        self.current = self.sessions["main"]
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.MAX_WORKERS, thread_name_prefix="session"
+        )
+        self._lock = threading.Lock()  # serializes printing from the workers
+
+    def start(self):
+        self.current.chat._resume_incomplete()
+        try:
+            # Output of the workers goes above the prompt instead of into it
+            with patch_stdout(raw=True):
+                while True:
+                    self._turn()
+        finally:
+            self._shut_down()
+
+    def _turn(self):
+        session = self.current
+        user_input = session.chat.ask_for_input(
+            message=f"{session.name}> ", status=self.status
+        )
+        if self._run_command(user_input):
+            return
+        if session.busy:
+            pretty.warning(
+                f"Session '{session.name}' is still waiting for a reply: "
+                "switch to another one with /session NAME or /new NAME."
+            )
+            return
+        if session.chat._run_command(user_input):
+            return
+        session.chat._add_user_message(user_input)
+        self._submit(session)
+
+    def _submit(self, session: Session):
+        session.error = session.unread = None
+        session.future = self.executor.submit(self._reply, session)
+        invalidate()
+
+    def _reply(self, session: Session):
+        try:
+            with span("sessions.reply", session=session.name):
+                # Tool calls are followed without notes, like the rest of the turn
+                reply = session.chat._respond(
+                    session.chat._fetch_reply, notify=lambda _: None
+                )
+        except Exception as e:  # a worker has nobody else to report to
+            session.error = str(e)
+            with self._lock:
+                pretty.error(
+                    f"Session '{session.name}': {e} Send the message again with "
+                    "/regenerate."
+                )
+            return
+        finally:
+            invalidate()
+
+        with self._lock:
+            if session is self.current:
+                self._show(reply)
+            else:
+                session.unread = reply
+                pretty.note(
+                    f"Session '{session.name}' has a new reply: "
+                    f"/session {session.name} to read it."
+                )
+
+    @staticmethod
+    def _show(reply: str):
+        rich.print()
+        rich.print(Markdown(reply))
+        rich.print()
+
+    def _run_command(self, user_input: str) -> bool:
+        "Run a session command, return `False` if the input is not one."
+        command, *args = user_input.split() or [""]
+        match command, args:
+            case "/new", [name, *output] if len(output) <= 1:
+                if name in self.sessions:
+                    pretty.error(f"Session '{name}' already exists.")
+                    return True
+                chat = self.new_chat(output[0] if output else None)
+                self.sessions[name] = Session(name, chat)
+                self._switch(name)
+            case "/session", [name]:
+                if name not in self.sessions:
+                    pretty.error(f"There is no session '{name}'.")
+                    return True
+                self._switch(name)
+            case "/sessions", []:
+                for session in self.sessions.values():
+                    marker = "*" if session is self.current else " "
+                    pretty.note(f"{marker} {session.name} ({session.status})")
+            case "/new" | "/session" | "/sessions", _:
+                pretty.error(USAGE)
+            case _:
+                return False
+        return True
+
+    def _switch(self, name: str):
+        with self._lock:
+            self.current = self.sessions[name]
+            pretty.note(f"Switched to session '{name}' ({self.current.status}).")
+            if self.current.unread is not None:
+                self._show(self.current.unread)
+                self.current.unread = None
+
+    def status(self) -> HTML:
+        "One entry per session for the prompt's toolbar."
+        entries = []
+        for session in self.sessions.values():
+            name = html.escape(session.name)
+            if session is self.current:
+                name = f"<b>{name}</b>"
+            if session.busy:
+                name += " …"
+            elif session.error is not None:
+                name += " <style fg='ansired'>!</style>"
+            elif session.unread is not None:
+                name += " <style fg='ansigreen'>●</style>"
+            entries.append(name)
+        return HTML("Sessions: " + "  ".join(entries))
+
+    def _shut_down(self):
+        busy = [s.name for s in self.sessions.values() if s.busy]
+        if busy:
+            pretty.note(f"Waiting for replies in: {', '.join(busy)}.")
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,51 @@
+"""On-disk segment for messages that fell out of the context window.
+
+Long sessions only ever send their newest messages, so older ones are written
+to an append-only temporary file and dropped from memory. Their token counts
+stay in memory, and the messages are read back one at a time when something
+needs them (saving, or a larger window).
+"""
+
+from __future__ import annotations
+
+import json
+import tempfile
+import threading
+from .message import Message
+from .model import OpenAiModel
+
+
+class SpilledMessage:
+    __slots__ = ("store", "offset", "length")
+
+    def __init__(self, store: SpillStore, offset: int, length: int):
+        self.store = store
+        self.offset = offset
+        self.length = length
+
+    def load(self) -> Message:
+        return self.store.read(self.offset, self.length)
+
+
+class SpillStore:
+    def __init__(self, model: OpenAiModel):
+        self.model = model
+        # Removed by the OS when closed, including on a crash
+        self.file = tempfile.TemporaryFile(prefix="gpt-cli-", suffix=".segment")
+        self._lock = threading.Lock()
+
+    def write(self, message: Message) -> SpilledMessage:
+        data = json.dumps(message.to_record()).encode()
+        with self._lock:
+            offset = self.file.seek(0, 2)
+            self.file.write(data)
+        return SpilledMessage(self, offset, len(data))
+
+    def read(self, offset: int, length: int) -> Message:
+        with self._lock:
+            self.file.seek(offset)
+            record = json.loads(self.file.read(length))
+        return Message.from_record(record, self.model)
+
+    def close(self):
+        self.file.close()
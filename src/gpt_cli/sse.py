@@ -0,0 +1,87 @@
+"""Lean parser for streamed chat completions.
+
+The openai client turns every server-sent event into a tree of `OpenAIObject`s.
+This parser splits the raw bytes into events itself and keeps only what a
+stream consumer reads: the choices (with their delta and finish reason) and the
+usage, as the plain dicts and lists the JSON decoder produces.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+from openai.error import APIError
+
+from .payload import loads
+
+_DATA = b"data:"
+_DONE = b"[DONE]"
+
+
+class StreamChunk:
+    "One streamed chunk: `choices[i]['delta']['content']` and friends."
+
+    __slots__ = ("choices", "usage")
+
+    def __init__(self, choices: List[Dict[str, Any]], usage: Dict[str, Any] | None):
+        self.choices = choices
+        self.usage = usage
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == "choices":
+            return self.choices
+        if key == "usage":
+            return self.usage if self.usage is not None else default
+        return default
+
+    def to_dict_recursive(self) -> Dict[str, Any]:
+        "The chunk as plain data, like `OpenAIObject.to_dict_recursive`."
+        chunk: Dict[str, Any] = {"choices": self.choices}
+        if self.usage is not None:
+            chunk["usage"] = self.usage
+        return chunk
+
+
+def iter_events(body: Iterable[bytes]) -> Iterator[bytes]:
+    "Yield the data of every event in a byte stream, until `[DONE]`."
+    pending = b""
+    for block in body:
+        if pending:
+            block = pending + block
+        start = 0
+        while True:
+            end = block.find(b"\n", start)
+            if end == -1:
+                break
+            line = block[start:end]
+            start = end + 1
+            # Only `data` fields matter; comments, ids and blank lines are skipped
+            if line.startswith(_DATA):
+                data = line[len(_DATA) :].strip()
+                if data == _DONE:
+                    return
+                if data:
+                    yield data
+        pending = block[start:]
+    if pending.startswith(_DATA):  # the last line may lack its line break
+        data = pending[len(_DATA) :].strip()
+        if data and data != _DONE:
+            yield data
+
+
+def iter_chunks(
+    body: Iterable[bytes],
+    on_error: Callable[[bytes, Dict[str, Any]], Exception] | None = None,
+) -> Iterator[StreamChunk]:
+    """Parse a streamed chat completion into `StreamChunk`s.
+
+    An event with an `error` is raised as `on_error(data, event)`, so callers
+    can raise the same exceptions as the openai client.
+    """
+    for data in iter_events(body):
+        event = loads(data)
+        if "error" in event:
+            if on_error is not None:
+                raise on_error(data, event)
+            raise APIError(f"Error in stream: {event['error']}", data.decode())
+        yield StreamChunk(event.get("choices") or [], event.get("usage"))
@@ -0,0 +1,161 @@
+"""Client-side stop conditions, checked while a reply streams in.
+
+The API only stops on up to four plain strings. These conditions are fed the
+reply chunk by chunk, look only at the new text (plus whatever small state they
+keep) and return where the reply should be cut once they match.
+"""
+
+from __future__ import annotations
+
+import re
+
+FENCE = "```"
+
+
+class StopCondition:
+    reason: str
+
+    def feed(self, chunk: str) -> int | None:
+        "Take the next chunk, return the length to cut the reply to on a match."
+        raise NotImplementedError
+
+
+class RegexStop(StopCondition):
+    """Stop before the first match of a regular expression.
+
+    Only the last `LOOKBACK` characters are searched again with every chunk, so
+    matches longer than that are not found. The character before them is kept
+    but not searched, so that `^` and `\\b` only match where they would in the
+    whole reply, not at the start of the window.
+    """
+
+    LOOKBACK: int = 1_024
+
+    def __init__(self, pattern: str):
+        self.pattern = re.compile(pattern, re.MULTILINE)
+        self.reason = f"matched /{pattern}/"
+        self.tail = ""
+        self.offset = 0  # position of `tail` in the reply
+
+    def feed(self, chunk: str) -> int | None:
+        text = self.tail + chunk
+        # Searching from `pos` still sees the character before it
+        pos = 1 if self.offset > 0 else 0
+        match = self.pattern.search(text, pos)
+        if match:
+            return self.offset + match.start()
+        if len(text) > self.LOOKBACK + 1:
+            self.tail = text[-(self.LOOKBACK + 1) :]
+            self.offset += len(text) - len(self.tail)
+        else:
+            self.tail = text
+        return None
+
+
+class CodeFenceStop(StopCondition):
+    "Stop right after the first code block is closed."
+
+    reason = "code block closed"
+
+    def __init__(self):
+        self.line = ""  # the current, possibly incomplete, line
+        self.line_start = 0
+        self.in_fence = False
+
+    def feed(self, chunk: str) -> int | None:
+        self.line += chunk
+        while True:
+            newline = self.line.find("\n")
+            line = self.line if newline == -1 else self.line[:newline]
+            stripped = line.lstrip()
+            if stripped.startswith(FENCE):
+                if self.in_fence:
+                    # Cut after the closing backticks
+                    fence_start = len(line) - len(stripped)
+                    fence_length = len(stripped) - len(stripped.lstrip("`"))
+                    return self.line_start + fence_start + fence_length
+                if newline != -1:
+                    # Opening fences are only known once the line is complete
+                    self.in_fence = True
+            if newline == -1:
+                return None
+            self.line = self.line[newline + 1 :]
+            self.line_start += newline + 1
+
+
+class JsonObjectStop(StopCondition):
+    "Stop right after the first top-level JSON object is complete."
+
+    reason = "JSON object complete"
+
+    def __init__(self):
+        self.offset = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, chunk: str) -> int | None:
+        for i, char in enumerate(chunk):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.depth > 0:
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    return self.offset + i + 1
+        self.offset += len(chunk)
+        return None
+
+
+class MaxLinesStop(StopCondition):
+    "Stop after a number of lines."
+
+    def __init__(self, max_lines: int):
+        if max_lines < 1:
+            raise ValueError("Number of lines should be a positive integer.")
+        self.max_lines = max_lines
+        self.reason = f"reached {max_lines:,d} lines"
+        self.n_lines = 0
+        self.offset = 0
+
+    def feed(self, chunk: str) -> int | None:
+        newline = chunk.find("\n")
+        while newline != -1:
+            self.n_lines += 1
+            if self.n_lines == self.max_lines:
+                return self.offset + newline
+            newline = chunk.find("\n", newline + 1)
+        self.offset += len(chunk)
+        return None
+
+
+def parse_stop_condition(spec: str) -> StopCondition:
+    """Create a condition from its command line form.
+
+    `regex:PATTERN`, `fence`, `json` or `lines:N`.
+    """
+    kind, _, argument = spec.partition(":")
+    try:
+        match kind:
+            case "regex" if argument:
+                return RegexStop(argument)
+            case "fence" if not argument:
+                return CodeFenceStop()
+            case "json" if not argument:
+                return JsonObjectStop()
+            case "lines" if argument:
+                return MaxLinesStop(int(argument))
+    except (re.error, ValueError) as e:
+        raise ValueError(f"Invalid stop condition '{spec}': {e}") from e
+    raise ValueError(
+        f"Invalid stop condition '{spec}': expected 'regex:PATTERN', 'fence', "
+        "'json' or 'lines:N'."
+    )
@@ -0,0 +1,87 @@
+"""Timeouts for streamed replies.
+
+A stalled stream blocks inside the HTTP client, where it cannot be
+interrupted, so chunks are read on a separate thread and handed over through a
+queue that the caller waits on with a timeout.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+from typing import Any, Iterable, Iterator
+
+from openai.error import APIConnectionError
+
+_DONE = object()
+MAX_QUEUED_CHUNKS = 16
+
+
+class StreamTimeout(APIConnectionError):
+    pass
+
+
+class StreamInterrupted(Exception):
+    "A stream broke off after part of the reply had arrived."
+
+    def __init__(self, partial: str):
+        super().__init__("The reply was interrupted.")
+        self.partial = partial
+
+
+def with_timeouts(
+    stream: Iterable[Any],
+    first_chunk_timeout: float | None = None,
+    chunk_timeout: float | None = None,
+) -> Iterator[Any]:
+    """Iterate over `stream`, raising `StreamTimeout` if it stalls.
+
+    `first_chunk_timeout` limits the wait for the first chunk (which may
+    include the model's thinking time), `chunk_timeout` the wait for any later
+    one. `None` means no limit.
+    """
+    # Bounded, so a fast stream does not pile up chunks faster than they render
+    chunks: queue.Queue = queue.Queue(maxsize=MAX_QUEUED_CHUNKS)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for chunk in stream:
+                if not put((chunk, None)):
+                    break
+        except BaseException as e:
+            put((None, e))
+            return
+        finally:
+            # Runs on this thread, so closing (and the connection) is safe here
+            getattr(stream, "close", lambda: None)()
+        put((_DONE, None))
+
+    threading.Thread(target=read, name="stream-reader", daemon=True).start()
+    timeout, what = first_chunk_timeout, "the first token"
+    try:
+        while True:
+            try:
+                chunk, error = chunks.get(timeout=timeout)
+            except queue.Empty:
+                raise StreamTimeout(
+                    f"No response for {timeout:g} seconds while waiting for {what}."
+                )
+            if error is not None:
+                raise error
+            if chunk is _DONE:
+                return
+            yield chunk
+            timeout, what = chunk_timeout, "the next chunk"
+    finally:
+        # The reader stops with its next chunk, or when the socket times out
+        stop.set()
@@ -1,20 +1,63 @@
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable
+
 import tiktoken
+import tiktoken.model
 from gpt_cli.model import ModelName
+from gpt_cli.trace import traced
 import re
 
+# When set, token counting is delegated (e.g. to a warm `gpt-cli serve` daemon)
+# instead of loading BPE encodings in this process.
+_counter: Callable[[str, ModelName], int] | None = None
 
-def guess_encoding_using_heuristics(model_name: ModelName) -> tiktoken.Encoding:
+
+def set_counter(counter: Callable[[str, ModelName], int] | None) -> None:
+    global _counter
+    _counter = counter
+
+
+def get_counter() -> Callable[[str, ModelName], int] | None:
+    return _counter
+
+
+def guess_encoding_name_using_heuristics(model_name: ModelName) -> str:
     # oX models, e.g. o3, o4, o1, o1-pro
     if re.search(r"o\d+", model_name.value):
-        return tiktoken.get_encoding("o200k_base")
+        return "o200k_base"
     # gpt-4.1, gpt-4o, etc. But NOT plain gpt-4, or gpt-4-turbo
     if re.search(r"gpt-4(?:\.[1-9]\d*|o.*)", model_name.value):
-        return tiktoken.get_encoding("o200k_base")
+        return "o200k_base"
 
     raise ValueError(f"Could not guess encoding for model {model_name.value}.")
 
 
+def guess_encoding_using_heuristics(model_name: ModelName) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(guess_encoding_name_using_heuristics(model_name))
+
+
+@lru_cache
+def encoding_name(model: ModelName) -> str:
+    "Name of the model's encoding, without loading the encoding itself."
+    try:
+        return tiktoken.model.encoding_name_for_model(model.value)
+    except (KeyError, ValueError):
+        return guess_encoding_name_using_heuristics(model_name=model)
+
+
+def token_count_key(text: str, model: ModelName) -> str:
+    "Key under which the token count of `text` is stored: valid per encoding."
+    digest = hashlib.sha1(text.encode(), usedforsecurity=False).hexdigest()
+    return f"{encoding_name(model)}:{digest}"
+
+
+@traced("tokens.count")
 def count_tokens(text: str, model: ModelName) -> int:
+    if _counter is not None:
+        return _counter(text, model)
+
     try:
         encoding = tiktoken.encoding_for_model(model.value)
     except (KeyError, ValueError):
@@ -22,3 +65,32 @@ def count_tokens(text: str, model: ModelName) -> int:
 
     num_tokens = len(encoding.encode(text))
     return num_tokens
+
+
+class IncrementalTokenCounter:
+    """Count tokens of a text that changes a little at a time, e.g. a draft.
+
+    The text is split after every run of line breaks and the count of every
+    segment is cached, so an edit only re-encodes the segments it touches.
+    Tokens rarely span such a boundary, so the sum is exact or very close.
+    """
+
+    MAX_CACHED_SEGMENTS: int = 4_096
+
+    def __init__(self, model: ModelName):
+        self.model = model
+        self._cache: OrderedDict[str, int] = OrderedDict()
+
+    def count(self, text: str) -> int:
+        n_tokens = 0
+        for segment in re.findall(r"[^\n]*\n+|[^\n]+", text):
+            segment_tokens = self._cache.get(segment)
+            if segment_tokens is None:
+                segment_tokens = count_tokens(segment, self.model)
+                self._cache[segment] = segment_tokens
+                if len(self._cache) > self.MAX_CACHED_SEGMENTS:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(segment)
+            n_tokens += segment_tokens
+        return n_tokens
@@ -0,0 +1,342 @@
+"""Local tools the model can call.
+
+Tools only read from the working directory (the registry's `root`) and run
+commands from an allow-list, without a shell. All calls of one reply run at
+once on a thread pool; each result is capped in size, and calls that are not
+done when the timeout expires are reported as timed out.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import shlex
+import stat
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List
+
+from .trace import span
+
+
+class ToolError(Exception):
+    "A failure that is reported to the model as the tool's result."
+
+
+@dataclass
+class Tool:
+    name: str
+    description: str
+    parameters: Dict[str, Any]  # JSON schema of the arguments
+    func: Callable[..., str]
+
+    def schema(self) -> Dict[str, Any]:
+        "The tool as listed in the `tools` parameter of a request."
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "parameters": self.parameters,
+            },
+        }
+
+
+@dataclass
+class ToolResult:
+    call_id: str
+    name: str
+    output: str
+    status: str = "ok"  # "ok", "error", "timeout" or "skipped"
+
+
+def add_tool_call_deltas(
+    calls: Dict[int, Dict[str, Any]], deltas: Iterable[Dict[str, Any]]
+):
+    "Merge the `tool_calls` of a streamed delta into the calls received so far."
+    for delta in deltas:
+        call = calls.setdefault(
+            delta.get("index", 0),
+            {"id": "", "type": "function", "function": {"name": "", "arguments": ""}},
+        )
+        if delta.get("id"):
+            call["id"] = delta["id"]
+        function = delta.get("function") or {}
+        call["function"]["name"] += function.get("name") or ""
+        call["function"]["arguments"] += function.get("arguments") or ""
+
+
+def ordered_calls(calls: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [calls[i] for i in sorted(calls)]
+
+
+class ToolRegistry:
+    MAX_WORKERS: int = 8
+    MAX_GREP_MATCHES: int = 200
+
+    def __init__(
+        self,
+        root: str = ".",
+        commands: Iterable[str] = (),
+        timeout: float = 10.0,
+        max_output_chars: int = 16_000,
+    ):
+        """
+        `commands` are the programs `run_command` may start; without them the
+        tool is not offered. `timeout` applies to all calls of a reply together.
+        """
+        self.root = os.path.realpath(root)
+        self.commands = sorted(set(commands))
+        self.timeout = timeout
+        self.max_output_chars = max_output_chars
+        self.tools: Dict[str, Tool] = {}
+
+        self.register(
+            Tool(
+                name="read_file",
+                description=(
+                    "Read a text file in the working directory. Lines are "
+                    "numbered from 1."
+                ),
+                parameters={
+                    "type": "object",
+                    "properties": {
+                        "path": {"type": "string"},
+                        "start_line": {"type": "integer", "minimum": 1},
+                        "max_lines": {"type": "integer", "minimum": 1},
+                    },
+                    "required": ["path"],
+                },
+                func=self.read_file,
+            )
+        )
+        self.register(
+            Tool(
+                name="grep",
+                description=(
+                    "Search files in the working directory for a regular "
+                    "expression; prints `path:line: text` for every match."
+                ),
+                parameters={
+                    "type": "object",
+                    "properties": {
+                        "pattern": {"type": "string"},
+                        "path": {
+                            "type": "string",
+                            "description": "File or directory, `.` by default.",
+                        },
+                        "ignore_case": {"type": "boolean"},
+                    },
+                    "required": ["pattern"],
+                },
+                func=self.grep,
+            )
+        )
+        if self.commands:
+            self.register(
+                Tool(
+                    name="run_command",
+                    description=(
+                        "Run a command in the working directory, without a "
+                        f"shell. Allowed programs: {', '.join(self.commands)}."
+                    ),
+                    parameters={
+                        "type": "object",
+                        "properties": {"command": {"type": "string"}},
+                        "required": ["command"],
+                    },
+                    func=self.run_command,
+                )
+            )
+
+    def register(self, tool: Tool) -> Tool:
+        self.tools[tool.name] = tool
+        return tool
+
+    def schemas(self) -> List[Dict[str, Any]]:
+        return [tool.schema() for tool in self.tools.values()]
+
+    def run(self, calls: List[Dict[str, Any]]) -> List[ToolResult]:
+        "Run the calls of one reply in parallel, results in the order of the calls."
+        executor = ThreadPoolExecutor(
+            max_workers=min(len(calls), self.MAX_WORKERS) or 1,
+            thread_name_prefix="tool",
+        )
+        try:
+            futures = [executor.submit(self._call, call) for call in calls]
+            deadline = time.monotonic() + self.timeout
+            results = []
+            for call, future in zip(calls, futures):
+                name = call["function"]["name"]
+                try:
+                    output = future.result(timeout=max(deadline - time.monotonic(), 0))
+                    status = "ok"
+                except FutureTimeoutError:
+                    output = f"Timed out after {self.timeout:g} seconds."
+                    status = "timeout"
+                except ToolError as e:
+                    output = f"Error: {e}"
+                    status = "error"
+                results.append(ToolResult(call["id"], name, self._cap(output), status))
+        finally:
+            # Calls that timed out are left to finish in the background
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    @staticmethod
+    def skip(calls: List[Dict[str, Any]], reason: str) -> List[ToolResult]:
+        "Results for calls that are not run: every call needs one."
+        return [
+            ToolResult(call["id"], call["function"]["name"], reason, "skipped")
+            for call in calls
+        ]
+
+    def _call(self, call: Dict[str, Any]) -> str:
+        name = call["function"]["name"]
+        tool = self.tools.get(name)
+        if tool is None:
+            raise ToolError(f"There is no tool '{name}'.")
+        try:
+            arguments = json.loads(call["function"]["arguments"] or "{}")
+        except ValueError as e:
+            raise ToolError(f"Arguments are not valid JSON: {e}")
+        if not isinstance(arguments, dict):
+            raise ToolError("Arguments should be a JSON object.")
+
+        with span("tools.call", tool=name):
+            try:
+                return tool.func(**arguments)
+            except ToolError:
+                raise
+            except TypeError as e:  # missing or unknown arguments
+                raise ToolError(f"Invalid arguments: {e}")
+            except (OSError, ValueError) as e:  # e.g. a path with a null byte
+                raise ToolError(str(e))
+            except Exception as e:  # arguments come from the model: never crash
+                raise ToolError(f"{type(e).__name__}: {e}")
+
+    def _cap(self, output: str) -> str:
+        n_extra = len(output) - self.max_output_chars
+        if n_extra <= 0:
+            return output
+        return (
+            output[: self.max_output_chars]
+            + f"\n[output truncated: {n_extra:,d} more characters]"
+        )
+
+    def _resolve(self, path: str) -> str:
+        "The real path of `path`, which should be inside `root`."
+        resolved = os.path.realpath(os.path.join(self.root, path))
+        if not self._is_inside_root(resolved):
+            raise ToolError(f"'{path}' is outside the working directory.")
+        return resolved
+
+    def _is_inside_root(self, realpath: str) -> bool:
+        return realpath == self.root or realpath.startswith(self.root + os.sep)
+
+    @staticmethod
+    def _is_regular_file(path: str) -> bool:
+        # Opening a FIFO or a device could block the worker for good
+        try:
+            return stat.S_ISREG(os.stat(path).st_mode)
+        except OSError:
+            return False
+
+    def read_file(
+        self, path: str, start_line: int = 1, max_lines: int | None = None
+    ) -> str:
+        filepath = self._resolve(path)
+        if not self._is_regular_file(filepath):
+            raise ToolError(f"'{path}' is not a regular file.")
+
+        deadline = time.monotonic() + self.timeout
+        lines: List[str] = []
+        n_chars = 0
+        with open(filepath, "r", errors="replace") as file:
+            for i, line in enumerate(file, 1):
+                if time.monotonic() > deadline:
+                    raise ToolError(f"Timed out after {self.timeout:g} seconds.")
+                if i < start_line:
+                    continue
+                if max_lines is not None and len(lines) >= max_lines:
+                    break
+                lines.append(line)
+                n_chars += len(line)
+                if n_chars > self.max_output_chars:
+                    break  # the rest would be cut off anyway
+        return "".join(lines)
+
+    def grep(self, pattern: str, path: str = ".", ignore_case: bool = False) -> str:
+        try:
+            regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        except re.error as e:
+            raise ToolError(f"Invalid pattern: {e}")
+
+        deadline = time.monotonic() + self.timeout
+        matches: List[str] = []
+        for filepath in self._walk(self._resolve(path)):
+            # A symbolic link inside the root may point anywhere
+            if not self._is_inside_root(os.path.realpath(filepath)):
+                continue
+            if not self._is_regular_file(filepath):
+                continue
+            try:
+                with open(filepath, "r", errors="replace") as file:
+                    for i, line in enumerate(file, 1):
+                        # Checked per line: a single file can be huge
+                        if time.monotonic() > deadline:
+                            matches.append("[search stopped: timed out]")
+                            return "\n".join(matches)
+                        if "\0" in line:
+                            break  # a binary file
+                        if regex.search(line):
+                            relpath = os.path.relpath(filepath, self.root)
+                            matches.append(f"{relpath}:{i}: {line.rstrip()}")
+                            if len(matches) >= self.MAX_GREP_MATCHES:
+                                matches.append("[search stopped: too many matches]")
+                                return "\n".join(matches)
+            except OSError:
+                continue  # unreadable files are not worth failing the search
+        return "\n".join(matches) if matches else "No matches."
+
+    @staticmethod
+    def _walk(path: str) -> Iterable[str]:
+        if not os.path.isdir(path):
+            yield path
+            return
+        for dirpath, dirnames, filenames in os.walk(path):
+            # Hidden directories (e.g. .git) are mostly noise
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for filename in sorted(filenames):
+                yield os.path.join(dirpath, filename)
+
+    def run_command(self, command: str) -> str:
+        try:
+            argv = shlex.split(command)
+        except ValueError as e:
+            raise ToolError(f"Cannot parse the command: {e}")
+        if not argv or argv[0] not in self.commands:
+            program = argv[0] if argv else ""
+            raise ToolError(
+                f"'{program}' is not allowed, only: {', '.join(self.commands)}."
+            )
+        try:
+            completed = subprocess.run(
+                argv,
+                cwd=self.root,
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                text=True,
+                errors="replace",
+                timeout=self.timeout,
+            )
+        except subprocess.TimeoutExpired:
+            raise ToolError(f"Timed out after {self.timeout:g} seconds.")
+        output = completed.stdout + completed.stderr
+        if completed.returncode != 0:
+            output += f"\n[exit code {completed.returncode}]"
+        return output
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List
+
+
+@dataclass
+class SpanEvent:
+    name: str
+    start_ns: int
+    end_ns: int
+    thread_id: int
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration_s(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+
+Subscriber = Callable[[SpanEvent], None]
+
+# Kept as a plain list so that the disabled path is a single truthiness check
+_subscribers: List[Subscriber] = []
+_lock = threading.Lock()
+
+
+def subscribe(callback: Subscriber) -> Callable[[], None]:
+    """Call `callback` with a `SpanEvent` every time a span finishes.
+
+    Returns a function that removes the subscription.
+    """
+    with _lock:
+        _subscribers.append(callback)
+    return lambda: unsubscribe(callback)
+
+
+def unsubscribe(callback: Subscriber) -> None:
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+def enabled() -> bool:
+    return bool(_subscribers)
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "start_ns")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.start_ns = 0
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> _Span:
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        event = SpanEvent(
+            name=self.name,
+            start_ns=self.start_ns,
+            end_ns=time.perf_counter_ns(),
+            thread_id=threading.get_ident(),
+            attrs=self.attrs,
+        )
+        for callback in list(_subscribers):
+            callback(event)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self) -> _NullSpan:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, **attrs) -> _Span | _NullSpan:
+    """Time a block of code: `with span("context.save"): ...`.
+
+    When nobody is subscribed a shared no-op object is returned, so
+    instrumentation left in hot paths costs next to nothing.
+    """
+    if not _subscribers:
+        return _NULL_SPAN
+    return _Span(name, attrs)
+
+
+def traced(name: str) -> Callable:
+    "Decorator version of `span`."
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _subscribers:
+                return func(*args, **kwargs)
+            with _Span(name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class ChromeTraceRecorder:
+    """Collect spans and write them in Chrome's trace-event format.
+
+    The output can be opened in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self):
+        self.events: List[SpanEvent] = []
+
+    def __call__(self, event: SpanEvent) -> None:
+        self.events.append(event)
+
+    def to_dict(self) -> Dict[str, Any]:
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": event.name,
+                    "ph": "X",
+                    "ts": event.start_ns / 1e3,
+                    "dur": (event.end_ns - event.start_ns) / 1e3,
+                    "pid": pid,
+                    "tid": event.thread_id,
+                    "args": {k: str(v) for k, v in event.attrs.items()},
+                }
+                for event in self.events
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def write(self, filepath: str) -> None:
+        with open(filepath, "w") as file:
+            json.dump(self.to_dict(), file)
+
+
+@contextmanager
+def profile(filepath: str | None) -> Iterator[None]:
+    """Profile the enclosed block and write the results to `filepath`.
+
+    Files ending in `.json` get a Chrome trace of the recorded spans, anything
+    else gets a cProfile dump (readable with `pstats` or `snakeviz`).
+    """
+    if filepath is None:
+        yield
+        return
+
+    if filepath.endswith(".json"):
+        recorder = ChromeTraceRecorder()
+        unsubscribe_recorder = subscribe(recorder)
+        try:
+            yield
+        finally:
+            unsubscribe_recorder()
+            recorder.write(filepath)
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(filepath)
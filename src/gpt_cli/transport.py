@@ -0,0 +1,109 @@
+"""Chat completion requests with pre-encoded bodies.
+
+`create_completion` is a drop-in replacement for `ChatCompletion.create` that
+sends the body built by `payload.encode_request`, so cached message fragments
+reach the HTTP layer without being decoded and re-encoded. Responses and
+errors go through the openai client's usual interpretation, except for streams
+with `lean_stream`, which are parsed by `sse.iter_chunks`.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from openai import util
+from openai.error import APIConnectionError
+from openai.api_requestor import APIRequestor
+from openai.api_resources.chat_completion import ChatCompletion
+
+from . import sse
+from .payload import encode_request
+
+
+class _PreEncodedRequestor(APIRequestor):
+    def _prepare_request_raw(
+        self, url, supplied_headers, method, params, files, request_id: Optional[str]
+    ):
+        if not isinstance(params, bytes):
+            return super()._prepare_request_raw(
+                url, supplied_headers, method, params, files, request_id
+            )
+        abs_url, headers, _ = super()._prepare_request_raw(
+            url, supplied_headers, method, None, files, request_id
+        )
+        headers["Content-Type"] = "application/json"
+        return abs_url, headers, params
+
+
+def create_completion(
+    api_key: str | None = None,
+    api_base: str | None = None,
+    organization: str | None = None,
+    request_timeout: float | Tuple[float, float] | None = None,
+    headers: Dict[str, str] | None = None,
+    lean_stream: bool = False,
+    **params: Any,
+):
+    """Drop-in replacement for `ChatCompletion.create` (OpenAI API only).
+
+    With `lean_stream`, streamed chunks are `sse.StreamChunk`s instead of
+    `OpenAIObject`s: they only support `chunk.choices` (plain dicts) and `get`.
+    """
+    requestor = _PreEncodedRequestor(
+        api_key, api_base=api_base, organization=organization
+    )
+    stream = params.get("stream", False)
+    if isinstance(request_timeout, list):  # (connect, read) after a JSON round trip
+        request_timeout = tuple(request_timeout)
+    result = requestor.request_raw(
+        "post",
+        ChatCompletion.class_url(),
+        params=encode_request(params),
+        supplied_headers=headers,
+        stream=stream,
+        request_timeout=request_timeout,
+    )
+
+    if (
+        lean_stream
+        and stream
+        and 200 <= result.status_code < 300
+        and "text/event-stream" in result.headers.get("Content-Type", "")
+    ):
+
+        def on_error(data: bytes, event: Dict[str, Any]) -> Exception:
+            return requestor.handle_error_response(
+                data.decode(),
+                result.status_code,
+                event,
+                result.headers,
+                stream_error=True,
+            )
+
+        body = result.iter_content(chunk_size=None)
+        return _stream(result, sse.iter_chunks(body, on_error=on_error))
+
+    response, got_stream = requestor._interpret_response(result, stream)
+
+    def convert(data):
+        return util.convert_to_openai_object(
+            data, requestor.api_key, requestor.api_version, organization
+        )
+
+    if got_stream:
+        # The response is kept so that closing a stream early closes the connection
+        return _stream(result, (convert(line) for line in response))
+    return convert(response)
+
+
+def _stream(http_response, chunks):
+    try:
+        yield from chunks
+    except requests.exceptions.RequestException as e:
+        # A dropped connection mid-stream, raised as the error the caller expects
+        raise APIConnectionError(f"Error communicating with OpenAI: {e}") from e
+    finally:
+        # Stopping early (e.g. on a client-side stop condition) should not
+        # leave the server generating tokens nobody reads
+        http_response.close()
@@ -1,5 +1,7 @@
 import pytest
 
+from gpt_cli.chat import Chat
+from gpt_cli.key import OpenaiApiKey
 from gpt_cli.model import ModelName, OpenAiModel
 
 
@@ -20,3 +22,31 @@ def pytest_addoption(parser):
 @pytest.fixture
 def use_o3(request):
     return request.config.getoption("--o3")
+
+
+@pytest.fixture
+def make_chat():
+    "Build a chat that sends its requests to `create_completion` instead of the API."
+
+    def make(model, create_completion, out=None, **options) -> Chat:
+        return Chat(
+            api_key=OpenaiApiKey("sk-test"),
+            model=model,
+            out=out,
+            create_completion=create_completion,
+            **options,
+        )
+
+    return make
+
+
+@pytest.fixture
+def count_words(monkeypatch):
+    "Count one token per word, for tests that should not depend on the tokenizer."
+    for target in (
+        "gpt_cli.message.count_tokens",
+        "gpt_cli.tokens.count_tokens",
+        "gpt_cli.compare.count_tokens",
+        "gpt_cli.mapreduce.count_tokens",
+    ):
+        monkeypatch.setattr(target, lambda text, model: len(text.split()))
@@ -0,0 +1,93 @@
+import os
+import tempfile
+
+import pytest
+
+from gpt_cli import archive
+from gpt_cli.context import Context
+from gpt_cli.message import Message
+from gpt_cli.role import Role
+
+
+@pytest.fixture
+def directory():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+def make_context(model, n_messages: int) -> Context:
+    context = Context(model=model).set_system("You are a helpful assistant.")
+    for i in range(n_messages):
+        role = Role.user if i % 2 == 0 else Role.assistant
+        context.add_message(
+            Message(content=f"Message number {i}", role=role, model=model)
+        )
+    return context
+
+
+def test_roundtrip(directory, count_words, default_model_for_tests, monkeypatch):
+    monkeypatch.setattr(archive, "BLOCK_SIZE", 64)  # force several blocks
+    model = default_model_for_tests
+    context = make_context(model, 20)
+    filepath = os.path.join(directory, "chat.gptz")
+    context.save(filepath)
+
+    assert archive.is_archive(filepath)
+    assert len(archive.read_index(filepath)["blocks"]) > 1
+
+    loaded = Context(model=model).load(filepath)
+    assert loaded.system.content == context.system.content
+    assert [m.content for m in loaded.messages] == [m.content for m in context.messages]
+    assert [m.role for m in loaded.messages] == [m.role for m in context.messages]
+
+
+def test_load_tail(directory, count_words, default_model_for_tests, monkeypatch):
+    monkeypatch.setattr(archive, "BLOCK_SIZE", 64)
+    model = default_model_for_tests
+    filepath = os.path.join(directory, "chat.gptz")
+    make_context(model, 20).save(filepath)
+
+    # System message is 5 words, every message is 3 words
+    loaded = Context(model=model).load(filepath, max_tokens=5 + 3 * 4)
+    assert [m.content for m in loaded.messages] == [
+        f"Message number {i}" for i in range(16, 20)
+    ]
+
+
+def test_load_tail_recounts_other_encoding(
+    directory, count_words, default_model_for_tests, monkeypatch
+):
+    model = default_model_for_tests
+    filepath = os.path.join(directory, "chat.gptz")
+    # Written with an encoding that needs twice as many tokens
+    with monkeypatch.context() as m:
+        m.setattr(archive, "encoding_name", lambda model: "cl100k_base")
+        m.setattr(
+            "gpt_cli.message.count_tokens", lambda text, model: 2 * len(text.split())
+        )
+        make_context(model, 20).save(filepath)
+    os.remove(f"{filepath}.tokens.json")  # only the index is under test
+
+    loaded = Context(model=model).load(filepath, max_tokens=5 + 3 * 4)
+    assert [m.content for m in loaded.messages] == [
+        f"Message number {i}" for i in range(16, 20)
+    ]
+    assert loaded.messages[0].n_tokens == 3
+
+
+def test_convert_to_and_from_yaml(directory, count_words, default_model_for_tests):
+    model = default_model_for_tests
+    yaml_filepath = os.path.join(directory, "chat.yaml")
+    archive_filepath = os.path.join(directory, "chat.gptz")
+    context = make_context(model, 3)
+    context.messages[-1].incomplete = True
+    context.save(yaml_filepath)
+
+    Context(model=model).load(yaml_filepath).save(archive_filepath)
+    assert not archive.is_archive(yaml_filepath)
+    os.remove(yaml_filepath)
+    Context(model=model).load(archive_filepath).save(yaml_filepath)
+
+    loaded = Context(model=model).load(yaml_filepath)
+    assert [m.content for m in loaded.messages] == [m.content for m in context.messages]
+    assert loaded.messages[-1].incomplete
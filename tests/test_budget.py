@@ -0,0 +1,50 @@
+from gpt_cli.budget import TokenBudgetPlanner
+from gpt_cli.model import ModelName, OpenAiModel
+
+
+def test_initial_plan_reserves_less_than_max_output():
+    model = OpenAiModel(name=ModelName.gpt_5)
+    planner = TokenBudgetPlanner(model=model)
+    budget = planner.plan(history_tokens=1_000)
+
+    assert budget.context_tokens == 1_000
+    assert budget.output_tokens == 4_096
+    assert budget.output_tokens < model.max_output_tokens
+
+
+def test_output_follows_recent_replies():
+    planner = TokenBudgetPlanner(model=OpenAiModel(name=ModelName.gpt_5))
+    for reply_tokens in (100, 3_000, 200):
+        planner.observe(reply_tokens)
+    assert planner.plan(history_tokens=1_000).output_tokens == 6_000
+
+    # Only the latest replies count, and there is a minimum allowance
+    planner = TokenBudgetPlanner(
+        model=OpenAiModel(name=ModelName.gpt_5), n_recent_replies=1
+    )
+    for reply_tokens in (3_000, 10):
+        planner.observe(reply_tokens)
+    assert planner.plan(history_tokens=1_000).output_tokens == 1_024
+
+
+def test_large_history_gets_the_rest_of_the_window():
+    model = OpenAiModel(name=ModelName.gpt_5)
+    planner = TokenBudgetPlanner(model=model)
+    budget = planner.plan(history_tokens=1_000_000)
+
+    # The static split would leave 400k - 128k for the context
+    assert budget.context_tokens == model.max_context_tokens - 1_024
+    assert budget.output_tokens == 1_024
+    assert budget.context_tokens + budget.output_tokens <= model.max_context_tokens
+
+
+def test_configured_limits_are_hard_bounds():
+    model = OpenAiModel(name=ModelName.gpt_5)
+    planner = TokenBudgetPlanner(
+        model=model, max_context_tokens=50_000, max_output_tokens=2_000
+    )
+    planner.observe(100_000)
+    budget = planner.plan(history_tokens=1_000_000)
+
+    assert budget.context_tokens == 50_000
+    assert budget.output_tokens == 2_000
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+import typer
+from openai.error import RateLimitError
+from openai.util import convert_to_openai_object
+
+from gpt_cli.cassette import CassetteError, Player, Recorder
+from gpt_cli.chat import Chat
+from gpt_cli.key import OpenaiApiKey
+
+
+def slow_stream(*contents, delay=0.0):
+    def create(**params):
+        for content in contents:
+            time.sleep(delay)
+            yield convert_to_openai_object(
+                {"choices": [{"delta": {"content": content}}]}
+            )
+
+    return create
+
+
+def run_chat(create_completion, model, user_inputs, api_key="sk-test") -> Chat:
+    "Run the whole chat loop until the inputs run out."
+    chat = Chat(
+        api_key=OpenaiApiKey(api_key) if api_key else None,
+        model=model,
+        create_completion=create_completion,
+    )
+    inputs = iter(user_inputs)
+
+    def ask_for_input(**kwargs):
+        for user_input in inputs:
+            return user_input
+        raise typer.Exit()
+
+    chat.ask_for_input = ask_for_input
+    with pytest.raises(typer.Exit):
+        chat.start()
+    return chat
+
+
+def test_record_and_replay(count_words, tmp_path, default_model_for_tests):
+    cassette = str(tmp_path / "chat.jsonl")
+    model = default_model_for_tests
+    recorder = Recorder(cassette, slow_stream("Banksy ", "is ", "an artist."))
+    recorded = run_chat(recorder, model, ["Who?", "Really?"])
+    assert "sk-test" not in open(cassette).read()
+
+    # Same conversation without a key, through the same loop
+    replayed = run_chat(Player(cassette), model, ["Who?", "Really?"], api_key=None)
+    assert [m.content for m in replayed.context.messages] == [
+        m.content for m in recorded.context.messages
+    ]
+    assert replayed.context.last_message.content == "Banksy is an artist."
+
+
+def test_replay_at_recorded_pace(tmp_path):
+    cassette = str(tmp_path / "chat.jsonl")
+    recorder = Recorder(cassette, slow_stream("a", "b", "c", delay=0.05))
+    params = {"model": "gpt-4o-mini", "messages": [], "stream": True}
+    assert len(list(recorder(**params))) == 3
+
+    start = time.monotonic()
+    assert len(list(Player(cassette, realtime=True)(**params))) == 3
+    assert time.monotonic() - start >= 0.15
+
+    start = time.monotonic()
+    chunks = list(Player(cassette)(**params))
+    assert time.monotonic() - start < 0.05
+    assert [c.choices[0].delta.content for c in chunks] == ["a", "b", "c"]
+
+
+def test_replay_errors_and_mismatches(tmp_path):
+    cassette = str(tmp_path / "chat.jsonl")
+
+    def rate_limited(**params):
+        raise RateLimitError("Slow down", http_status=429)
+
+    params = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "?"}]}
+    with pytest.raises(RateLimitError):
+        Recorder(cassette, rate_limited)(**params)
+
+    player = Player(cassette)
+    with pytest.raises(RateLimitError) as error:
+        player(**params, api_key="sk-other")  # credentials do not matter
+    assert error.value.http_status == 429
+    with pytest.raises(CassetteError):
+        player(**params)  # every recorded reply is used once
+    with pytest.raises(CassetteError):
+        Player(cassette)(**{**params, "temperature": 0.5})
@@ -0,0 +1,311 @@
+import tempfile
+import threading
+import time
+
+import pytest
+import yaml
+from openai.error import APIConnectionError, Timeout
+from openai.util import convert_to_openai_object
+
+from gpt_cli.chat import Chat
+from gpt_cli.context import Context
+from gpt_cli.message import Message
+from gpt_cli.model import ModelName
+from gpt_cli.role import Role
+from gpt_cli.router import LatencyHistory, ModelRouter, RoutingRule
+from gpt_cli.tools import ToolRegistry
+
+
+def make_stream(*contents):
+    def create(**params):
+        return (
+            convert_to_openai_object({"choices": [{"delta": {"content": c}}]})
+            for c in contents
+        )
+
+    return create
+
+
+@pytest.fixture
+def out_filepath():
+    with tempfile.NamedTemporaryFile(suffix=".yaml") as f:
+        yield f.name
+
+
+def test_stream_reply_joins_chunks(default_model_for_tests, make_chat):
+    chat = make_chat(default_model_for_tests, make_stream("Hel", "lo", "!"))
+    assert chat._stream_replies(messages=[])[0] == "Hello!"
+
+
+def test_stream_reply_checkpoints_partial(
+    out_filepath, default_model_for_tests, make_chat
+):
+    checkpoints = []
+
+    def create(**params):
+        for content in ("Banksy ", "is ", "an artist."):
+            yield convert_to_openai_object(
+                {"choices": [{"delta": {"content": content}}]}
+            )
+            checkpoints.append(yaml.safe_load(open(out_filepath)))
+
+    model = default_model_for_tests
+    chat = make_chat(model, create, out=out_filepath)
+    chat.CHECKPOINT_SECONDS = 0
+    # Without timeouts the stream is read in step with the checkpoints
+    chat.first_token_timeout = chat.chunk_timeout = None
+    chat.context.add_message(Message(content="Who?", role=Role.user, model=model))
+
+    assert chat._stream_replies(messages=[])[0] == "Banksy is an artist."
+    assert checkpoints[0][-1] == {
+        "role": "assistant",
+        "incomplete": True,
+        "content": "Banksy ",
+    }
+    assert checkpoints[1][-1]["content"] == "Banksy is "
+
+
+def test_continue_incomplete_reply(default_model_for_tests, make_chat):
+    requests = []
+
+    def create(**params):
+        requests.append(params["messages"])
+        return make_stream(" an artist.")()
+
+    model = default_model_for_tests
+    chat = make_chat(model, create)
+    chat.max_context_tokens = 0  # keep the test free of tokenization
+    reply = chat._get_reply(continue_from="Banksy is")
+
+    assert reply == "Banksy is an artist."
+    assert requests[0][-2] == {"role": "assistant", "content": "Banksy is"}
+    assert requests[0][-1]["role"] == "user"
+
+
+def test_stream_several_choices(default_model_for_tests, make_chat):
+    requests = []
+
+    def create(**params):
+        requests.append(params)
+        for index, content in ((0, "Yes"), (1, "No"), (0, "!"), (1, "?")):
+            yield convert_to_openai_object(
+                {"choices": [{"index": index, "delta": {"content": content}}]}
+            )
+
+    chat = make_chat(default_model_for_tests, create)
+    assert chat._stream_replies(messages=[], n=2) == ["Yes!", "No?"]
+    assert requests[0]["n"] == 2
+
+
+def test_regenerate_replaces_last_reply(
+    count_words, default_model_for_tests, make_chat
+):
+    model = default_model_for_tests
+    chat = make_chat(model, make_stream("Second", " try"))
+    chat.max_context_tokens = 0  # keep the test free of tokenization
+    chat.context.add_message(Message(content="Who?", role=Role.user, model=model))
+    chat.context.add_message(
+        Message(content="First try", role=Role.assistant, model=model)
+    )
+
+    assert chat._run_command("/regenerate")
+    assert [m.content for m in chat.context.messages] == ["Who?", "Second try"]
+    assert not chat._run_command("/unknown")
+    assert not chat._run_command("")
+
+
+def test_auto_model_routes_every_turn(count_words, default_model_for_tests, make_chat):
+    requests = []
+
+    def create(**params):
+        requests.append(params)
+        return make_stream("Fine", " thanks")()
+
+    rules = [RoutingRule(models=[ModelName.gpt_4_1_nano])]
+    router = ModelRouter(rules=rules, history=LatencyHistory(filepath=None))
+    model = default_model_for_tests
+    chat = make_chat(router.largest_model, create)
+    chat.router = router
+    chat.context.add_message(Message(content="How?", role=Role.user, model=model))
+
+    assert chat._get_reply() == "Fine thanks"
+    assert requests[0]["model"] == ModelName.gpt_4_1_nano
+    assert requests[0]["max_completion_tokens"] <= chat.model.max_output_tokens
+    assert ModelName.gpt_4_1_nano.value in router.history.models
+
+
+def test_branch_commands(count_words, out_filepath, default_model_for_tests, make_chat):
+    model = default_model_for_tests
+    chat = make_chat(model, make_stream("Unused"), out=out_filepath)
+    for content, role in (("Who?", Role.user), ("Banksy", Role.assistant)):
+        chat.context.add_message(Message(content=content, role=role, model=model))
+
+    assert chat._run_command("/branch alt")
+    assert chat._run_command("/rewind 2")
+    assert chat.context.messages == []
+    assert chat._run_command("/switch main")
+    assert [m.content for m in chat.context.messages] == ["Who?", "Banksy"]
+    # Invalid arguments are reported, not raised
+    assert chat._run_command("/rewind many")
+    assert chat._run_command("/switch missing")
+    assert chat.context.branch == "main"
+
+
+def test_stop_condition_closes_stream(default_model_for_tests, make_chat):
+    closed = []
+
+    def create(**params):
+        try:
+            for content in ("one\n", "two\n", "three\n", "four\n"):
+                yield convert_to_openai_object(
+                    {"choices": [{"delta": {"content": content}}]}
+                )
+        finally:
+            closed.append(True)
+
+    chat = make_chat(default_model_for_tests, create)
+    chat.stop_when = ["lines:2"]
+    assert chat._stream_replies(messages=[])[0] == "one\ntwo"
+    assert chat.stop_reasons == ["reached 2 lines"]
+    assert closed
+
+
+def test_stop_condition_closes_slow_stream(default_model_for_tests, make_chat):
+    closed = threading.Event()
+
+    def create(**params):
+        try:
+            for content in ("one\n", "two\n", "three\n", "four\n"):
+                yield convert_to_openai_object(
+                    {"choices": [{"delta": {"content": content}}]}
+                )
+                time.sleep(0.2)  # the reader thread is still inside `next()`
+        finally:
+            closed.set()
+
+    chat = make_chat(default_model_for_tests, create)
+    assert chat.chunk_timeout is not None  # read on another thread
+    chat.stop_when = ["lines:2"]
+    assert chat._stream_replies(messages=[])[0] == "one\ntwo"
+    # Closed by the reader thread once it gets the stream back
+    assert closed.wait(timeout=5)
+
+
+def test_dropped_stream_is_continued(default_model_for_tests, make_chat):
+    requests = []
+
+    def create(**params):
+        requests.append(params["messages"])
+        if len(requests) == 1:
+            yield convert_to_openai_object(
+                {"choices": [{"delta": {"content": "Banksy is"}}]}
+            )
+            raise APIConnectionError("Connection reset")
+        yield convert_to_openai_object(
+            {"choices": [{"delta": {"content": " an artist."}}]}
+        )
+
+    model = default_model_for_tests
+    chat = make_chat(model, create)
+    chat.max_context_tokens = 0  # keep the test free of tokenization
+    assert chat._get_reply() == "Banksy is an artist."
+    assert requests[1][-2] == {"role": "assistant", "content": "Banksy is"}
+
+
+def test_compact_user_message(count_words, default_model_for_tests, make_chat):
+    chat = make_chat(default_model_for_tests, make_stream("OK"), compact=True)
+    user_input = "Log:\n" + "retrying connection\n" * 10
+    message = chat._user_message(user_input)
+    assert message.original == user_input
+    assert message.content == (
+        "Log:\nretrying connection\n[previous line repeated 9 more times]"
+    )
+    assert chat._user_message("Thanks").original is None
+
+
+def test_tool_calls_are_run_and_answered(
+    count_words, tmp_path, default_model_for_tests, make_chat
+):
+    (tmp_path / "a.txt").write_text("alpha")
+    (tmp_path / "b.txt").write_text("beta")
+    requests = []
+
+    def create(**params):
+        requests.append(params)
+        if len(requests) == 1:
+            for index, path in enumerate(("a.txt", "b.txt")):
+                yield convert_to_openai_object(
+                    {
+                        "choices": [
+                            {
+                                "delta": {
+                                    "tool_calls": [
+                                        {
+                                            "index": index,
+                                            "id": f"call_{index}",
+                                            "function": {
+                                                "name": "read_file",
+                                                "arguments": f'{{"path": "{path}"}}',
+                                            },
+                                        }
+                                    ]
+                                }
+                            }
+                        ]
+                    }
+                )
+        else:
+            yield convert_to_openai_object(
+                {"choices": [{"delta": {"content": "Both are Greek letters."}}]}
+            )
+
+    model = default_model_for_tests
+    out = str(tmp_path / "chat.yaml")
+    chat = make_chat(model, create, out=out, tools=ToolRegistry(root=str(tmp_path)))
+    chat.context.add_message(Message(content="Compare", role=Role.user, model=model))
+
+    assert chat._respond() == "Both are Greek letters."
+    assert requests[0]["tools"][0]["function"]["name"] == "read_file"
+    assert [m["role"] for m in requests[1]["messages"][-3:]] == [
+        "assistant",
+        "tool",
+        "tool",
+    ]
+    assert requests[1]["messages"][-1] == {
+        "role": "tool",
+        "content": "beta",
+        "tool_call_id": "call_1",
+    }
+    tool_message = chat.context.messages[-2]
+    assert tool_message.n_tokens == 1
+
+    # Tool calls and results survive saving and loading
+    loaded = Context(model=model).load(out)
+    assert [m.role for m in loaded.messages] == [m.role for m in chat.context.messages]
+    assert loaded.messages[1].tool_calls == chat.context.messages[1].tool_calls
+    assert loaded.messages[2].tool_call_id == "call_0"
+
+
+def test_unstreamed_reply_has_no_read_timeout(
+    count_words, default_model_for_tests, monkeypatch, make_chat
+):
+    monkeypatch.setattr(Chat, "RETRY_SLEEP", 0)
+    requests = []
+
+    def create(**params):
+        requests.append(params)
+        if len(requests) == 1:
+            raise Timeout("Request timed out")
+        return convert_to_openai_object(
+            {"choices": [{"message": {"role": "assistant", "content": "Done"}}]}
+        )
+
+    model = default_model_for_tests
+    chat = make_chat(model, create)
+    chat.stream_output = False
+    chat.context.add_message(Message(content="Long task", role=Role.user, model=model))
+
+    # A timeout is retried like other transient errors
+    assert chat._get_reply() == "Done"
+    assert len(requests) == 2 and "request_timeout" not in requests[1]
+    assert "request_timeout" in chat.stream_params
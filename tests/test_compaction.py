@@ -0,0 +1,57 @@
+from gpt_cli.compaction import (
+    Compactor,
+    collapse_repeats,
+    normalize_whitespace,
+    split_fences,
+)
+
+CODE = "```python\nx  =  1   \n\n\n\ny = 2\n```"
+
+
+def test_split_fences():
+    text = f"Look:\n{CODE}\nThanks"
+    assert list(split_fences(text)) == [
+        (False, "Look:\n"),
+        (True, CODE + "\n"),
+        (False, "Thanks"),
+    ]
+
+
+def test_whitespace_outside_code_only():
+    text = f"Error  in   line 3:   \n\n\n\n    indented   text\n{CODE}\n"
+    assert normalize_whitespace(text) == (
+        f"Error in line 3:\n\n    indented text\n{CODE}"
+    )
+
+
+def test_collapse_repeats():
+    text = "start\n" + "  WARN retrying\n" * 40 + "done\ndone"
+    assert collapse_repeats(text) == (
+        "start\n  WARN retrying\n  [previous line repeated 39 more times]\n"
+        "done\ndone"
+    )
+
+
+def test_repeats_in_code_are_kept():
+    code = "```\n" + "assert ok()\n" * 5 + "```"
+    text = "log\n" * 5 + code
+    assert Compactor().compact(text) == (
+        f"log\n[previous line repeated 4 more times]\n{code}"
+    )
+
+
+def test_dedupe_blocks_in_history():
+    block = "```\n" + "\n".join(f"line {i}" for i in range(50)) + "\n```"
+    compactor = Compactor()
+    history = [f"Here is my code:\n{block}"]
+
+    compacted = compactor.compact(
+        f"Why does this fail?\n{block}\nPlease help.", history
+    )
+    assert compacted == (
+        "Why does this fail?\n"
+        "[52 lines omitted: same as in an earlier message]\n"
+        "Please help."
+    )
+    # Nothing to omit when the block is not in the window anymore
+    assert block in compactor.compact(f"Again:\n{block}", history=[])
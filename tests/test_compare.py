@@ -0,0 +1,109 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from rich.console import Console
+from typer.testing import CliRunner
+
+from gpt_cli.compare import Comparison, RunStats, percentile
+from gpt_cli.main import app
+from gpt_cli.model import ModelName, OpenAiModel
+
+MESSAGES = [{"role": "user", "content": "Say hi"}]
+
+
+class StandIn(BaseHTTPRequestHandler):
+    "A local OpenAI-compatible API: gpt-4.1-nano reports usage, o3 fails."
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if body["model"] == "o3":
+            self._send(429, "application/json", {"error": {"message": "Slow down"}})
+            return
+        events = [
+            {"choices": [{"index": 0, "delta": {"content": word}}]}
+            for word in ("Hi", " from", f" {body['model']}")
+        ]
+        if body["model"] == "gpt-4.1-nano":
+            usage = {"prompt_tokens": 7, "completion_tokens": 3}
+            events.append({"choices": [], "usage": usage})
+        data = "".join(f"data: {json.dumps(e)}\n\n" for e in events)
+        self._send(200, "text/event-stream", data + "data: [DONE]\n\n")
+
+    def _send(self, status, content_type, data):
+        encoded = data if isinstance(data, str) else json.dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.end_headers()
+        self.wfile.write(encoded.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def api_base():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+
+
+def test_percentile():
+    assert percentile([3.0], 90) == 3.0
+    assert percentile([4.0, 1.0, 3.0, 2.0], 50) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 90) == pytest.approx(4.6)
+
+
+def test_tokens_per_second():
+    assert RunStats(1.0, 3.0, 10, 50).tokens_per_second == 25
+    assert RunStats(None, 3.0, 10, 0).tokens_per_second is None
+
+
+def test_compare_against_stand_in(count_words, api_base):
+    models = [
+        OpenAiModel(name=name)
+        for name in (ModelName.gpt_4_1_nano, ModelName.gpt_4o_mini, ModelName.gpt_o3)
+    ]
+    comparison = Comparison(
+        models=models,
+        messages=MESSAGES,
+        repeat=3,
+        console=Console(file=open("/dev/null", "w")),
+        api_key="sk-local",
+        api_base=api_base,
+    )
+    nano, mini, o3 = comparison.run()
+
+    assert nano.reply == "Hi from gpt-4.1-nano"
+    assert [(r.prompt_tokens, r.completion_tokens) for r in nano.runs] == [(7, 3)] * 3
+    # Counted on the client when the server does not report usage
+    assert [(r.prompt_tokens, r.completion_tokens) for r in mini.runs] == [(2, 3)] * 3
+    assert all(r.ttft is not None and r.ttft <= r.seconds for r in nano.runs)
+    assert (len(o3.runs), len(o3.errors)) == (0, 3)
+
+    console = Console(width=200, record=True, file=open("/dev/null", "w"))
+    console.print(comparison.table())
+    text = console.export_text()
+    assert "p50 / p90 of 3 rounds" in text
+    assert "7 / 7" in text
+
+
+def test_compare_command(count_words, api_base):
+    result = CliRunner().invoke(
+        app,
+        [
+            "compare",
+            "Say hi",
+            "--model",
+            "gpt-4.1-nano",
+            "--model",
+            "gpt-4o-mini",
+            "--api-base",
+            api_base,
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "Hi from gpt-4o-mini" in result.output
+    assert "Comparison" in result.output
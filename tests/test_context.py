@@ -1,7 +1,9 @@
 import tempfile
 
 import pytest
+import yaml
 
+from gpt_cli import history
 from gpt_cli.chat import Context, Role
 from gpt_cli.message import Message
 from gpt_cli.model import OpenAiModel, ModelName
@@ -148,3 +150,174 @@ def test_save(save_filepath, default_model_for_tests):
     for m1, m2 in zip(context.messages, loaded_context.messages):
         assert m1.content == m2.content
         assert m1.role == m2.role
+
+
+def test_save_partial(save_filepath, default_model_for_tests):
+    model = default_model_for_tests
+    context = Context(model=model)
+    context.add_message(Message(content="Who is Banksy?", role=Role.user, model=model))
+    partial = Message(
+        content="Banksy is", role=Role.assistant, model=model, incomplete=True
+    )
+    context.save(save_filepath, partial=partial)
+
+    # Partial reply is only written to the file, not added to the context
+    assert len(context.messages) == 1
+
+    loaded_context = Context(model=model).load(save_filepath)
+    assert len(loaded_context.messages) == 2
+    assert not loaded_context.messages[0].incomplete
+    assert loaded_context.messages[1].incomplete
+    assert loaded_context.messages[1].content == "Banksy is"
+
+
+def make_branched_context(model) -> Context:
+    context = Context(model=model)
+    context.set_system("You are a helpful assistant.")
+    for i, role in enumerate((Role.user, Role.assistant) * 2):
+        context.add_message(Message(content=f"Message {i}", role=role, model=model))
+    context.fork("alt").rewind(2)
+    context.add_message(Message(content="Other question", role=Role.user, model=model))
+    context.fork("alt2")
+    context.add_message(
+        Message(content="Other answer", role=Role.assistant, model=model)
+    )
+    return context
+
+
+def test_branches_share_history(count_words, default_model_for_tests):
+    context = make_branched_context(default_model_for_tests)
+    assert [m.content for m in context.messages] == [
+        "Message 0",
+        "Message 1",
+        "Other question",
+        "Other answer",
+    ]
+    assert context.n_tokens == 5 + 4 * 2
+
+    context.switch("main")
+    assert len(context.messages) == 4
+    assert context.messages[-1].content == "Message 3"
+    # The common prefix is the same objects, not copies
+    alt = context.branches["alt"]
+    assert alt is not None and alt.parent is context.branches["main"].parent.parent
+
+    with pytest.raises(ValueError):
+        context.fork("alt")
+    with pytest.raises(ValueError):
+        context.switch("missing")
+    with pytest.raises(ValueError):
+        context.rewind(5)
+
+
+def test_save_and_load_branches(count_words, save_filepath, default_model_for_tests):
+    model = default_model_for_tests
+    context = make_branched_context(model)
+    context.save(save_filepath)
+
+    # Only the divergent suffixes go to the sidecar
+    with open(f"{save_filepath}.branches.yaml") as file:
+        saved = yaml.safe_load(file)
+    assert saved["current"] == "alt2"
+    assert [(b["name"], b["parent"], b["fork_depth"]) for b in saved["branches"]] == [
+        ("main", "alt2", 2),
+        ("alt", "alt2", 3),
+    ]
+    assert [len(b["messages"]) for b in saved["branches"]] == [2, 0]
+
+    loaded = Context(model=model).load(save_filepath)
+    assert loaded.branch == "alt2"
+    for name in context.branches:
+        context.switch(name)
+        loaded.switch(name)
+        assert [m.content for m in loaded.messages] == [
+            m.content for m in context.messages
+        ]
+
+
+def test_spill_old_messages(count_words, save_filepath, default_model_for_tests):
+    model = default_model_for_tests
+    context = Context(model=model, keep_tokens=6)
+    for i in range(6):
+        role = Role.user if i % 2 == 0 else Role.assistant
+        context.add_message(Message(content=f"Message {i}", role=role, model=model))
+
+    spilled = [node.spilled for node in reversed(list(history.ancestors(context.head)))]
+    # Messages are 2 tokens each: the newest ones that exceed 6 tokens stay
+    assert spilled == [True, True, False, False, False, False]
+    assert context.n_tokens == 12
+
+    # Paged back in when a larger window needs them
+    assert [m.content for m in context._get_context(max_context_tokens=12)] == [
+        f"Message {i}" for i in range(6)
+    ]
+
+    context.save(save_filepath)
+    loaded = Context(model=model).load(save_filepath)
+    assert [m.content for m in loaded.messages] == [m.content for m in context.messages]
+
+
+def test_load_uses_saved_token_counts(
+    count_words, monkeypatch, save_filepath, default_model_for_tests
+):
+    model = default_model_for_tests
+    context = Context(model=model).set_system("Be brief.")
+    # Line breaks and trailing spaces should read back as they were saved
+    for content in ("Message one", "Message\nnumber two  "):
+        context.add_message(Message(content=content, role=Role.user, model=model))
+    context.save(save_filepath)
+
+    # Edit one message, so only its count is stale
+    with open(save_filepath) as file:
+        text = file.read()
+    with open(save_filepath, "w") as file:
+        file.write(text.replace("Message one", "Message three words"))
+
+    counted = []
+
+    def count_tokens(text, model):
+        counted.append(text)
+        return len(text.split())
+
+    monkeypatch.setattr("gpt_cli.message.count_tokens", count_tokens)
+    loaded = Context(model=model).load(save_filepath)
+    assert loaded.n_tokens == 2 + 3 + 3
+    assert counted == ["Message three words"]
+
+
+def test_save_keeps_original(count_words, save_filepath, default_model_for_tests):
+    model = default_model_for_tests
+    context = Context(model=model)
+    original = "line1\nline2\n\n\n\nline3  \n  indented\r\n"
+    message = Message(
+        content="Error x3", role=Role.user, model=model, original=original
+    )
+    context.add_message(message)
+    context.save(save_filepath)
+
+    loaded = Context(model=model).load(save_filepath).messages[0]
+    assert (loaded.content, loaded.original) == ("Error x3", original)
+
+
+def test_window_does_not_start_with_tool_results(count_words, default_model_for_tests):
+    model = default_model_for_tests
+    context = Context(model=model)
+    call = {"id": "c", "type": "function", "function": {"name": "f", "arguments": ""}}
+    context.add_message(
+        Message(content="", role=Role.assistant, model=model, tool_calls=[call])
+    )
+    context.add_message(
+        Message(content="one two", role=Role.tool, model=model, tool_call_id="c")
+    )
+    context.add_message(Message(content="Done", role=Role.assistant, model=model))
+
+    # The reply that asked for the result does not fit
+    assert context.messages[0].n_tokens == 1
+    assert [m["role"] for m in context.get_messages(max_context_tokens=3)] == [
+        "assistant"
+    ]
+    assert [m["role"] for m in context.get_messages(max_context_tokens=4)] == [
+        "assistant",
+        "tool",
+        "assistant",
+    ]
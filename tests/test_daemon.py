@@ -0,0 +1,208 @@
+import gc
+import json
+import os
+import socket
+import tempfile
+import threading
+import weakref
+
+import pytest
+from openai.error import APIConnectionError, RateLimitError
+from openai.util import convert_to_openai_object
+
+from gpt_cli import daemon, tokens
+from gpt_cli.daemon import DaemonClient, DaemonServer
+from gpt_cli.keypool import KeyPool, PooledKey
+from gpt_cli.model import ModelName
+from gpt_cli.payload import RequestMessage
+from gpt_cli.timeouts import StreamTimeout
+
+
+def fake_create(**params):
+    if params["messages"][-1]["content"] == "fail":
+        raise RateLimitError("Slow down", http_status=429)
+    if not params.get("stream"):
+        return convert_to_openai_object(
+            {"choices": [{"message": {"role": "assistant", "content": "Hi"}}]}
+        )
+    return (
+        convert_to_openai_object({"choices": [{"delta": {"content": c}}]})
+        for c in ("H", "i", params["api_key"])
+    )
+
+
+@pytest.fixture
+def socket_path(monkeypatch):
+    monkeypatch.setattr(daemon.transport, "create_completion", fake_create)
+    monkeypatch.setattr(daemon, "count_tokens", lambda text, model: len(text))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "daemon.sock")
+        server = DaemonServer(path, daemon._Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield path
+        server.shutdown()
+        server.server_close()
+
+
+def test_connect_without_daemon():
+    with tempfile.TemporaryDirectory() as directory:
+        assert DaemonClient.connect(os.path.join(directory, "missing.sock")) is None
+
+
+def test_ping_and_count_tokens(socket_path):
+    client = DaemonClient.connect(socket_path)
+    assert client is not None
+    assert client.ping() == os.getpid()
+    assert client.count_tokens("Hello", ModelName.gpt_4_1_nano) == 5
+
+
+def test_chat_completion(socket_path):
+    client = DaemonClient(socket_path, api_key="sk-test")
+    messages = [{"role": "user", "content": "Hello"}]
+
+    completion = client.chat_completion(model="gpt-4.1-nano", messages=messages)
+    assert completion.choices[0].message["content"] == "Hi"
+
+    stream = client.chat_completion(
+        model="gpt-4.1-nano", messages=messages, stream=True
+    )
+    assert "".join(c.choices[0].delta.content for c in stream) == "Hisk-test"
+
+
+def test_chat_completion_sends_cached_fragments(socket_path, monkeypatch):
+    monkeypatch.setattr(
+        daemon.transport,
+        "create_completion",
+        lambda **params: convert_to_openai_object(
+            {"choices": [{"message": params["messages"][0]}]}
+        ),
+    )
+    message = RequestMessage("user", "Hello")
+    message._json = b'{"role":"user","content":"From the cache"}'
+    client = DaemonClient(socket_path, api_key="sk-test")
+    completion = client.chat_completion(model="gpt-4.1-nano", messages=[message])
+    assert completion.choices[0].message["content"] == "From the cache"
+
+
+def test_openai_errors_are_reraised(socket_path):
+    client = DaemonClient(socket_path, api_key="sk-test")
+    with pytest.raises(RateLimitError):
+        client.chat_completion(
+            model="gpt-4.1-nano", messages=[{"role": "user", "content": "fail"}]
+        )
+
+
+def test_key_pool_falls_back_on_streams(socket_path, monkeypatch):
+    def create(**params):
+        if params["api_key"] == "sk-limited":
+            raise RateLimitError("Slow down", http_status=429)
+        return fake_create(**params)
+
+    monkeypatch.setattr(daemon.transport, "create_completion", create)
+    pool = KeyPool(
+        [
+            PooledKey(name="limited", key="sk-limited", tpm=1_000_000),
+            PooledKey(name="other", key="sk-other"),
+        ]
+    )
+    create_completion = pool.wrap(DaemonClient(socket_path).chat_completion)
+    stream = create_completion(
+        model="gpt-4.1-nano",
+        messages=[{"role": "user", "content": "Hello"}],
+        stream=True,
+    )
+    assert "".join(c.choices[0].delta.content for c in stream) == "Hisk-other"
+    assert pool.usage["limited"].rate_limited == 1
+
+
+def test_stream_timeouts_are_reraised(socket_path, monkeypatch):
+    def stalled(**params):
+        raise StreamTimeout("No response for 1 seconds.")
+
+    monkeypatch.setattr(daemon.transport, "create_completion", stalled)
+    client = DaemonClient(socket_path, api_key="sk-test")
+    with pytest.raises(StreamTimeout):
+        client.chat_completion(model="gpt-4.1-nano", messages=[])
+
+
+def test_fall_back_when_the_daemon_is_gone(socket_path, monkeypatch):
+    client = DaemonClient.connect(socket_path)
+    tokens.set_counter(client.count_tokens)
+    try:
+        os.remove(socket_path)  # as if the daemon had exited
+        monkeypatch.setattr(tokens, "count_tokens", lambda text, model: -1)
+        # Counted in this process, which no longer delegates to the daemon
+        assert client.count_tokens("Hello", ModelName.gpt_4_1_nano) == 5
+        assert tokens.get_counter() is None
+        completion = client.chat_completion(
+            model="gpt-4.1-nano",
+            messages=[{"role": "user", "content": "Hello"}],
+            api_key="sk-test",
+        )
+        assert completion.choices[0].message["content"] == "Hi"
+    finally:
+        tokens.set_counter(None)
+
+
+def test_lost_connection_is_a_connection_error(socket_path, monkeypatch):
+    def dies(handler, params):
+        # One chunk, then the connection closes without a `done` line
+        chunk = {"choices": [{"delta": {"content": "H"}}]}
+        daemon._write(handler.wfile, {"started": True})
+        daemon._write(handler.wfile, {"chunk": chunk})
+
+    monkeypatch.setattr(daemon._Handler, "_chat_completion", dies)
+    client = DaemonClient(socket_path, api_key="sk-test")
+    stream = client.chat_completion(model="gpt-4.1-nano", messages=[], stream=True)
+    assert next(stream).choices[0].delta.content == "H"
+    with pytest.raises(APIConnectionError):
+        next(stream)
+
+
+def test_handler_survives_bad_requests_and_gone_clients(socket_path, monkeypatch):
+    errors, done = [], threading.Event()
+    handle = daemon._Handler.handle
+
+    def checked_handle(handler):
+        try:
+            handle(handler)
+        except BaseException as e:  # would be printed by the daemon
+            errors.append(e)
+            raise
+        finally:
+            done.set()
+
+    def endless(**params):
+        return (
+            convert_to_openai_object({"choices": [{"delta": {"content": "x"}}]})
+            for _ in iter(int, 1)
+        )
+
+    monkeypatch.setattr(daemon._Handler, "handle", checked_handle)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(b"not json\n")
+        with sock.makefile("rb") as rfile:
+            assert "error" in json.loads(rfile.readline())
+    assert done.wait(timeout=5)
+
+    # The client stops reading mid-stream, as after a stop condition
+    done.clear()
+    monkeypatch.setattr(daemon.transport, "create_completion", endless)
+    client = DaemonClient(socket_path, api_key="sk-test")
+    stream = client.chat_completion(model="gpt-4.1-nano", messages=[], stream=True)
+    assert next(stream).choices[0].delta.content == "x"
+    stream.close()
+    assert done.wait(timeout=5)
+    assert errors == []
+
+
+def test_clients_are_not_kept_alive(socket_path):
+    client = DaemonClient.connect(socket_path)
+    client.count_tokens("Hello", ModelName.gpt_4_1_nano)
+    ref = weakref.ref(client)
+    del client
+    gc.collect()
+    assert ref() is None
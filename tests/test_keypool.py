@@ -0,0 +1,96 @@
+import pytest
+from openai.error import AuthenticationError, RateLimitError
+from openai.util import convert_to_openai_object
+
+from gpt_cli.keypool import KeyPool, PooledKey
+
+MESSAGES = [{"role": "user", "content": "Hello!"}]
+
+
+def make_pool() -> KeyPool:
+    return KeyPool(
+        [
+            PooledKey(name="small", key="sk-small", rpm=10, tpm=1_000),
+            PooledKey(name="large", key="sk-large", rpm=100, tpm=100_000),
+        ]
+    )
+
+
+def completion(n_tokens: int):
+    return convert_to_openai_object(
+        {
+            "choices": [{"message": {"role": "assistant", "content": "Hi"}}],
+            "usage": {"completion_tokens": n_tokens},
+        }
+    )
+
+
+def test_requests_go_to_the_key_with_most_headroom():
+    pool = make_pool()
+    used_keys = []
+
+    def create(**params):
+        used_keys.append(params["api_key"])
+        return completion(10)
+
+    create_with_pool = pool.wrap(create)
+    create_with_pool(model="gpt-4.1-nano", messages=MESSAGES)
+    assert used_keys == ["sk-large"]
+    assert pool.usage["large"].requests == 1
+    assert pool.usage["large"].tokens == 1 + 10
+
+
+def test_fallback_on_rate_limit_and_auth_errors():
+    pool = make_pool()
+    used_keys = []
+
+    def create(**params):
+        used_keys.append(params["api_key"])
+        if params["api_key"] == "sk-large":
+            raise RateLimitError("Slow down", headers={"retry-after": "30"})
+        return completion(10)
+
+    create_with_pool = pool.wrap(create)
+    create_with_pool(model="gpt-4.1-nano", messages=MESSAGES)
+    assert used_keys == ["sk-large", "sk-small"]
+    assert pool.usage["large"].rate_limited == 1
+
+    # The large key is cooling down, so the small one is used directly
+    create_with_pool(model="gpt-4.1-nano", messages=MESSAGES)
+    assert used_keys[-1] == "sk-small"
+
+
+def test_all_keys_fail_authentication():
+    pool = make_pool()
+
+    def create(**params):
+        raise AuthenticationError("Incorrect API key")
+
+    with pytest.raises(AuthenticationError):
+        pool.wrap(create)(model="gpt-4.1-nano", messages=MESSAGES)
+    assert all(usage.disabled for usage in pool.usage.values())
+
+
+def test_all_keys_rate_limited():
+    pool = make_pool()
+
+    def create(**params):
+        raise RateLimitError("Slow down")
+
+    with pytest.raises(RateLimitError):
+        pool.wrap(create)(model="gpt-4.1-nano", messages=MESSAGES)
+
+
+def test_stream_usage_is_recorded():
+    pool = make_pool()
+
+    def create(**params):
+        yield convert_to_openai_object({"choices": [{"delta": {"content": "Hi"}}]})
+        yield convert_to_openai_object(
+            {"choices": [], "usage": {"completion_tokens": 42}}
+        )
+
+    stream = pool.wrap(create)(model="gpt-4.1-nano", messages=MESSAGES, stream=True)
+    assert len(list(stream)) == 2
+    assert pool.usage["large"].tokens == 1 + 42
+    assert pool.stats().row_count == 2
@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+from openai.util import convert_to_openai_object
+
+from gpt_cli.mapreduce import Checkpoint, MapReduce, split_text
+
+
+def fake_create(calls):
+    def create(model, messages, **params):
+        prompt, text = messages[0]["content"], messages[1]["content"]
+        calls.append((prompt, text))
+        content = f"{prompt}({text.strip()})"
+        return convert_to_openai_object(
+            {"choices": [{"message": {"role": "assistant", "content": content}}]}
+        )
+
+    return create
+
+
+def test_split_text_at_paragraphs(count_words, default_model_for_tests):
+    text = "one two three\n\nfour five\n\nsix seven eight nine"
+    chunks = split_text(text, max_tokens=5, model=default_model_for_tests)
+    assert chunks == ["one two three\n\nfour five\n\n", "six seven eight nine"]
+
+
+def test_split_text_falls_back_to_finer_boundaries(
+    count_words, default_model_for_tests
+):
+    text = "One two three. Four five six.\nSeven"
+    chunks = split_text(text, max_tokens=3, model=default_model_for_tests)
+    assert chunks == ["One two three. ", "Four five six.\n", "Seven"]
+    assert "".join(chunks) == text
+
+
+def test_run_reduces_hierarchically(count_words, default_model_for_tests):
+    calls = []
+    map_reduce = MapReduce(
+        model=default_model_for_tests,
+        map_prompt="m",
+        reduce_prompt="r",
+        chunk_tokens=1,
+        concurrency=2,
+        create_completion=fake_create(calls),
+    )
+    answer = map_reduce.run(["a\n\nb\n\nc"])
+
+    assert [text for prompt, text in calls if prompt == "m"] == ["a\n\n", "b\n\n", "c"]
+    assert answer.startswith("r(")
+    for chunk in ("m(a)", "m(b)", "m(c)"):
+        assert chunk in answer
+
+
+def test_checkpoint_resumes(count_words, default_model_for_tests):
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, "checkpoint.json")
+        first_calls, second_calls = [], []
+        for calls in (first_calls, second_calls):
+            map_reduce = MapReduce(
+                model=default_model_for_tests,
+                map_prompt="m",
+                reduce_prompt="r",
+                chunk_tokens=100,
+                checkpoint=Checkpoint(filepath),
+                create_completion=fake_create(calls),
+            )
+            answer = map_reduce.run(["some text"])
+
+    assert answer == "r(m(some text))"
+    assert len(first_calls) == 2
+    assert second_calls == []
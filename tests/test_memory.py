@@ -0,0 +1,155 @@
+"""Memory budgets for long sessions.
+
+Everything runs offline: completions come from a fake streaming source and
+tokens are counted per word. Budgets are in bytes and measured with
+tracemalloc, so they do not depend on the allocator or the machine.
+"""
+
+import contextlib
+import gc
+import io
+import re
+import sys
+import tracemalloc
+
+import pytest
+import typer
+from openai.util import convert_to_openai_object
+
+from gpt_cli.chat import Chat
+from gpt_cli.context import Context
+from gpt_cli.key import OpenaiApiKey
+from gpt_cli.message import Message
+from gpt_cli.role import Role
+
+pytestmark = pytest.mark.memory
+
+N_TURNS = 10_000
+# Bytes a message may take on top of its content
+MESSAGE_OVERHEAD_BUDGET = 1_024
+# Bytes a message may take once it is spilled to disk
+SPILLED_MESSAGE_BUDGET = 256
+
+
+@contextlib.contextmanager
+def traced_memory():
+    "Yield a dict that gets the net and peak allocations of the block."
+    gc.collect()
+    tracemalloc.start()
+    result = {}
+    try:
+        yield result
+    finally:
+        gc.collect()
+        result["current"], result["peak"] = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+
+def fake_stream(reply: str):
+    def create(**params):
+        return (
+            convert_to_openai_object({"choices": [{"delta": {"content": word}}]})
+            for word in re.findall(r"\S+\s*", reply)
+        )
+
+    return create
+
+
+def fill_context(context: Context, model, n_turns: int) -> int:
+    "Add `n_turns` user/assistant pairs and return the size of their contents."
+    content_bytes = 0
+    for i in range(n_turns):
+        for role, content in (
+            (Role.user, f"Question number {i}: what is the answer?"),
+            (Role.assistant, f"Answer number {i}: it is {i * 7 % 13}."),
+        ):
+            context.add_message(Message(content=content, role=role, model=model))
+            content_bytes += sys.getsizeof(content)
+    return content_bytes
+
+
+def test_per_message_memory(count_words, default_model_for_tests):
+    context = Context(model=default_model_for_tests)
+    with traced_memory() as memory:
+        content_bytes = fill_context(context, default_model_for_tests, N_TURNS)
+
+    overhead = (memory["current"] - content_bytes) / len(context.messages)
+    assert overhead <= MESSAGE_OVERHEAD_BUDGET
+
+
+def test_get_messages_steady_state(count_words, default_model_for_tests):
+    context = Context(model=default_model_for_tests)
+    context.set_system("You are a helpful assistant.")
+    fill_context(context, default_model_for_tests, N_TURNS)
+    context.get_messages(max_context_tokens=4_096)  # warm up
+
+    with traced_memory() as memory:
+        for _ in range(100):
+            context.get_messages(max_context_tokens=4_096)
+
+    # Building requests must not leave anything behind
+    assert memory["current"] <= 16 * 1024
+
+
+def test_chat_loop_steady_state(count_words, default_model_for_tests):
+    n_turns = 20
+    reply = " ".join(f"word{i}" for i in range(200))
+    chat = Chat(
+        api_key=OpenaiApiKey("sk-test"),
+        model=default_model_for_tests,
+        create_completion=fake_stream(reply),
+    )
+    chat.max_context_tokens = 4_096
+
+    def run(n: int):
+        inputs = iter([f"Question {i}" for i in range(n)])
+
+        def ask_for_input():
+            try:
+                return next(inputs)
+            except StopIteration:
+                raise typer.Exit()
+
+        chat.ask_for_input = ask_for_input
+        with contextlib.redirect_stdout(io.StringIO()):
+            with pytest.raises(typer.Exit):
+                chat.start()
+
+    run(2)  # warm up Rich and the stream path
+    n_messages = len(chat.context.messages)
+    with traced_memory() as memory:
+        run(n_turns)
+
+    # Only the conversation itself may grow: no Live buffers or stream chunks
+    n_new_messages = len(chat.context.messages) - n_messages
+    content_bytes = n_new_messages * sys.getsizeof(reply)
+    budget = content_bytes + n_new_messages * MESSAGE_OVERHEAD_BUDGET
+    assert memory["current"] <= budget
+
+
+def test_streaming_peak(default_model_for_tests):
+    reply = " ".join(f"word{i}" for i in range(500))
+    chat = Chat(
+        api_key=OpenaiApiKey("sk-test"),
+        model=default_model_for_tests,
+        create_completion=fake_stream(reply),
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        chat._stream_replies(messages=[])[0]  # warm up
+
+        with traced_memory() as memory:
+            assert chat._stream_replies(messages=[])[0] == reply
+
+    # Chunks and rendering may need a few copies of the reply, not one per chunk
+    assert memory["peak"] <= 64 * len(reply)
+    assert memory["current"] <= 16 * 1024
+
+
+def test_spilled_messages_memory(count_words, default_model_for_tests):
+    context = Context(model=default_model_for_tests, keep_tokens=4_096)
+    fill_context(context, default_model_for_tests, 100)  # opens the spill file
+    with traced_memory() as memory:
+        fill_context(context, default_model_for_tests, N_TURNS)
+
+    # Spilled messages only leave their node and token counts behind
+    assert memory["current"] / (2 * N_TURNS) <= SPILLED_MESSAGE_BUDGET
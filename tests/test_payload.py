@@ -0,0 +1,39 @@
+import json
+
+from gpt_cli import payload
+from gpt_cli.context import Context
+from gpt_cli.message import Message
+from gpt_cli.role import Role
+
+
+def test_encode_request_matches_json():
+    params = {
+        "model": "gpt-4.1-nano",
+        "messages": [
+            payload.RequestMessage("system", "Be brief."),
+            {"role": "user", "content": 'Привет, "world"\n'},
+        ],
+        "stream": True,
+    }
+    assert json.loads(payload.encode_request(params)) == params
+    assert json.loads(payload.encode_request({"messages": []})) == {"messages": []}
+
+
+def test_fragments_are_cached(count_words, default_model_for_tests):
+    model = default_model_for_tests
+    context = Context(model=model)
+    context.set_system("Be brief.")
+    context.add_message(Message(content="Hi", role=Role.user, model=model))
+
+    first = context.get_messages(max_context_tokens=0)
+    second = context.get_messages(max_context_tokens=0)
+    assert first == [{"role": "system", "content": "Be brief."}]
+    assert first[0] is second[0]
+    assert first[0].json is second[0].json
+
+    # A new system message gets a new fragment
+    context.set_system("Be verbose.")
+    assert json.loads(context.get_messages(max_context_tokens=0)[0].json) == {
+        "role": "system",
+        "content": "Be verbose.",
+    }
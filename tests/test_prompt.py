@@ -0,0 +1,73 @@
+import threading
+
+from gpt_cli import tokens
+from gpt_cli.model import ModelName
+from gpt_cli.prompt import TokenMeter
+from gpt_cli.tokens import IncrementalTokenCounter
+
+
+def test_incremental_counter_encodes_only_edited_lines(monkeypatch):
+    encoded = []
+
+    def count(text, model):
+        encoded.append(text)
+        return len(text.split())
+
+    monkeypatch.setattr(tokens, "count_tokens", count)
+    counter = IncrementalTokenCounter(ModelName.gpt_4o_mini)
+    draft = "".join(f"line number {i}\n" for i in range(100))
+    assert counter.count(draft) == 300
+    assert len(encoded) == 100
+
+    encoded.clear()
+    assert counter.count(draft + "one more") == 302
+    assert encoded == ["one more"]
+
+
+def test_token_meter_counts_off_the_calling_thread(count_words):
+    meter = TokenMeter()
+    updated = threading.Event()
+    counting_threads = set()
+
+    def context_tokens():
+        counting_threads.add(threading.current_thread())
+        return 90
+
+    meter.on_update = updated.set
+    meter.reset(ModelName.gpt_4o_mini, context_tokens, max_context_tokens=100)
+    assert updated.wait(timeout=5)
+
+    # The meter keeps the latest draft only
+    for i in range(1, 12):
+        updated.clear()
+        meter.update(" ".join(["word"] * i))
+    assert updated.wait(timeout=5)
+    while meter.draft_tokens != 11:
+        updated.clear()
+        assert updated.wait(timeout=5)
+
+    assert counting_threads and threading.current_thread() not in counting_threads
+    assert "Over by 1" in meter.toolbar().value
+
+
+def test_token_meter_survives_failed_counts(count_words):
+    meter = TokenMeter()
+    updated = threading.Event()
+    meter.on_update = updated.set
+    failing = [True]
+
+    def context_tokens():
+        if failing[0]:
+            raise ConnectionRefusedError("daemon is gone")
+        return 10
+
+    meter.reset(ModelName.gpt_4o_mini, context_tokens, max_context_tokens=100)
+    assert updated.wait(timeout=5)
+    assert "unavailable: daemon is gone" in meter.toolbar().value
+
+    # The thread is still there and counts again with the next edit
+    failing[0] = False
+    updated.clear()
+    meter.update("two words")
+    assert updated.wait(timeout=5)
+    assert meter.toolbar().value.endswith("Left: 88")
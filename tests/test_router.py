@@ -0,0 +1,77 @@
+import os
+import tempfile
+
+import pytest
+import yaml
+
+from gpt_cli.model import ModelName
+from gpt_cli.router import LatencyHistory, ModelRouter, RoutingRule
+
+RULES = [
+    RoutingRule(
+        max_prompt_tokens=1_000,
+        models=[ModelName.gpt_4_1_nano, ModelName.gpt_4o_mini],
+    ),
+    RoutingRule(models=[ModelName.gpt_4o, ModelName.gpt_4_1]),
+]
+
+
+@pytest.fixture
+def latency_filepath():
+    with tempfile.TemporaryDirectory() as dirpath:
+        yield os.path.join(dirpath, "model_latency.json")
+
+
+def test_route_by_prompt_size():
+    router = ModelRouter(rules=RULES)
+    decision = router.route(prompt_tokens=100)
+    assert decision.model.name == ModelName.gpt_4_1_nano
+    assert "no latency history" in str(decision)
+
+    assert router.route(prompt_tokens=5_000).model.name == ModelName.gpt_4o
+    # gpt-4o's window is too small, so the next model of the rule is used
+    assert router.route(prompt_tokens=500_000).model.name == ModelName.gpt_4_1
+    # Nothing fits: fall back to the largest window
+    decision = router.route(prompt_tokens=5_000_000)
+    assert decision.model.max_context_tokens == 1_047_576
+    assert "no rule matches" in decision.reason
+
+
+def test_route_keeps_room_for_the_output():
+    router = ModelRouter(rules=RULES)
+    # gpt-4o has a window of 128,000 tokens and reserves 16,384 for the output
+    assert router.route(prompt_tokens=111_616).model.name == ModelName.gpt_4o
+    assert router.route(prompt_tokens=111_617).model.name == ModelName.gpt_4_1
+    # A smaller output limit leaves more room for the prompt
+    decision = router.route(prompt_tokens=120_000, max_output_tokens=1_000)
+    assert decision.model.name == ModelName.gpt_4o
+
+
+def test_route_to_the_fastest_model(latency_filepath):
+    history = LatencyHistory(latency_filepath)
+    router = ModelRouter(rules=RULES, history=history)
+    router.observe(router.route(100).model, ttft=2.0, n_tokens=100, stream_seconds=2)
+    history.observe(ModelName.gpt_4o_mini, ttft=0.3, tokens_per_second=100)
+    assert router.route(prompt_tokens=100).model.name == ModelName.gpt_4o_mini
+
+    # The history survives between sessions
+    history = LatencyHistory(latency_filepath)
+    assert history.models[ModelName.gpt_4_1_nano.value].tokens_per_second == 50
+    assert ModelName.gpt_4o_mini.value not in history.models  # not saved yet
+
+
+def test_moving_average():
+    history = LatencyHistory(filepath=None)
+    history.observe(ModelName.gpt_4o, ttft=1.0, tokens_per_second=100)
+    history.observe(ModelName.gpt_4o, ttft=2.0, tokens_per_second=200)
+    latency = history.models[ModelName.gpt_4o.value]
+    assert latency.ttft == pytest.approx(1.3)
+    assert latency.tokens_per_second == pytest.approx(130)
+    assert latency.n_observations == 2
+
+
+def test_load_rules(latency_filepath):
+    with open(latency_filepath, "w") as file:
+        yaml.safe_dump([{"models": ["gpt-5-nano"], "max_prompt_tokens": 10}], file)
+    rules = ModelRouter.load_rules(latency_filepath)
+    assert rules == [RoutingRule(models=[ModelName.gpt_5_nano], max_prompt_tokens=10)]
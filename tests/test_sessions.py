@@ -0,0 +1,113 @@
+import threading
+import time
+
+import yaml
+from openai.error import APIConnectionError, RateLimitError
+from openai.util import convert_to_openai_object
+
+from gpt_cli.chat import Chat
+from gpt_cli.model import ModelName
+from gpt_cli.router import LatencyHistory, ModelRouter, RoutingRule
+from gpt_cli.sessions import SessionManager
+
+
+def reply_with(content, wait_for=None):
+    def create(**params):
+        if wait_for is not None:
+            assert wait_for.wait(timeout=5)
+        yield convert_to_openai_object({"choices": [{"delta": {"content": content}}]})
+
+    return create
+
+
+def type_in(manager, user_input):
+    manager.current.chat.ask_for_input = lambda **kwargs: user_input
+    manager._turn()
+
+
+def test_sessions_run_concurrently(
+    count_words, tmp_path, default_model_for_tests, make_chat
+):
+    model = default_model_for_tests
+    release = threading.Event()
+    main_out, other_out = str(tmp_path / "main.yaml"), str(tmp_path / "other.yaml")
+    manager = SessionManager(
+        make_chat(model, reply_with("Slow answer", wait_for=release), out=main_out),
+        new_chat=lambda out: make_chat(model, reply_with("Fast answer"), out=out),
+    )
+    main = manager.current
+
+    type_in(manager, "Slow question")
+    assert main.busy
+    type_in(manager, "Another question")  # refused while the reply is pending
+    assert main.chat.context.n_messages == 1
+
+    type_in(manager, f"/new other {other_out}")
+    other = manager.current
+    assert other.name == "other"
+    type_in(manager, "Fast question")
+    other.future.result(timeout=5)
+    # Answered while the first session is still waiting
+    assert main.busy
+    assert other.chat.context.last_message.content == "Fast answer"
+
+    release.set()
+    main.future.result(timeout=5)
+    assert main.unread == "Slow answer"
+    assert "●" in manager.status().value
+
+    type_in(manager, "/session main")
+    assert manager.current is main and main.unread is None
+
+    # Every session keeps its own output file
+    for path, answer in ((main_out, "Slow answer"), (other_out, "Fast answer")):
+        assert yaml.safe_load(open(path))[-1]["content"] == answer
+    manager._shut_down()
+
+
+def test_failed_reply_is_reported(
+    count_words, default_model_for_tests, monkeypatch, make_chat
+):
+    monkeypatch.setattr(Chat, "RETRY_SLEEP", 0)
+
+    def create(**params):
+        raise APIConnectionError("No connection.")
+
+    manager = SessionManager(
+        make_chat(default_model_for_tests, create), new_chat=lambda out: None
+    )
+    type_in(manager, "Question")
+    manager.current.future.result(timeout=5)
+    assert manager.current.status == "failed"
+    manager._shut_down()
+
+
+def test_reply_is_retried_and_observed(
+    count_words, default_model_for_tests, monkeypatch, make_chat
+):
+    monkeypatch.setattr(Chat, "RETRY_SLEEP", 0)
+    errors = [RateLimitError("Slow down"), APIConnectionError("No connection.")]
+
+    def create(**params):
+        if errors:
+            raise errors.pop(0)
+        for content in ("Fine", " thanks"):
+            time.sleep(0.01)
+            yield convert_to_openai_object(
+                {"choices": [{"delta": {"content": content}}]}
+            )
+
+    router = ModelRouter(
+        rules=[RoutingRule(models=[ModelName.gpt_4_1_nano])],
+        history=LatencyHistory(filepath=None),
+    )
+    chat = make_chat(router.largest_model, create)
+    chat.router = router
+    manager = SessionManager(chat, new_chat=lambda out: None)
+    type_in(manager, "Question")
+    manager.current.future.result(timeout=5)
+    assert manager.current.status != "failed"
+    assert chat.context.last_message.content == "Fine thanks"
+    # Background replies feed `--model auto` too
+    assert ModelName.gpt_4_1_nano.value in router.history.models
+    manager._shut_down()
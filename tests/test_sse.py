@@ -0,0 +1,58 @@
+import json
+
+import pytest
+from openai.error import APIError
+
+from gpt_cli import sse
+
+EVENTS = [
+    {"choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}}]},
+    {"choices": [{"index": 0, "delta": {"content": "Hello"}}]},
+    {"choices": [{"index": 0, "delta": {"content": ", wörld"}}]},
+    {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+    {"choices": [], "usage": {"completion_tokens": 3}},
+]
+
+
+def encode(events):
+    body = ": keep-alive\n\n"
+    body += "".join(
+        f"data: {json.dumps(e, ensure_ascii=False)}\r\n\r\n" for e in events
+    )
+    return (body + "data: [DONE]\n\n").encode()
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 64, 10_000])
+def test_chunks_split_anywhere(block_size):
+    body = encode(EVENTS)
+    blocks = [body[i : i + block_size] for i in range(0, len(body), block_size)]
+    chunks = list(sse.iter_chunks(blocks))
+
+    assert [c.choices for c in chunks] == [e["choices"] for e in EVENTS]
+    assert (
+        "".join(
+            choice["delta"].get("content", "") for c in chunks for choice in c.choices
+        )
+        == "Hello, wörld"
+    )
+    assert chunks[3].choices[0]["finish_reason"] == "stop"
+    assert chunks[-1].get("usage") == {"completion_tokens": 3}
+    assert chunks[0].get("usage") is None
+
+
+def test_nothing_after_done():
+    body = encode(EVENTS[:1]) + encode(EVENTS[1:2])
+    assert len(list(sse.iter_chunks([body]))) == 1
+
+
+def test_last_line_without_line_break():
+    body = f"data: {json.dumps(EVENTS[1])}".encode()
+    assert len(list(sse.iter_chunks([body]))) == 1
+
+
+def test_error_event():
+    body = encode([EVENTS[1], {"error": {"message": "Boom"}}])
+    chunks = sse.iter_chunks([body])
+    next(chunks)
+    with pytest.raises(APIError):
+        next(chunks)
@@ -0,0 +1,68 @@
+import pytest
+
+from gpt_cli.stops import (
+    CodeFenceStop,
+    JsonObjectStop,
+    MaxLinesStop,
+    RegexStop,
+    parse_stop_condition,
+)
+
+
+def feed_all(condition, chunks):
+    "Return the reply cut where the condition matched, or None."
+    text = ""
+    for chunk in chunks:
+        cut = condition.feed(chunk)
+        text += chunk
+        if cut is not None:
+            return text[:cut]
+    return None
+
+
+def test_regex_across_chunks():
+    assert (
+        feed_all(RegexStop(r"END\d"), ["Some text E", "ND", "7 more"]) == "Some text "
+    )
+    assert feed_all(RegexStop(r"^Q:"), ["A: yes\n", "Q", ": next"]) == "A: yes\n"
+    assert feed_all(RegexStop(r"never"), ["a", "b"]) is None
+
+
+def test_regex_anchor_at_window_start():
+    stop = RegexStop(r"^Q:")
+    stop.LOOKBACK = 1
+    # The window starts in the middle of a line, which is not a line start
+    assert feed_all(stop, ["A: xQ", ":", " no\n"]) is None
+    stop = RegexStop(r"^Q:")
+    stop.LOOKBACK = 1
+    assert feed_all(stop, ["A: yes\n", "Q", ":"]) == "A: yes\n"
+
+
+def test_code_fence():
+    chunks = ["Here:\n``", "`python\nprint(1)\n", "``", "`\nAnd more text"]
+    assert feed_all(CodeFenceStop(), chunks) == "Here:\n```python\nprint(1)\n```"
+    assert feed_all(CodeFenceStop(), ["no code\n", "at all"]) is None
+
+
+def test_json_object():
+    chunks = ['Result: {"a": "}{", ', '"b": {"c": "\\"}"}', "} trailing"]
+    assert (
+        feed_all(JsonObjectStop(), chunks) == 'Result: {"a": "}{", "b": {"c": "\\"}"}}'
+    )
+
+
+def test_max_lines():
+    assert feed_all(MaxLinesStop(2), ["one\ntw", "o\nthree\n"]) == "one\ntwo"
+    with pytest.raises(ValueError):
+        MaxLinesStop(0)
+
+
+@pytest.mark.parametrize("spec", ["regex:a+", "fence", "json", "lines:3"])
+def test_parse(spec):
+    assert parse_stop_condition(spec).feed("") is None
+
+
+@pytest.mark.parametrize("spec", ["regex:", "regex:(", "fence:1", "lines:x", "other"])
+def test_parse_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_stop_condition(spec)
@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from gpt_cli.timeouts import StreamTimeout, with_timeouts
+
+
+def slow_stream(delays):
+    for i, delay in enumerate(delays):
+        time.sleep(delay)
+        yield i
+
+
+def test_passes_chunks_and_errors_through():
+    assert list(with_timeouts(iter(range(100)), 1, 1)) == list(range(100))
+
+    def failing():
+        yield 1
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        list(with_timeouts(failing(), 1, 1))
+
+
+def test_first_chunk_timeout():
+    with pytest.raises(StreamTimeout, match="first token"):
+        list(with_timeouts(slow_stream([0.5]), first_chunk_timeout=0.05))
+    # Only the first chunk may take long
+    assert list(with_timeouts(slow_stream([0.2, 0]), 1, 0.1)) == [0, 1]
+
+
+def test_chunk_timeout():
+    received = []
+    with pytest.raises(StreamTimeout, match="next chunk"):
+        for chunk in with_timeouts(slow_stream([0, 0, 0.5]), 1, chunk_timeout=0.05):
+            received.append(chunk)
+    assert received == [0, 1]
+
+
+def test_reader_stops_when_closed():
+    closed = threading.Event()
+
+    def endless():
+        try:
+            while True:
+                yield 0
+        finally:
+            closed.set()
+
+    stream = with_timeouts(endless(), 1, 1)
+    next(stream)
+    stream.close()
+    assert closed.wait(timeout=5)
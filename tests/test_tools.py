@@ -0,0 +1,118 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from gpt_cli.tools import Tool, ToolRegistry, add_tool_call_deltas, ordered_calls
+
+
+def call(name, call_id="call_1", **arguments):
+    return {
+        "id": call_id,
+        "type": "function",
+        "function": {"name": name, "arguments": json.dumps(arguments)},
+    }
+
+
+@pytest.fixture
+def registry(tmp_path):
+    (tmp_path / "notes.txt").write_text("one\ntwo\nthree\n")
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "app.py").write_text("def main():\n    return 'two'\n")
+    return ToolRegistry(root=str(tmp_path), commands=["ls"], max_output_chars=100)
+
+
+def test_read_and_grep(registry):
+    results = registry.run(
+        [
+            call("read_file", "a", path="notes.txt", start_line=2, max_lines=1),
+            call("grep", "b", pattern="two"),
+            call("read_file", "c", path="../outside.txt"),
+            call("grep", "d", pattern="("),
+            call("read_file", "e", path="a\0b"),
+            call("grep", "f", pattern="x", path="a\0b"),
+        ]
+    )
+    assert [r.call_id for r in results] == ["a", "b", "c", "d", "e", "f"]
+    assert results[0].output == "two\n"
+    assert results[1].output == "notes.txt:2: two\nsrc/app.py:2:     return 'two'"
+    assert results[2].status == "error" and "outside" in results[2].output
+    assert results[3].status == "error"
+    # Invalid arguments are reported to the model, not raised
+    assert results[4].status == results[5].status == "error"
+    assert "null byte" in results[4].output
+
+
+def test_run_command_allow_list(registry):
+    allowed, denied = registry.run(
+        [
+            call("run_command", "a", command="ls src"),
+            call("run_command", "b", command=f"{sys.executable} -c 'print(1)'"),
+        ]
+    )
+    assert allowed.output == "app.py\n"
+    assert denied.status == "error" and "not allowed" in denied.output
+    assert "run_command" not in ToolRegistry().tools
+
+
+def test_calls_run_in_parallel_with_timeout_and_cap(registry):
+    def sleep(seconds: float) -> str:
+        time.sleep(seconds)
+        return "x" * 500
+
+    registry.register(Tool("sleep", "Sleep.", {"type": "object"}, sleep))
+    registry.timeout = 0.5
+    start = time.monotonic()
+    results = registry.run(
+        [call("sleep", str(i), seconds=0.2) for i in range(4)]
+        + [call("sleep", "slow", seconds=2)]
+    )
+    assert time.monotonic() - start < 1
+    assert [r.status for r in results] == ["ok"] * 4 + ["timeout"]
+    assert results[0].output.endswith("[output truncated: 400 more characters]")
+
+
+def test_add_tool_call_deltas():
+    calls = {}
+    add_tool_call_deltas(
+        calls,
+        [
+            {"index": 1, "id": "b", "function": {"name": "grep", "arguments": ""}},
+            {"index": 0, "id": "a", "function": {"name": "read_file"}},
+        ],
+    )
+    add_tool_call_deltas(calls, [{"index": 0, "function": {"arguments": '{"pa'}}])
+    add_tool_call_deltas(calls, [{"index": 0, "function": {"arguments": 'th": 1}'}}])
+    assert [c["id"] for c in ordered_calls(calls)] == ["a", "b"]
+    assert calls[0]["function"] == {"name": "read_file", "arguments": '{"path": 1}'}
+
+
+def test_tools_skip_special_files_and_stop_on_time(registry, tmp_path):
+    os.mkfifo(tmp_path / "pipe")
+    (tmp_path / "big.txt").write_text("no match\n" * 200_000)
+    (fifo,) = registry.run([call("read_file", "a", path="pipe")])
+    assert fifo.status == "error" and "not a regular file" in fifo.output
+
+    # Stops inside the big file, and does not block on the FIFO
+    registry.timeout = 0.01
+    start = time.monotonic()
+    assert registry.grep("yes") == "[search stopped: timed out]"
+    assert time.monotonic() - start < 1
+
+
+def test_grep_does_not_follow_links_out_of_the_root(registry, tmp_path_factory):
+    outside = tmp_path_factory.mktemp("outside") / "secret.txt"
+    outside.write_text("SECRET=hunter2\n")
+    os.symlink(outside, os.path.join(registry.root, "link.txt"))
+    os.symlink(outside.parent, os.path.join(registry.root, "linked_dir"))
+    read, grep, grep_dir = registry.run(
+        [
+            call("read_file", "a", path="link.txt"),
+            call("grep", "b", pattern="SECRET"),
+            call("grep", "c", pattern="SECRET", path="linked_dir"),
+        ]
+    )
+    assert read.status == grep_dir.status == "error"
+    assert grep.output == "No matches."
@@ -0,0 +1,66 @@
+import json
+import pstats
+import tempfile
+
+from gpt_cli import trace
+
+
+def test_span_is_noop_without_subscribers():
+    assert not trace.enabled()
+    assert trace.span("noop") is trace.span("other")
+
+
+def test_subscribe_receives_events():
+    events = []
+    unsubscribe = trace.subscribe(events.append)
+    try:
+        with trace.span("outer", turn=1) as s:
+            s.set(n_messages=3)
+            with trace.span("inner"):
+                pass
+    finally:
+        unsubscribe()
+
+    assert [e.name for e in events] == ["inner", "outer"]
+    assert events[1].attrs == {"turn": 1, "n_messages": 3}
+    assert events[1].duration_s >= events[0].duration_s >= 0
+    assert not trace.enabled()
+
+
+def test_traced_decorator():
+    @trace.traced("square")
+    def square(x):
+        return x * x
+
+    assert square(3) == 9
+
+    events = []
+    unsubscribe = trace.subscribe(events.append)
+    try:
+        assert square(4) == 16
+    finally:
+        unsubscribe()
+    assert [e.name for e in events] == ["square"]
+
+
+def test_profile_chrome_trace():
+    with tempfile.NamedTemporaryFile(suffix=".json") as f:
+        with trace.profile(f.name):
+            with trace.span("phase", model="gpt-4.1-nano"):
+                pass
+        data = json.load(open(f.name))
+
+    (event,) = data["traceEvents"]
+    assert event["name"] == "phase"
+    assert event["ph"] == "X"
+    assert event["args"] == {"model": "gpt-4.1-nano"}
+    assert not trace.enabled()
+
+
+def test_profile_cprofile_dump():
+    with tempfile.NamedTemporaryFile(suffix=".prof") as f:
+        with trace.profile(f.name):
+            sum(range(1000))
+        stats = pstats.Stats(f.name)
+
+    assert stats.total_calls > 0
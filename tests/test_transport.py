@@ -0,0 +1,98 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from openai.error import RateLimitError
+
+from gpt_cli import transport
+from gpt_cli.payload import RequestMessage
+
+MESSAGES = [RequestMessage("user", "Hello!")]
+
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        Handler.requests.append((self.path, self.headers, body))
+        if body["model"] == "busy":
+            self._send(429, "application/json", {"error": {"message": "Slow down"}})
+        elif body.get("stream"):
+            lines = [
+                {"choices": [{"index": 0, "delta": {"content": word}}]}
+                for word in ("Hi", " there")
+            ]
+            data = "".join(f"data: {json.dumps(line)}\n\n" for line in lines)
+            self._send(200, "text/event-stream", data + "data: [DONE]\n\n")
+        else:
+            message = {"role": "assistant", "content": "Hi there"}
+            self._send(200, "application/json", {"choices": [{"message": message}]})
+
+    def _send(self, status, content_type, data):
+        encoded = data if isinstance(data, str) else json.dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.end_headers()
+        self.wfile.write(encoded.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def api_base():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+
+
+def test_completion(api_base):
+    completion = transport.create_completion(
+        api_key="sk-test", api_base=api_base, model="gpt-4.1-nano", messages=MESSAGES
+    )
+    assert completion.choices[0].message["content"] == "Hi there"
+
+    path, headers, body = Handler.requests[-1]
+    assert path == "/v1/chat/completions"
+    assert headers["Authorization"] == "Bearer sk-test"
+    assert headers["Content-Type"] == "application/json"
+    assert body == {
+        "messages": [{"role": "user", "content": "Hello!"}],
+        "model": "gpt-4.1-nano",
+    }
+
+
+def test_stream(api_base):
+    stream = transport.create_completion(
+        api_key="sk-test",
+        api_base=api_base,
+        model="gpt-4.1-nano",
+        messages=MESSAGES,
+        stream=True,
+    )
+    assert [chunk.choices[0].delta.content for chunk in stream] == ["Hi", " there"]
+
+
+def test_lean_stream(api_base):
+    stream = transport.create_completion(
+        api_key="sk-test",
+        api_base=api_base,
+        model="gpt-4.1-nano",
+        messages=MESSAGES,
+        stream=True,
+        lean_stream=True,
+    )
+    assert [chunk.choices[0]["delta"]["content"] for chunk in stream] == [
+        "Hi",
+        " there",
+    ]
+
+
+def test_errors_are_interpreted(api_base):
+    with pytest.raises(RateLimitError):
+        transport.create_completion(
+            api_key="sk-test", api_base=api_base, model="busy", messages=MESSAGES
+        )